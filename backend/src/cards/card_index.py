@@ -0,0 +1,85 @@
+"""card_index.py is a file in cards folder that maintains the card_hash index, which maps a card's content to its card ID so a card can be found with one keyed read.
+
+Entries are ``card_hash/<hash>/<deck>``, so identical cards in different decks never share an
+entry, and the decks holding a card are found without knowing any of them. Identical cards
+within one deck do share one, and the entry points at the last one written."""
+
+import hashlib
+import json
+
+try:
+    from ..deck.progress import progress_path
+except ImportError:
+    from deck.progress import progress_path
+
+
+class AmbiguousCard(Exception):
+    """Raised when a card's content is indexed in several decks and none can be chosen."""
+
+
+def card_hash(front, back, hint):
+    """Return the index key for a card with the given front, back and hint."""
+    content = json.dumps([front, back, hint], ensure_ascii=False)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def index_path(card):
+    """Return the database path of the card_hash entry for a card dict."""
+    return f"card_hash/{card_hash(card.get('front'), card.get('back'), card.get('hint'))}/{card.get('deckId')}"
+
+
+def unindex_updates(db, card_id, card):
+    """Return the update that removes a deleted card's card_hash entry, unless the entry belongs to a twin card."""
+    path = index_path(card)
+    return {path: None} if db.child(path).get().val() == card_id else {}
+
+
+def lookup_card(db, front, back, hint, deck_id=None, user_id=None):
+    """Find (card ID, deck ID) of the card with this front, back and hint, or (None, None).
+
+    With ``deck_id`` the card's entry in that deck is read; without it every deck's entry for
+    the content is read at once. When the content is in several decks, the one where
+    ``user_id`` has progress on the card is chosen, and AmbiguousCard is raised if that is not
+    exactly one. Only cards written before the index existed fall back to the front query:
+    cards in ``deck_id`` match when it is given, and otherwise a card owned by ``user_id`` is
+    preferred. The index entry is then written so the next lookup is direct."""
+    key = card_hash(front, back, hint)
+    if deck_id:
+        card_id = db.child("card_hash").child(key).child(deck_id).get().val()
+        if card_id:
+            return card_id, deck_id
+    else:
+        entries = db.child("card_hash").child(key).get().val()
+        # An entry of the unscoped index (``card_hash/<hash>``) names no deck, so it is not used
+        if isinstance(entries, dict) and entries:
+            return _choose_deck(db, entries, user_id)
+
+    query_result = db.child("card").order_by_child("front").equal_to(front).get()
+    matches = [
+        (card.key(), card.val())
+        for card in query_result.each() or []
+        if card.val().get("back") == back
+        and card.val().get("hint") == hint
+        and (not deck_id or card.val().get("deckId") == deck_id)
+    ]
+    if not matches:
+        return None, None
+    card_id, card = next((match for match in matches if match[1].get("userId") == user_id), matches[0])
+    if card.get("deckId"):
+        db.child(index_path(card)).set(card_id)
+    return card_id, card.get("deckId")
+
+
+def _choose_deck(db, entries, user_id):
+    """Return (card ID, deck ID) of the one entry in ``entries`` ({deck: card}) the user has studied"""
+    if len(entries) == 1:
+        ((deck_id, card_id),) = entries.items()
+        return card_id, deck_id
+    studied = [
+        (card_id, deck_id)
+        for deck_id, card_id in entries.items()
+        if user_id and db.child(progress_path(user_id, deck_id, card_id)).shallow().get().val()
+    ]
+    if len(studied) != 1:
+        raise AmbiguousCard(f"The card is in {len(entries)} decks; send its cardId or deckId")
+    return studied[0]
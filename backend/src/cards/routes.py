@@ -29,8 +29,14 @@ from flask_cors import cross_origin
 
 try:
     from .. import firebase
+    from ..common.firebase_ops import increment
+    from ..common.response_cache import cards_key, deck_key, deck_list_key, response_cache
+    from .card_index import index_path, unindex_updates
 except ImportError:
     from __init__ import firebase
+    from common.firebase_ops import increment
+    from common.response_cache import cards_key, deck_key, deck_list_key, response_cache
+    from cards.card_index import index_path, unindex_updates
 
 card_bp = Blueprint("card_bp", __name__)
 
@@ -42,13 +48,22 @@ db = firebase.database()
 def getcards(deckId):
     """This method is called when the user want to fetch all of the cards in a deck. Only the deckid is required to fetch all cards from the required deck."""
     try:
-        user_cards = db.child("card").order_by_child("deckId").equal_to(deckId).get()
-        cards = [card.val() for card in user_cards.each()]
+        cards = response_cache.get(cards_key(deckId), lambda db: _list_cards(db, deckId), db)
         return jsonify(cards=cards, message="Fetching cards successfully", status=200), 200
     except Exception as e:
         return jsonify(cards=[], message=f"An error occurred {e}", status=400), 400
 
 
+def _list_cards(db, deckId):
+    user_cards = db.child("card").order_by_child("deckId").equal_to(deckId).get()
+    return [card.val() for card in user_cards.each() or []]
+
+
+def _invalidate_cards(deckId, owner):
+    """Drop a deck's cards, and the deck and deck lists showing its card count, from the response cache"""
+    response_cache.invalidate(cards_key(deckId), deck_key(deckId), deck_list_key(owner), deck_list_key())
+
+
 @card_bp.route("/deck/<deckId>/card/create", methods=["POST"])
 @cross_origin(supports_credentials=True)
 def createcards(deckId):
@@ -61,20 +76,28 @@ def createcards(deckId):
 
         """remove existing cards"""
         previous_cards = db.child("card").order_by_child("deckId").equal_to(deckId).get()
-        for card in previous_cards.each():
+        updates = {}
+        for card in previous_cards.each() or []:
             db.child("card").child(card.key()).remove()
+            updates[index_path(card.val())] = None
 
         """add new cards"""
         for card in cards:
-            db.child("card").push(
-                {
-                    "userId": localId,
-                    "deckId": deckId,
-                    "front": card["front"],
-                    "back": card["back"],
-                    "hint": card["hint"],
-                }
-            )
+            new_card = {
+                "userId": localId,
+                "deckId": deckId,
+                "front": card["front"],
+                "back": card["back"],
+                "hint": card["hint"],
+            }
+            card_ref = db.child("card").push(new_card)
+            updates[index_path(new_card)] = card_ref["name"]
+
+        """the deck's cards were replaced, so its counter is the new card total and due indexes are stale"""
+        updates[f"deck/{deckId}/cards_count"] = len(cards)
+        updates[f"deck/{deckId}/cards_version"] = increment(1)
+        db.update(updates)
+        _invalidate_cards(deckId, localId)
 
         return jsonify(message="Adding cards Successful", status=201), 201
     except Exception as _:
@@ -96,6 +119,7 @@ def updatecard(id, cardid):
         db.child("card").order_by_child("Id").equal_to(f"{deckid}_{cardid}").update(
             {"Id": f"{deckid}_{cardid}", "deckid": {deckid}, "word": word, "meaning": meaning}
         )
+        response_cache.invalidate(cards_key(deckid))
 
         return jsonify(message="Update Card Successful", status=201), 201
     except Exception as e:
@@ -110,7 +134,19 @@ def deletecard(id, cardid):
         deckid = id
         cardid = cardid
 
-        db.child("card").order_by_child("Id").equal_to(f"{deckid}_{cardid}").remove()
+        card = db.child("card").child(cardid).get().val()
+        if not card or card.get("deckId") != deckid:
+            return jsonify(message="Card not found", status=404), 404
+
+        db.child("card").child(cardid).remove()
+        db.update(
+            {
+                f"deck/{deckid}/cards_count": increment(-1),
+                f"deck/{deckid}/cards_version": increment(1),
+                **unindex_updates(db, cardid, card),
+            }
+        )
+        _invalidate_cards(deckid, card.get("userId"))
 
         return jsonify(message="Delete Card Successful", status=200), 200
     except Exception as _:
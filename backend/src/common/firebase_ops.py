@@ -0,0 +1,39 @@
+"""firebase_ops.py is a file in the common folder that has small helpers shared by the blueprints for talking to the Firebase Realtime Database."""
+
+import random
+import time
+
+
+def increment(delta):
+    """Return a Firebase server value that atomically adds ``delta`` to the stored number.
+
+    Writing this value with ``update`` lets the database apply the change, so concurrent
+    writers never overwrite each other's counts."""
+    return {".sv": {"increment": delta}}
+
+
+class TransactionConflict(Exception):
+    """Raised when a conditional write keeps losing to concurrent writers."""
+
+
+def transaction(db, path, update, max_attempts=10, backoff=0.02, max_backoff=1.0):
+    """Atomically replace the value at ``path`` with ``update(current_value)``.
+
+    The write is a conditional PUT with an ``if-match`` ETag, so it only succeeds if
+    nobody wrote the node since it was read. On a conflict the value is read again and
+    ``update`` re-run, so it must not depend on state from a previous attempt. After
+    ``max_attempts`` conflicts TransactionConflict is raised. Returns the value written."""
+    # The ETag is read before the value: if the value changes in between, the write
+    # fails and is retried instead of overwriting the newer value.
+    etag = db.child(path).get_etag()
+    for attempt in range(max_attempts):
+        current = db.child(path).get().val()
+        new_value = update(current)
+        result = db.child(path).conditional_set(new_value, etag)
+        # pyrebase returns the current ETag instead of raising when the if-match fails
+        if not (isinstance(result, dict) and list(result) == ["ETag"]):
+            return new_value
+        etag = result["ETag"]
+        # Randomised exponential backoff so competing writers stop colliding
+        time.sleep(random.uniform(0, min(max_backoff, backoff * 2**attempt)))
+    raise TransactionConflict(f"Gave up updating {path} after {max_attempts} conflicting writes")
@@ -0,0 +1,108 @@
+"""leaderboard_windows.py is a file in the common folder that keeps daily, weekly and monthly leaderboard counters.
+
+A board's counters live in ``<board>/<window>/<period>/<user>`` = {score, name}, where the period
+is the UTC day (``2025-04-13``), ISO week (``2025-W15``) or month (``2025-04``). Each write adds to
+the current period of every window with server-side increments, so a window's ranking is one
+indexed query rather than a scan of history. Periods older than ``RETENTION`` are deleted by
+``expire_periods``, run with ``flask --app api leaderboard expire-windows``.
+
+The boards are ``leaderboard_windows/xp`` (XP earned), ``leaderboard_windows/correct`` (correct
+quiz answers over all decks) and ``deck_leaderboard_windows/<deck>`` (correct answers on a deck)."""
+
+from datetime import datetime, timedelta, timezone
+import os
+
+try:
+    from .firebase_ops import increment
+    from .snapshot import Snapshots
+except ImportError:
+    from common.firebase_ops import increment
+    from common.snapshot import Snapshots
+
+WINDOWS = ("daily", "weekly", "monthly")
+# Periods kept for each window, including the current one
+RETENTION = {"daily": 14, "weekly": 8, "monthly": 12}
+
+# Windowed rankings are served from in-memory snapshots of the TOP_SIZE best of each board,
+# refreshed in the background once they are LEADERBOARD_WINDOW_REFRESH seconds old
+TOP_SIZE = 100
+SNAPSHOT_MAX_AGE = float(os.getenv("LEADERBOARD_WINDOW_REFRESH", "60"))
+
+WINDOW_ROOT = "leaderboard_windows"
+DECK_WINDOW_ROOT = "deck_leaderboard_windows"
+XP_BOARD = f"{WINDOW_ROOT}/xp"
+CORRECT_BOARD = f"{WINDOW_ROOT}/correct"
+
+
+def deck_board(deck_id):
+    """Return the board of correct answers on one deck"""
+    return f"{DECK_WINDOW_ROOT}/{deck_id}"
+
+
+def period_key(window, when):
+    """Return the key of the period of ``window`` that the UTC datetime ``when`` falls in"""
+    if window == "daily":
+        return when.strftime("%Y-%m-%d")
+    if window == "weekly":
+        year, week, _ = when.isocalendar()
+        return f"{year}-W{week:02d}"
+    return when.strftime("%Y-%m")
+
+
+def _periods_ago(window, when, periods):
+    """Return a datetime in the period ``periods`` periods before the one ``when`` falls in"""
+    if window == "daily":
+        return when - timedelta(days=periods)
+    if window == "weekly":
+        return when - timedelta(weeks=periods)
+    months = when.year * 12 + when.month - 1 - periods
+    return when.replace(year=months // 12, month=months % 12 + 1, day=1)
+
+
+def counter_updates(board, user_id, amount, now, name=None):
+    """Return the multi-path update that adds ``amount`` to a user's score in every window of a board"""
+    updates = {}
+    for window in WINDOWS:
+        path = f"{board}/{window}/{period_key(window, now)}/{user_id}"
+        updates[f"{path}/score"] = increment(amount)
+        if name is not None:
+            updates[f"{path}/name"] = name
+    return updates
+
+
+def read_top(db, board, window, limit, now):
+    """Return the ``limit`` best [{user_id, name, score, rank}] of the current period, best first"""
+    entries = (
+        db.child(board).child(window).child(period_key(window, now)).order_by_child("score").limit_to_last(limit)
+    ).get().val() or {}
+    ranked = sorted(entries.items(), key=lambda item: (item[1].get("score", 0), item[0]), reverse=True)
+    return [
+        {"user_id": user_id, "name": entry.get("name"), "score": entry.get("score", 0), "rank": rank}
+        for rank, (user_id, entry) in enumerate(ranked, start=1)
+    ]
+
+
+def top_snapshots(db_factory):
+    """Return ``Snapshots`` of the ``TOP_SIZE`` best of a (board, window).
+
+    Snapshots refresh on background threads, so each load reads with a new handle from
+    ``db_factory()`` rather than one shared with request threads."""
+
+    def load(board, window):
+        return read_top(db_factory(), board, window, TOP_SIZE, datetime.now(timezone.utc))
+
+    return Snapshots(load, SNAPSHOT_MAX_AGE)
+
+
+def expire_periods(db, board, now):
+    """Delete the periods of a board older than ``RETENTION`` with one update. Returns the number deleted."""
+    updates = {}
+    for window in WINDOWS:
+        oldest = period_key(window, _periods_ago(window, now, RETENTION[window] - 1))
+        for period in db.child(board).child(window).shallow().get().val() or []:
+            # Period keys sort in time order within a window
+            if period < oldest:
+                updates[f"{board}/{window}/{period}"] = None
+    if updates:
+        db.update(updates)
+    return len(updates)
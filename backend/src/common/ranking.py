@@ -0,0 +1,67 @@
+"""ranking.py is a file in the common folder that pages through Firebase nodes ranked by a numeric child.
+
+Firebase orders a query by the child and then by key, both ascending, so the rankings here are
+that order reversed: highest value first and equal values by descending key. A page is one
+``limit_to_last`` query; a cursor records the rank offset, the value of the last entry shown and
+how many entries with that value were already shown, so the next page is one ``end_at`` query
+however deep it is.
+
+Queries cannot count, so a rank needs counts kept alongside the entries; ``as_counts`` reads
+such a {bucket: count} node."""
+
+
+def ranked(entries, field):
+    """Return the (key, value) pairs of entries that have ``field``, best first"""
+    rows = [
+        (key, value)
+        for key, value in (entries or {}).items()
+        if isinstance(value, dict) and value.get(field) is not None
+    ]
+    return sorted(rows, key=lambda item: (item[1][field], item[0]), reverse=True)
+
+
+def parse_cursor(cursor):
+    """Return (entries before the page, entries shown with the last value, last value) from a cursor.
+
+    Raises ValueError for a malformed cursor."""
+    offset, ties, value = cursor.split(":", 2)
+    value = float(value)
+    return int(offset), int(ties), int(value) if value.is_integer() else value
+
+
+def read_page(db, path, field, limit, cursor=None):
+    """Return ([(rank, key, value)], next cursor) for a page of the entries at ``path`` ordered by ``field``.
+
+    Children without ``field`` sort first in Firebase, so they are only reached after every
+    ranked entry and are left out. The next cursor is None on the last page."""
+    offset, ties, last = parse_cursor(cursor) if cursor else (0, 0, None)
+    query = db.child(path).order_by_child(field)
+    if last is not None:
+        query = query.end_at(last)
+    rows = ranked(query.limit_to_last(limit + ties).get().val(), field)[ties:]
+
+    page = [(rank, key, value) for rank, (key, value) in enumerate(rows, start=offset + 1)]
+    if len(page) < limit:
+        return page, None
+    last_value = page[-1][2][field]
+    shown = sum(1 for _, _, value in page if value[field] == last_value) + (ties if last_value == last else 0)
+    return page, f"{offset + len(page)}:{shown}:{last_value}"
+
+
+def ranked_between(db, path, field, low, high):
+    """Return the (key, value) pairs with ``low <= field <= high``, best first, in one query"""
+    return ranked(db.child(path).order_by_child(field).start_at(low).end_at(high).get().val(), field)
+
+
+def as_counts(counts, prefix=""):
+    """Return a {bucket: count} node as a dict with int keys, dropping empty buckets.
+
+    ``prefix`` is stripped from the keys of buckets stored as ``<prefix><number>``."""
+    # Firebase returns an object whose keys are all small integers as a list
+    if isinstance(counts, list):
+        return {bucket: count for bucket, count in enumerate(counts) if count}
+    return {
+        int(bucket[len(prefix) :]): count
+        for bucket, count in (counts or {}).items()
+        if count and bucket.startswith(prefix)
+    }
@@ -0,0 +1,266 @@
+"""response_cache.py is a file in the common folder that caches the results of deck, card and folder reads.
+
+Decks, cards and folders are read far more often than they change, so ``GET /deck/<id>``,
+``GET /deck/all``, ``GET /deck/<id>/card/all`` and ``GET /folders/all`` read through
+``response_cache``: a hit is served from memory, a miss loads from Firebase and is kept for
+``RESPONSE_CACHE_TTL`` seconds. Every endpoint that writes one of these nodes invalidates the
+keys it affected, so the TTL only bounds how long a write made outside these endpoints (e.g.
+in the Firebase console) can go unseen. Concurrent misses of one key share a single load, so a
+popular deck list never has more than one query for it in flight per process. With a stale
+window, a value just past its TTL is also served while one background load refreshes it.
+
+Configuration comes from the environment:
+
+- ``RESPONSE_CACHE_DB``: path of a SQLite file; when set, the server processes on a host share
+  the values through it and only keep their own copies for ``RESPONSE_CACHE_LOCAL_TTL``
+  seconds (default 1), so an invalidation in one process reaches the others that quickly.
+- ``RESPONSE_CACHE_TTL``: seconds a value is kept (default 60 with ``RESPONSE_CACHE_DB``,
+  otherwise 1); ``0`` turns the cache off.
+- ``RESPONSE_CACHE_STALE``: seconds past its TTL a value is still served while it is refreshed
+  in the background (default 30 with ``RESPONSE_CACHE_DB``, otherwise 0). Invalidated values
+  are never served.
+- ``RESPONSE_CACHE_SIZE``: values kept in memory per process (default 1024), least recently
+  used dropped first.
+
+An invalidation only reaches the other server processes through ``RESPONSE_CACHE_DB``, so
+without it each process keeps values for a second and never serves them stale: a write seen
+by one worker is seen by every worker within ``RESPONSE_CACHE_TTL`` seconds. Serving stale
+values is opt-in there; concurrent misses still share one load either way.
+"""
+
+from collections import OrderedDict
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    from .. import firebase
+    from .single_flight import SingleFlight
+except ImportError:
+    from __init__ import firebase
+    from common.single_flight import SingleFlight
+
+
+def deck_key(deck_id):
+    return f"deck:{deck_id}"
+
+
+def deck_list_key(user_id=None):
+    """Return the key of a user's decks, or of the public decks if ``user_id`` is None"""
+    return f"decks:user:{user_id}" if user_id else "decks:public"
+
+
+def cards_key(deck_id):
+    return f"cards:{deck_id}"
+
+
+def folders_key(user_id):
+    return f"folders:{user_id}"
+
+
+class SQLiteCacheBackend:
+    """Keeps cached values in a SQLite file shared by every server process on the host.
+
+    Every key has a generation that each invalidation bumps. A value is only stored if the
+    key's generation is still the one read before loading it, so a load that started before
+    another process's invalidation never puts the older value back."""
+
+    # Expired rows are deleted once every this many writes
+    PURGE_EVERY = 100
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS response_cache_generations (
+                key TEXT PRIMARY KEY,
+                generation INTEGER NOT NULL
+            )"""
+        )
+
+    def get(self, key):
+        """Return (True, value, None) for a live entry, otherwise (False, None, the key's generation)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM response_cache WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+            if row:
+                return True, json.loads(row[0]), None
+            row = self._conn.execute(
+                "SELECT generation FROM response_cache_generations WHERE key = ?", (key,)
+            ).fetchone()
+        return False, None, row[0] if row else 0
+
+    def set(self, key, value, ttl, generation):
+        """Store ``value`` unless ``key`` was invalidated since its generation was ``generation``"""
+        with self._lock:
+            self._conn.execute(
+                """INSERT OR REPLACE INTO response_cache (key, value, expires_at)
+                SELECT ?, ?, ?
+                WHERE COALESCE((SELECT generation FROM response_cache_generations WHERE key = ?), 0) = ?""",
+                (key, json.dumps(value), time.time() + ttl, key, generation),
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                self._conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),))
+
+    def delete(self, keys):
+        with self._lock:
+            # The generation is bumped first, so a load that stores after the delete is refused
+            self._conn.executemany(
+                """INSERT INTO response_cache_generations (key, generation) VALUES (?, 1)
+                ON CONFLICT(key) DO UPDATE SET generation = generation + 1""",
+                [(key,) for key in keys],
+            )
+            self._conn.executemany("DELETE FROM response_cache WHERE key = ?", [(key,) for key in keys])
+
+
+class ResponseCache:
+    """An LRU of loaded values that expire ``ttl`` seconds after loading, optionally backed by a shared store.
+
+    For ``stale`` seconds after it expires a value is still returned while one background
+    refresh replaces it, and concurrent misses of a key share one load, so a popular key
+    never sends more than one query to Firebase at a time. Values are shared between callers,
+    so they must not be modified after they are returned.
+
+    A pyrebase handle keeps the path and query being built on itself, so it must not be used
+    by two threads at once. A load on a miss reads with the caller's handle; a background
+    refresh reads with a new one from ``db_factory()``. Without ``db_factory`` values are
+    not served stale."""
+
+    def __init__(self, ttl, max_entries, backend=None, local_ttl=None, stale=0, db_factory=None):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._backend = backend
+        self._local_ttl = ttl if local_ttl is None else min(ttl, local_ttl)
+        self._stale = stale if db_factory else 0
+        self._db_factory = db_factory
+        self._lock = threading.Lock()
+        # key -> (fresh until, stale until, value)
+        self._entries = OrderedDict()
+        # Bumped by every invalidation, so a load that raced with a write is not stored
+        self._generations = {}
+        self._flights = SingleFlight()
+        self._refreshing = set()
+        self._metrics = {}
+
+    def get(self, key, load, db):
+        """Return the cached value of ``key``, calling ``load(db)`` and keeping its result on a miss"""
+        if self._ttl <= 0:
+            return load(db)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            generation = self._generations.get(key, 0)
+            if entry is not None and now < entry[1]:
+                self._entries.move_to_end(key)
+                self._count(key, "hits")
+                if now >= entry[0] and key not in self._refreshing:
+                    self._refreshing.add(key)
+                    threading.Thread(target=self._refresh, args=(key, load, generation), daemon=True).start()
+                return entry[2]
+        return self._load(key, lambda: load(db), generation, "misses")
+
+    def _load(self, key, load, generation, metric):
+        def fetch():
+            found, value, shared_generation = self._backend.get(key) if self._backend else (False, None, None)
+            with self._lock:
+                self._count(key, "shared_hits" if found else metric)
+            return found, value if found else load(), shared_generation
+
+        # Keyed by generation too, so a read that starts after a write never shares a load begun before it
+        (found, value, shared_generation), ran = self._flights.do((key, generation), fetch)
+        if not ran:
+            with self._lock:
+                self._count(key, "coalesced")
+            return value
+
+        with self._lock:
+            current = self._generations.get(key, 0) == generation
+            if current:
+                fresh_until = time.monotonic() + self._local_ttl
+                self._entries[key] = (fresh_until, fresh_until + self._stale, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+        if current and not found and self._backend:
+            self._backend.set(key, value, self._ttl, shared_generation)
+        return value
+
+    def _refresh(self, key, load, generation):
+        try:
+            self._load(key, lambda: load(self._db_factory()), generation, "refreshes")
+        except Exception:
+            # Keep serving the stale value; the next read tries again
+            logging.exception("Refreshing a cached response failed")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def invalidate(self, *keys):
+        """Drop ``keys`` so their next read loads them again"""
+        if self._ttl <= 0:
+            return
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+                self._generations[key] = self._generations.get(key, 0) + 1
+                self._count(key, "invalidations")
+        if self._backend:
+            self._backend.delete(keys)
+
+    def clear(self):
+        """Drop every value kept in memory and reset the metrics"""
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._refreshing.clear()
+            self._metrics.clear()
+
+    def _count(self, key, metric):
+        kind = self._metrics.setdefault(key.split(":", 1)[0], {})
+        kind[metric] = kind.get(metric, 0) + 1
+
+    def metrics(self):
+        """Return the counts since start-up, the hit rate, the entries kept and the counts by kind of key.
+
+        ``hits`` includes stale values served while they were refreshed, ``coalesced`` counts
+        misses that shared another request's load, and ``refreshes`` counts background loads.
+        ``by_kind`` has the same counts for each kind of key: deck, decks, cards and folders."""
+        with self._lock:
+            by_kind = {kind: dict(counts) for kind, counts in self._metrics.items()}
+            entries = len(self._entries)
+        totals = {
+            metric: sum(counts.get(metric, 0) for counts in by_kind.values())
+            for metric in ("hits", "misses", "shared_hits", "coalesced", "refreshes", "invalidations")
+        }
+        reads = totals["hits"] + totals["shared_hits"] + totals["coalesced"] + totals["misses"]
+        totals["hit_rate"] = (reads - totals["misses"]) / reads if reads else 0
+        return {**totals, "entries": entries, "by_kind": by_kind}
+
+
+def _from_env():
+    path = os.getenv("RESPONSE_CACHE_DB")
+    return ResponseCache(
+        ttl=float(os.getenv("RESPONSE_CACHE_TTL", "60" if path else "1")),
+        max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "1024")),
+        backend=SQLiteCacheBackend(path) if path else None,
+        local_ttl=float(os.getenv("RESPONSE_CACHE_LOCAL_TTL", "1")) if path else None,
+        stale=float(os.getenv("RESPONSE_CACHE_STALE", "30" if path else "0")),
+        db_factory=firebase.database,
+    )
+
+
+response_cache = _from_env()
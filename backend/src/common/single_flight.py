@@ -0,0 +1,45 @@
+"""single_flight.py is a file in the common folder that lets concurrent identical reads share one fetch.
+
+When many requests miss the same value at once, only the first runs the fetch; the others wait
+for it and are handed its result (or its exception) instead of each querying Firebase."""
+
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs at most one ``fetch`` per key at a time; callers arriving while it runs share its outcome."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fetch):
+        """Return (value, whether this caller ran ``fetch``) for ``key``, waiting for a call already in flight"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, False
+
+        try:
+            call.value = fetch()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value, True
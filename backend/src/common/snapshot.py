@@ -0,0 +1,79 @@
+"""snapshot.py is a file in the common folder that keeps query results in memory and refreshes them in the background.
+
+Endpoints that show the same ranking to every caller read it from a ``Snapshot`` rather than
+querying Firebase per request. Once a snapshot is older than ``max_age`` seconds the next
+caller starts a refresh on a background thread and is served the old value meanwhile, so
+only the very first read waits for the database."""
+
+from collections import OrderedDict
+import logging
+import threading
+import time
+
+
+class Snapshot:
+    """The cached result of ``load()``, refreshed in the background once it is ``max_age`` seconds old."""
+
+    def __init__(self, load, max_age):
+        self._load = load
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._value = None
+        self._loaded_at = None
+        self._refreshing = False
+
+    def get(self):
+        """Return the snapshot, loading it first if it has never been loaded"""
+        with self._lock:
+            if self._loaded_at is None:
+                self._store(self._load())
+                return self._value
+            if time.monotonic() - self._loaded_at >= self._max_age and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self._refresh, daemon=True).start()
+            return self._value
+
+    def invalidate(self):
+        """Make the next ``get`` load the value again before returning"""
+        with self._lock:
+            self._loaded_at = None
+
+    def _store(self, value):
+        self._value = value
+        self._loaded_at = time.monotonic()
+
+    def _refresh(self):
+        try:
+            value = self._load()
+        except Exception:
+            # Keep serving the old value; the next read past max_age tries again
+            logging.exception("Refreshing a snapshot failed")
+            with self._lock:
+                self._refreshing = False
+            return
+        with self._lock:
+            self._store(value)
+            self._refreshing = False
+
+
+class Snapshots:
+    """A ``Snapshot`` per key, created on first use; past ``max_keys`` the least recently used is dropped."""
+
+    def __init__(self, load, max_age, max_keys=256):
+        self._load = load
+        self._max_age = max_age
+        self._max_keys = max_keys
+        self._lock = threading.Lock()
+        self._snapshots = OrderedDict()
+
+    def get(self, *key):
+        """Return the snapshot of ``load(*key)``"""
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+            if snapshot is None:
+                snapshot = self._snapshots[key] = Snapshot(lambda: self._load(*key), self._max_age)
+                if len(self._snapshots) > self._max_keys:
+                    self._snapshots.popitem(last=False)
+            else:
+                self._snapshots.move_to_end(key)
+        return snapshot.get()
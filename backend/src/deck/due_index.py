@@ -0,0 +1,176 @@
+"""due_index.py is a file in deck folder that maintains the per-user due-card index.
+
+``user_due_cards/<user>/<deck>`` holds two lists. ``due`` has an entry for every card the
+user has reviewed, with ``next_review`` stored as an integer epoch (seconds) so the cards
+due now are returned by an indexed ``end_at`` query. ``new`` has the cards the user has
+never reviewed. The index remembers the deck's ``cards_version`` it was built from and is
+rebuilt from the deck's cards and the user's progress when the deck's cards change.
+
+With ``REVIEW_FUZZ=true`` reviewed cards are scheduled on the least loaded day near their
+SM-2 interval, counted from the index, so cards learned together do not stay due together."""
+
+from collections import Counter
+from datetime import datetime, timezone
+import os
+import time
+
+try:
+    from .loader import load_deck_cards, load_deck_progress
+    from .sm2 import DAY
+except ImportError:
+    from deck.loader import load_deck_cards, load_deck_progress
+    from deck.sm2 import DAY
+
+DUE_INDEX = "user_due_cards"
+FUZZ_REVIEWS = os.getenv("REVIEW_FUZZ", "false").lower() == "true"
+
+
+def to_epoch(next_review):
+    """Convert a stored ISO ``next_review`` to epoch seconds; unparseable dates count as due long ago"""
+    try:
+        review_time = datetime.fromisoformat(next_review)
+    except (TypeError, ValueError):
+        return 0
+    if review_time.tzinfo is None:
+        review_time = review_time.replace(tzinfo=timezone.utc)
+    return int(review_time.timestamp())
+
+
+def due_entry(progress):
+    """Return the index entry for a card with the given progress"""
+    return {"next_review": to_epoch(progress.get("next_review")), "progress": progress}
+
+
+def index_updates(user_id, deck_id, card_id, progress):
+    """Return the multi-path update that moves a reviewed card into the user's due list"""
+    base = f"{DUE_INDEX}/{user_id}/{deck_id}"
+    return {f"{base}/due/{card_id}": due_entry(progress), f"{base}/new/{card_id}": None}
+
+
+def rebuild_index(db, user_id, deck_id, version, cards=None):
+    """Build a user's index for a deck from the deck's cards and the user's progress"""
+    if cards is None:
+        cards = load_deck_cards(db, deck_id)
+    all_progress = load_deck_progress(db, user_id, deck_id, cards)
+
+    due, new = {}, {}
+    for card_id in cards:
+        progress = all_progress.get(card_id)
+        if progress:
+            due[card_id] = due_entry(progress)
+        else:
+            new[card_id] = True
+
+    db.child(DUE_INDEX).child(user_id).child(deck_id).set({"version": version, "due": due, "new": new})
+
+
+def ensure_index(db, user_id, deck_id, cards=None):
+    """Rebuild the user's index for a deck if it is missing or the deck's cards changed since it was built.
+
+    ``cards`` can be passed when the caller has already loaded the deck's cards."""
+    version = db.child("deck").child(deck_id).child("cards_version").get().val() or 0
+    built = db.child(DUE_INDEX).child(user_id).child(deck_id).child("version").get().val()
+    if built != version:
+        rebuild_index(db, user_id, deck_id, version, cards)
+
+
+def practice_queue(db, user_id, deck_id, limit=20, now=None, cards=None):
+    """Return up to ``limit`` (card_id, progress) pairs to practice, new cards first then the longest overdue.
+
+    Progress is None for new cards. Only the returned entries are read from the index."""
+    ensure_index(db, user_id, deck_id, cards)
+    now = int(time.time()) if now is None else now
+
+    new_cards = (
+        db.child(DUE_INDEX).child(user_id).child(deck_id).child("new").order_by_key().limit_to_first(limit).get()
+    )
+    queue = [(card.key(), None) for card in new_cards.each() or []]
+
+    if len(queue) < limit:
+        due_cards = (
+            db.child(DUE_INDEX)
+            .child(user_id)
+            .child(deck_id)
+            .child("due")
+            .order_by_child("next_review")
+            .end_at(now)
+            .limit_to_first(limit - len(queue))
+            .get()
+        )
+        queue.extend((card.key(), card.val().get("progress")) for card in due_cards.each() or [])
+    return queue
+
+
+def review_forecast(db, user_id, deck_id, days, now=None):
+    """Bucket the user's reviews for a deck by UTC day for today and the next ``days - 1`` days.
+
+    Only cards due before the end of the window are read, with one indexed query, and
+    each is placed in its bucket with integer arithmetic on its epoch. Overdue cards are
+    counted in today's bucket. Returns (day_start, buckets, overdue, new) where each
+    bucket is the list of card IDs due that day, most overdue first."""
+    ensure_index(db, user_id, deck_id)
+    now = int(time.time()) if now is None else now
+    day_start = now - now % DAY
+    window_end = day_start + days * DAY - 1
+
+    due_cards = (
+        db.child(DUE_INDEX)
+        .child(user_id)
+        .child(deck_id)
+        .child("due")
+        .order_by_child("next_review")
+        .end_at(window_end)
+        .get()
+    )
+    buckets = [[] for _ in range(days)]
+    overdue = 0
+    for card in due_cards.each() or []:
+        next_review = card.val().get("next_review", 0)
+        if next_review < now:
+            overdue += 1
+        buckets[max(0, (next_review - day_start) // DAY)].append(card.key())
+
+    new_cards = db.child(DUE_INDEX).child(user_id).child(deck_id).child("new").shallow().get().val() or []
+    return day_start, buckets, overdue, len(new_cards)
+
+
+class DueCounts:
+    """The number of a user's cards of a deck due on each UTC day, for ``sm2.review``'s ``due_counts``.
+
+    Days are read from the index with one indexed query the first time they are asked for.
+    ``move`` records a reviewed card's new due day before it is written, so the reviews of
+    a batch are balanced against each other as well."""
+
+    def __init__(self, db, user_id, deck_id):
+        self.db = db
+        self.user_id = user_id
+        self.deck_id = deck_id
+        self.indexed = Counter()
+        self.loaded = set()
+        self.pending = Counter()
+
+    def __call__(self, first_day, last_day):
+        missing = [day for day in range(first_day, last_day + 1) if day not in self.loaded]
+        if missing:
+            due_cards = (
+                self.db.child(DUE_INDEX)
+                .child(self.user_id)
+                .child(self.deck_id)
+                .child("due")
+                .order_by_child("next_review")
+                .start_at(missing[0] * DAY)
+                .end_at((missing[-1] + 1) * DAY - 1)
+                .get()
+            )
+            for card in due_cards.each() or []:
+                day = card.val().get("next_review", 0) // DAY
+                if day not in self.loaded:
+                    self.indexed[day] += 1
+            self.loaded.update(range(missing[0], missing[-1] + 1))
+        return {day: self.indexed[day] + self.pending[day] for day in range(first_day, last_day + 1)}
+
+    def move(self, old_next_review, new_next_review):
+        """Record that a card's next review moved between two ISO dates; ``old_next_review`` is None for a new card"""
+        if old_next_review is not None:
+            self.pending[to_epoch(old_next_review) // DAY] -= 1
+        self.pending[to_epoch(new_next_review) // DAY] += 1
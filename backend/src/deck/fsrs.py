@@ -0,0 +1,218 @@
+"""fsrs.py is a file in deck folder that implements the FSRS (Free Spaced Repetition Scheduler) v4.5 algorithm.
+
+FSRS models each card's memory with a stability (days until recall probability drops to
+90%) and a difficulty (1-10), and schedules the next review when the predicted recall
+probability reaches ``DESIRED_RETENTION``. Its 17 parameters can be fitted to a user's own
+review history with ``fit_parameters``; the formulas are written with NumPy operations so
+the same code steps one card or many cards under many parameter sets at once.
+
+https://github.com/open-spaced-repetition/fsrs4anki/wiki/The-Algorithm"""
+
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+try:
+    from .sm2 import DAY, balance_interval
+except ImportError:
+    from deck.sm2 import DAY, balance_interval
+
+DEFAULT_PARAMS = (
+    0.4872, 1.4003, 3.7145, 13.8206, 5.1618, 1.2298, 0.8975, 0.031, 1.6474,
+    0.1367, 1.0461, 2.1072, 0.0793, 0.3246, 1.587, 0.2272, 2.8755,
+)  # fmt: skip
+# Ranges each parameter is kept within while fitting
+PARAM_BOUNDS = (
+    (0.1, 100), (0.1, 100), (0.1, 100), (0.1, 100), (1, 10), (0.1, 5), (0.1, 5), (0, 0.75), (0, 4.5),
+    (0, 0.8), (0.01, 3.5), (0.1, 5), (0.01, 0.25), (0.01, 0.9), (0.01, 4), (0, 1), (1, 6),
+)  # fmt: skip
+
+DECAY = -0.5
+FACTOR = 19 / 81
+DESIRED_RETENTION = 0.9
+MAX_INTERVAL = 36500
+# FSRS rates answers Again (1), Hard (2), Good (3) or Easy (4); SM-2 qualities 0-2 are failed recalls
+RATINGS = (1, 1, 1, 2, 3, 4)
+MIN_FIT_REVIEWS = 100
+
+
+def retrievability(elapsed_days, stability):
+    """Return the probability of recalling a card ``elapsed_days`` after its last review"""
+    return (1 + FACTOR * elapsed_days / stability) ** DECAY
+
+
+def initial_state(w, rating):
+    """Return the (stability, difficulty) of a card after its first review"""
+    stability = np.where(
+        rating == 1, w[..., 0], np.where(rating == 2, w[..., 1], np.where(rating == 3, w[..., 2], w[..., 3]))
+    )
+    difficulty = np.clip(w[..., 4] - (rating - 3) * w[..., 5], 1, 10)
+    return stability, difficulty
+
+
+def next_state(w, stability, difficulty, elapsed_days, rating):
+    """Return the (stability, difficulty) of a card after a review ``elapsed_days`` after the previous one"""
+    recall = retrievability(elapsed_days, stability)
+    hard_penalty = np.where(rating == 2, w[..., 15], 1)
+    easy_bonus = np.where(rating == 4, w[..., 16], 1)
+    recalled = stability * (
+        1
+        + np.exp(w[..., 8])
+        * (11 - difficulty)
+        * stability ** -w[..., 9]
+        * (np.exp((1 - recall) * w[..., 10]) - 1)
+        * hard_penalty
+        * easy_bonus
+    )
+    forgotten = (
+        w[..., 11] * difficulty ** -w[..., 12] * ((stability + 1) ** w[..., 13] - 1) * np.exp((1 - recall) * w[..., 14])
+    )
+    new_stability = np.where(rating == 1, np.minimum(forgotten, stability), recalled)
+    # Difficulty moves with the rating, then reverts towards the difficulty of a first "Good"
+    moved = difficulty - w[..., 6] * (rating - 3)
+    new_difficulty = np.clip(w[..., 7] * w[..., 4] + (1 - w[..., 7]) * moved, 1, 10)
+    return new_stability, new_difficulty
+
+
+def next_interval(stability):
+    """Return the whole days until a card with ``stability`` reaches the desired retention"""
+    interval = stability / FACTOR * (DESIRED_RETENTION ** (1 / DECAY) - 1)
+    return int(min(MAX_INTERVAL, max(1, round(float(interval)))))
+
+
+def _parse_time(value):
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _from_sm2(progress):
+    """Estimate FSRS memory state for a card scheduled with SM-2 so far: its interval approximates
+    the stability and its ease factor (1.3-2.5+) the difficulty"""
+    stability = max(0.1, float(progress.get("interval", 1)))
+    difficulty = float(np.clip(11 - 2 * progress.get("ease_factor", 2.5), 1, 10))
+    return stability, difficulty
+
+
+def review(progress, quality, reviewed_at, due_counts=None, params=None):
+    """Return the progress fields that change when a card is answered with ``quality`` (0-5) at ``reviewed_at``.
+
+    ``params`` are the user's fitted parameters (the defaults when None). Cards scheduled
+    with SM-2 until now continue from an estimate of their memory state."""
+    w = np.asarray(params if params is not None else DEFAULT_PARAMS, dtype=np.float64)
+    rating = RATINGS[quality]
+    last_review = _parse_time(progress.get("last_review"))
+
+    if progress.get("scheduler") == "fsrs" and "stability" in progress:
+        stability, difficulty = progress["stability"], progress["difficulty"]
+    elif last_review is not None or progress.get("repetitions", 0) > 0:
+        stability, difficulty = _from_sm2(progress)
+    else:
+        stability = None
+
+    if stability is None:
+        stability, difficulty = initial_state(w, rating)
+    else:
+        if last_review is not None:
+            elapsed = max(0.0, (reviewed_at - last_review).total_seconds() / DAY)
+        else:
+            elapsed = float(progress.get("interval", 1))
+        stability, difficulty = next_state(w, stability, difficulty, elapsed, rating)
+
+    interval = next_interval(stability)
+    if due_counts is not None:
+        interval = balance_interval(interval, int(reviewed_at.timestamp()), due_counts)
+
+    return {
+        "interval": interval,
+        "repetitions": progress.get("repetitions", 0) + 1 if rating > 1 else 0,
+        "ease_factor": progress.get("ease_factor", 2.5),
+        "stability": round(float(stability), 4),
+        "difficulty": round(float(difficulty), 4),
+        "next_review": (reviewed_at + timedelta(days=interval)).isoformat(),
+        "last_review": reviewed_at.isoformat(),
+        "confidence": quality,
+    }
+
+
+def _history_arrays(histories):
+    """Pad per-card histories of (epoch, quality) into (elapsed days, rating, mask) arrays of shape (cards, reviews)"""
+    histories = [history for history in histories if len(history) >= 2]
+    steps = max(len(history) for history in histories)
+    elapsed = np.zeros((len(histories), steps))
+    ratings = np.ones((len(histories), steps), dtype=np.int64)
+    mask = np.zeros((len(histories), steps), dtype=bool)
+    for row, history in enumerate(histories):
+        times = np.array([epoch for epoch, _ in history], dtype=np.float64)
+        elapsed[row, 1 : len(history)] = np.diff(times) / DAY
+        ratings[row, : len(history)] = [RATINGS[quality] for _, quality in history]
+        mask[row, : len(history)] = True
+    return elapsed, ratings, mask
+
+
+def log_loss(params, elapsed, ratings, mask):
+    """Return the mean log loss of the recall predictions for every review after each card's first.
+
+    ``params`` may be one parameter set of shape (17,) or many of shape (sets, 17), which
+    are evaluated together and give one loss each."""
+    params = np.asarray(params, dtype=np.float64)
+    w = params.reshape(-1, 1, params.shape[-1])
+    stability, difficulty = initial_state(w, ratings[:, 0])
+    total = 0.0
+    for step in range(1, ratings.shape[1]):
+        valid = mask[:, step]
+        recall = np.clip(retrievability(elapsed[:, step], stability), 1e-6, 1 - 1e-6)
+        recalled = ratings[:, step] > 1
+        total = total + np.where(valid, -np.where(recalled, np.log(recall), np.log(1 - recall)), 0).sum(axis=-1)
+        new_stability, new_difficulty = next_state(w, stability, difficulty, elapsed[:, step], ratings[:, step])
+        stability = np.where(valid, np.maximum(new_stability, 0.01), stability)
+        difficulty = np.where(valid, new_difficulty, difficulty)
+    loss = total / max(1, mask[:, 1:].sum())
+    return loss if params.ndim > 1 else float(loss[0])
+
+
+def fit_parameters(histories, params=DEFAULT_PARAMS, iterations=60, learning_rate=0.05, max_cards=2000, seed=0):
+    """Fit FSRS parameters to a user's review history with Adam on finite-difference gradients.
+
+    ``histories`` is a list of per-card lists of (epoch, quality) in review order. Every
+    iteration evaluates the loss for the current parameters and a step either way along
+    each parameter as one vectorized batch. Returns (params, loss, reviews), or None when
+    there are fewer than ``MIN_FIT_REVIEWS`` reviews to learn from. The parameters are only
+    changed when they predict the history better than ``params``."""
+    histories = [history for history in histories if len(history) >= 2]
+    reviews = sum(len(history) - 1 for history in histories)
+    if reviews < MIN_FIT_REVIEWS:
+        return None
+    if len(histories) > max_cards:
+        rng = np.random.default_rng(seed)
+        histories = [histories[i] for i in rng.choice(len(histories), max_cards, replace=False)]
+    elapsed, ratings, mask = _history_arrays(histories)
+
+    lower, upper = np.array(PARAM_BOUNDS).T
+    scale = upper - lower
+    start = np.asarray(params, dtype=np.float64)
+    w = start.copy()
+    first_moment = np.zeros_like(w)
+    second_moment = np.zeros_like(w)
+    eye = np.eye(len(w))
+
+    for iteration in range(1, iterations + 1):
+        # Parameters are stepped in units of their range, so small and large ones move alike
+        step = 1e-3 * scale
+        candidates = np.clip(np.vstack([w + eye * step, w - eye * step]), lower, upper)
+        losses = log_loss(candidates, elapsed, ratings, mask)
+        gradient = (losses[: len(w)] - losses[len(w) :]) / (
+            candidates[: len(w)].diagonal() - candidates[len(w) :].diagonal()
+        )
+        gradient = gradient * scale
+        first_moment = 0.9 * first_moment + 0.1 * gradient
+        second_moment = 0.999 * second_moment + 0.001 * gradient**2
+        update = (first_moment / (1 - 0.9**iteration)) / (np.sqrt(second_moment / (1 - 0.999**iteration)) + 1e-8)
+        w = np.clip(w - learning_rate * update * scale / 10, lower, upper)
+
+    start_loss, fitted_loss = log_loss(np.vstack([start, w]), elapsed, ratings, mask)
+    if fitted_loss >= start_loss:
+        return [float(value) for value in start], float(start_loss), reviews
+    return [round(float(value), 4) for value in w], float(fitted_loss), reviews
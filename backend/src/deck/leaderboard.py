@@ -0,0 +1,251 @@
+"""leaderboard.py is a file in deck folder that saves users' deck scores and keeps the totals derived from them.
+
+Each deck's leaderboard is ``leaderboard/<deck>/<user>``. Alongside the entries the deck keeps
+``leaderboard/<deck>/_summary`` = {correct, incorrect, users}, the sums over all of its entries,
+so deck statistics are one small read. Keys starting with ``_`` are not user entries and readers
+of a deck's leaderboard skip them with ``is_entry``.
+
+Each entry also has a ``score`` child, the number correct times ``SCORE_SCALE`` plus the epoch
+second of ``lastAttempt``, so one indexed query orders a deck by correct answers with the most
+recent attempt first on ties. ``leaderboard_counts/<deck>/c<correct>`` counts the entries with
+each number correct, so a user's rank is found without reading the entries above them. The
+counts live outside ``leaderboard/<deck>`` and their keys are not numbers: Firebase returns an
+object keyed by small integers as an array, which pyrebase cannot sort among the entries of a
+``score`` query.
+
+Each user's sums over all decks are kept in ``leaderboard_totals/<user>`` = {userEmail,
+total_correct, total_incorrect}, indexed by ``total_correct`` so the global leaderboard reads
+only its top entries, and each user's scores are also indexed by user in
+``user_leaderboard/<user>/<deck>`` = {correct, incorrect, lastAttempt}, next to running totals
+in ``user_leaderboard/<user>/_totals`` = {correct, incorrect, decks}, so a user's statistics
+are one keyed read."""
+
+from datetime import datetime, timezone
+
+try:
+    from ..common.firebase_ops import increment, transaction
+    from ..common.leaderboard_windows import CORRECT_BOARD, counter_updates, deck_board
+    from ..common.ranking import as_counts, ranked, ranked_between
+    from ..common.ranking import read_page as read_ranked_page
+except ImportError:
+    from common.firebase_ops import increment, transaction
+    from common.leaderboard_windows import CORRECT_BOARD, counter_updates, deck_board
+    from common.ranking import as_counts, ranked, ranked_between
+    from common.ranking import read_page as read_ranked_page
+
+LEADERBOARD = "leaderboard"
+SUMMARY = "_summary"
+CORRECT_COUNTS = "leaderboard_counts"
+# Prefixed so the buckets are never returned as an array
+BUCKET_PREFIX = "c"
+# Larger than any epoch second, so the number correct always decides first
+SCORE_SCALE = 10**10
+TOTALS = "leaderboard_totals"
+USER_LEADERBOARD = "user_leaderboard"
+USER_TOTALS = "_totals"
+
+
+def is_entry(key):
+    """Return whether a key under ``leaderboard/<deck>`` or ``user_leaderboard/<user>`` is a score entry"""
+    return not str(key).startswith("_")
+
+
+def _count(value):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0
+
+
+def attempt_score(entry):
+    """Return the ``score`` an entry is ordered by: correct answers, then the time of the attempt"""
+    try:
+        attempted = int(datetime.fromisoformat(entry.get("lastAttempt")).timestamp())
+    except (TypeError, ValueError):
+        attempted = 0
+    return int(_count(entry.get("correct"))) * SCORE_SCALE + attempted
+
+
+def score_updates(deck_id, user_id, previous, entry):
+    """Return the multi-path update that moves the deck's summary and the user's totals from ``previous`` to ``entry``.
+
+    ``previous`` is None for a user's first score on the deck. The changes are server-side
+    increments, so concurrent writers never lose each other's counts."""
+    previous = previous or {}
+    # Increments of 0 are written too, so the fields always exist for ordering
+    summary = f"{LEADERBOARD}/{deck_id}/{SUMMARY}"
+    totals = f"{TOTALS}/{user_id}"
+    user_totals = f"{USER_LEADERBOARD}/{user_id}/{USER_TOTALS}"
+    updates = {
+        f"{totals}/userEmail": entry.get("userEmail"),
+        f"{USER_LEADERBOARD}/{user_id}/{deck_id}": {
+            field: entry.get(field) for field in ("correct", "incorrect", "lastAttempt")
+        },
+    }
+    for field in ("correct", "incorrect"):
+        delta = _count(entry.get(field)) - _count(previous.get(field))
+        updates[f"{summary}/{field}"] = increment(delta)
+        updates[f"{totals}/total_{field}"] = increment(delta)
+        updates[f"{user_totals}/{field}"] = increment(delta)
+    if not previous:
+        updates[f"{summary}/users"] = increment(1)
+        updates[f"{user_totals}/decks"] = increment(1)
+    counts = f"{CORRECT_COUNTS}/{deck_id}/{BUCKET_PREFIX}"
+    if not previous or int(_count(previous.get("correct"))) != int(_count(entry.get("correct"))):
+        if previous:
+            updates[f"{counts}{int(_count(previous.get('correct')))}"] = increment(-1)
+        updates[f"{counts}{int(_count(entry.get('correct')))}"] = increment(1)
+    return updates
+
+
+def save_score(db, deck_id, user_id, fields):
+    """Merge ``fields`` into a user's entry on a deck's leaderboard and update the deck's summary and user's totals.
+
+    The entry is replaced with a transaction, so the value it replaced, and therefore the
+    change to add to the summary, is known exactly even when the same user saves twice at
+    once. The score's correct answers are also added to the user's daily, weekly and monthly
+    counters for the deck and overall. Returns (previous entry or None, new entry)."""
+    replaced = []
+
+    def merge(current):
+        replaced[:] = [current]
+        entry = {**(current if isinstance(current, dict) else {}), **fields}
+        entry["score"] = attempt_score(entry)
+        return entry
+
+    entry = transaction(db, f"{LEADERBOARD}/{deck_id}/{user_id}", merge)
+    previous = replaced[0] if isinstance(replaced[0], dict) else None
+    updates = score_updates(deck_id, user_id, previous, entry)
+    correct = _count(fields.get("correct"))
+    if correct > 0:
+        now = datetime.now(timezone.utc)
+        name = entry.get("userEmail")
+        updates.update(counter_updates(deck_board(deck_id), user_id, correct, now, name))
+        updates.update(counter_updates(CORRECT_BOARD, user_id, correct, now, name))
+    db.update(updates)
+    return previous, entry
+
+
+def read_summary(db, deck_id):
+    """Return a deck's {correct, incorrect, users} summary"""
+    summary = db.child(LEADERBOARD).child(deck_id).child(SUMMARY).get().val() or {}
+    return {field: _count(summary.get(field)) for field in ("correct", "incorrect", "users")}
+
+
+def read_user_totals(db, user_id):
+    """Return a user's {correct, incorrect, decks} totals over all decks"""
+    totals = db.child(USER_LEADERBOARD).child(user_id).child(USER_TOTALS).get().val() or {}
+    return {field: _count(totals.get(field)) for field in ("correct", "incorrect", "decks")}
+
+
+def read_user_scores(db, user_id):
+    """Return {deck_id: {correct, incorrect, lastAttempt}} for every deck a user has a score on"""
+    scores = db.child(USER_LEADERBOARD).child(user_id).get().val() or {}
+    return {deck_id: score for deck_id, score in sorted(scores.items()) if is_entry(deck_id)}
+
+
+def _leaderboard_entry(rank, entry):
+    return {
+        "userEmail": entry.get("userEmail"),
+        "correct": entry.get("correct", 0),
+        "incorrect": entry.get("incorrect", 0),
+        "lastAttempt": entry.get("lastAttempt"),
+        "rank": rank,
+    }
+
+
+def read_page(db, deck_id, limit, cursor=None):
+    """Return (entries, next cursor) for a page of a deck's leaderboard, best score first.
+
+    Pass a page's cursor to get the next one; it is None on the last page. Raises ValueError
+    for a malformed cursor."""
+    page, next_cursor = read_ranked_page(db, f"{LEADERBOARD}/{deck_id}", "score", limit, cursor)
+    return [_leaderboard_entry(rank, entry) for rank, _, entry in page], next_cursor
+
+
+def read_rank(db, deck_id, user_id, neighbours=2):
+    """Return (entry, entries above, entries below) for a user on a deck's leaderboard, with ranks.
+
+    Up to ``neighbours`` entries are returned on each side, nearest first. The entries with
+    more correct answers are counted from ``leaderboard_counts`` and only the user's own number
+    correct is queried, so the board is never read in full. Returns None if the user has no
+    score on the deck."""
+    path = f"{LEADERBOARD}/{deck_id}"
+    entry = db.child(path).child(user_id).get().val()
+    if not entry or entry.get("score") is None:
+        return None
+    score = entry["score"]
+    correct = score // SCORE_SCALE
+    next_correct = (correct + 1) * SCORE_SCALE
+
+    counts = as_counts(db.child(CORRECT_COUNTS).child(deck_id).get().val(), BUCKET_PREFIX)
+    same_correct = ranked_between(db, path, "score", correct * SCORE_SCALE, next_correct - 1)
+    position = next(index for index, (key, _) in enumerate(same_correct) if key == user_id)
+    rank = sum(count for other, count in counts.items() if other > correct) + position + 1
+
+    above = [value for _, value in reversed(same_correct[:position])][:neighbours]
+    if len(above) < neighbours:
+        higher = db.child(path).order_by_child("score").start_at(next_correct).limit_to_first(neighbours - len(above))
+        above += [value for _, value in reversed(ranked(higher.get().val(), "score"))]
+
+    # Entries with this score and a greater key rank above the user, so they are skipped
+    tied = sum(1 for key, value in same_correct if value["score"] == score and key >= user_id)
+    lower = db.child(path).order_by_child("score").end_at(score).limit_to_last(neighbours + tied)
+    below = [value for _, value in ranked(lower.get().val(), "score")[tied:]]
+
+    return (
+        _leaderboard_entry(rank, entry),
+        [_leaderboard_entry(rank - index, value) for index, value in enumerate(above, start=1)],
+        [_leaderboard_entry(rank + index, value) for index, value in enumerate(below, start=1)],
+    )
+
+
+def top_totals(db, limit):
+    """Return the ``limit`` users with the most correct answers over all decks, best first"""
+    totals = db.child(TOTALS).order_by_child("total_correct").limit_to_last(limit).get().val() or {}
+    leaderboard = [
+        {
+            "userEmail": total.get("userEmail"),
+            "total_correct": _count(total.get("total_correct")),
+            "total_incorrect": _count(total.get("total_incorrect")),
+        }
+        for total in totals.values()
+    ]
+    leaderboard.sort(key=lambda total: total["total_correct"], reverse=True)
+    return leaderboard
+
+
+def rebuild_summaries(db):
+    """Recompute every deck's summary, scores and counts and every user's totals and scores with one multi-path update.
+
+    Returns (decks, users) rebuilt. Scores saved while it runs may be counted twice or not
+    at all, so run it when the leaderboard is quiet."""
+    leaderboards = db.child(LEADERBOARD).get().val() or {}
+    updates, totals, user_scores = {}, {}, {}
+    for deck_id, entries in leaderboards.items():
+        summary = {"correct": 0, "incorrect": 0, "users": 0}
+        correct_counts = {}
+        for user_id, entry in (entries or {}).items():
+            if not is_entry(user_id) or not isinstance(entry, dict):
+                continue
+            summary["correct"] += _count(entry.get("correct"))
+            summary["incorrect"] += _count(entry.get("incorrect"))
+            summary["users"] += 1
+            updates[f"{LEADERBOARD}/{deck_id}/{user_id}/score"] = attempt_score(entry)
+            correct = f"{BUCKET_PREFIX}{int(_count(entry.get('correct')))}"
+            correct_counts[correct] = correct_counts.get(correct, 0) + 1
+            total = totals.setdefault(
+                user_id, {"userEmail": entry.get("userEmail"), "total_correct": 0, "total_incorrect": 0}
+            )
+            total["total_correct"] += _count(entry.get("correct"))
+            total["total_incorrect"] += _count(entry.get("incorrect"))
+            scores = user_scores.setdefault(user_id, {USER_TOTALS: {"correct": 0, "incorrect": 0, "decks": 0}})
+            scores[deck_id] = {field: entry.get(field) for field in ("correct", "incorrect", "lastAttempt")}
+            scores[USER_TOTALS]["correct"] += _count(entry.get("correct"))
+            scores[USER_TOTALS]["incorrect"] += _count(entry.get("incorrect"))
+            scores[USER_TOTALS]["decks"] += 1
+        updates[f"{LEADERBOARD}/{deck_id}/{SUMMARY}"] = summary
+        updates[f"{CORRECT_COUNTS}/{deck_id}"] = correct_counts or None
+        # Counts kept under the entries before they moved to their own node
+        updates[f"{LEADERBOARD}/{deck_id}/_correct_counts"] = None
+    updates[TOTALS] = totals
+    updates[USER_LEADERBOARD] = user_scores
+    db.update(updates)
+    return len(leaderboards), len(totals)
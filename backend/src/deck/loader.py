@@ -0,0 +1,31 @@
+"""loader.py is a file in deck folder that loads a deck's cards and a user's progress on them for the practice and statistics endpoints.
+
+The deck loaders make one request each, and the endpoints join the results in memory instead
+of fetching cards one at a time. ``load_cards`` reads only the cards it is given, for an
+endpoint that already knows the few cards it needs from a much larger deck."""
+
+try:
+    from .progress import read_deck_progress
+except ImportError:
+    from deck.progress import read_deck_progress
+
+
+def load_deck_cards(db, deck_id):
+    """Return a dict of card ID to card for every card in a deck, fetched with one query"""
+    deck_cards = db.child("card").order_by_child("deckId").equal_to(deck_id).get()
+    return {card.key(): card.val() for card in deck_cards.each() or []}
+
+
+def load_cards(db, card_ids):
+    """Return a dict of card ID to card for the given cards, each read by its key; missing cards are left out"""
+    cards = {}
+    for card_id in card_ids:
+        card = db.child("card").child(card_id).get().val()
+        if card:
+            cards[card_id] = card
+    return cards
+
+
+def load_deck_progress(db, user_id, deck_id, card_ids):
+    """Return a dict of card ID to the user's progress for the given cards of a deck"""
+    return read_deck_progress(db, user_id, deck_id, card_ids)
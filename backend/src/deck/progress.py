@@ -0,0 +1,83 @@
+"""progress.py is a file in deck folder that reads and writes a user's card progress, which is partitioned by deck.
+
+Progress is stored as ``user_card_progress/<user>/<deck>/<card>`` so a deck-scoped endpoint
+reads only the deck it needs. Progress written before the partitioning lives directly at
+``user_card_progress/<user>/<card>``. While ``PROGRESS_LEGACY_READS`` is enabled (the
+default) those entries are still read, and are moved into their deck the first time they
+are read or written. Once ``flask --app api deck migrate-progress`` has been run it can be
+set to ``false`` to skip the lookups."""
+
+import os
+
+PROGRESS = "user_card_progress"
+LEGACY_PROGRESS_READS = os.getenv("PROGRESS_LEGACY_READS", "true").lower() != "false"
+
+
+def progress_path(user_id, deck_id, card_id):
+    """Return the database path of a user's progress on a card"""
+    return f"{PROGRESS}/{user_id}/{deck_id}/{card_id}"
+
+
+def is_legacy_entry(value):
+    """Tell a progress record stored directly under the user apart from a deck partition"""
+    return isinstance(value, dict) and any(key in value for key in ("interval", "repetitions", "next_review"))
+
+
+def read_card_progress(db, user_id, deck_id, card_id):
+    """Return a user's progress on one card, or None if they have never reviewed it"""
+    progress = db.child(PROGRESS).child(user_id).child(deck_id).child(card_id).get().val()
+    if progress is None and LEGACY_PROGRESS_READS:
+        progress = db.child(PROGRESS).child(user_id).child(card_id).get().val()
+    return progress
+
+
+def progress_updates(user_id, deck_id, card_id, progress):
+    """Return the multi-path update that stores a card's full progress in its deck partition"""
+    updates = {progress_path(user_id, deck_id, card_id): progress}
+    if LEGACY_PROGRESS_READS:
+        updates[f"{PROGRESS}/{user_id}/{card_id}"] = None
+    return updates
+
+
+def read_deck_progress(db, user_id, deck_id, card_ids):
+    """Return a dict of card ID to the user's progress for the given cards of a deck.
+
+    Only the deck's partition is downloaded. With legacy reads enabled the user's keys are
+    also listed with a shallow read, and any legacy entries for this deck are moved into it."""
+    progress = db.child(PROGRESS).child(user_id).child(deck_id).get().val() or {}
+
+    if LEGACY_PROGRESS_READS:
+        moved = {}
+        for key in db.child(PROGRESS).child(user_id).shallow().get().val() or []:
+            if key in card_ids and key not in progress:
+                legacy = db.child(PROGRESS).child(user_id).child(key).get().val()
+                if is_legacy_entry(legacy):
+                    progress[key] = legacy
+                    moved.update(progress_updates(user_id, deck_id, key, legacy))
+        if moved:
+            db.update(moved)
+
+    return {card_id: progress[card_id] for card_id in card_ids if progress.get(card_id)}
+
+
+def migrate_user_progress(db, user_id, card_decks):
+    """Move a user's legacy progress entries into their deck partitions with one update.
+
+    ``card_decks`` maps card IDs to deck IDs. Returns (moved, orphaned) counts; entries for
+    cards that no longer exist are left where they are."""
+    entries = db.child(PROGRESS).child(user_id).get().val() or {}
+    updates = {}
+    orphaned = 0
+    for card_id, value in entries.items():
+        if not is_legacy_entry(value):
+            continue
+        deck_id = card_decks.get(card_id)
+        if not deck_id:
+            orphaned += 1
+            continue
+        updates[progress_path(user_id, deck_id, card_id)] = value
+        updates[f"{PROGRESS}/{user_id}/{card_id}"] = None
+
+    if updates:
+        db.update(updates)
+    return len(updates) // 2, orphaned
@@ -0,0 +1,256 @@
+"""review_log.py is a file in deck folder that keeps an append-only log of every review a user makes.
+
+Each review is a fixed 13 byte record: the card's index in its chunk (uint32), the epoch
+second it was answered (uint32), its quality (uint8) and the milliseconds the user took to
+answer (uint32). A request's reviews are stored as one chunk under
+``user_review_log/<user>/chunks/<push key>``, holding the IDs of the cards it reviewed as
+``cards`` and the base64 packed records as ``records``, so appending is part of the
+request's multi-path update and never reads or locks anything. The same update increments
+``user_review_log/<user>/open_chunks``; once ``COMPACT_AFTER`` chunks have been appended the
+request that notices merges the newest chunks into chunks of up to ``CHUNK_REVIEWS`` records,
+reading only those. ``flask --app api deck compact-review-log`` merges the whole log.
+
+Logs written before chunks carried their own cards store each chunk as a bare base64 string
+whose indexes point into ``user_review_log/<user>/cards``; they are read the same way and are
+rewritten in the new form by the next compaction.
+
+Each card's review and correct answer counts are also kept per deck in
+``user_review_counts/<user>/<deck>/<card>``, incremented by the server in the same update,
+so a deck's statistics read only that deck's counts instead of the whole log."""
+
+import base64
+
+import numpy as np
+
+try:
+    from ..common.firebase_ops import increment
+except ImportError:
+    from common.firebase_ops import increment
+
+LOG = "user_review_log"
+COUNTS = "user_review_counts"
+RECORD = np.dtype([("card", "<u4"), ("epoch", "<u4"), ("quality", "u1"), ("elapsed_ms", "<u4")])
+CHUNK_REVIEWS = 512
+# Chunks appended since the newest chunks were last merged
+OPEN_CHUNKS = "open_chunks"
+COMPACT_AFTER = 32
+# The card index of records whose card is not known
+UNKNOWN = 2**32 - 1
+
+
+def pack(records):
+    """Pack a list of (card index, epoch, quality, elapsed ms) tuples into base64"""
+    return base64.b64encode(np.array(records, dtype=RECORD).tobytes()).decode("ascii")
+
+
+def unpack(chunk):
+    """Return the records of base64 packed chunk as a NumPy structured array"""
+    return np.frombuffer(base64.b64decode(chunk), dtype=RECORD)
+
+
+def _chunk(card_ids, records):
+    # A chunk names its own cards, so its records can be read without the rest of the log
+    return {"cards": list(card_ids), "records": base64.b64encode(records.tobytes()).decode("ascii")}
+
+
+def append_updates(db, user_id, reviews):
+    """Return the multi-path update that appends (card ID, epoch, quality, elapsed ms) reviews as one chunk.
+
+    After writing it, call ``compact_recent`` so the log's small chunks are merged."""
+    if not reviews:
+        return {}
+    card_ids = list(dict.fromkeys(card_id for card_id, _, _, _ in reviews))
+    index = {card_id: position for position, card_id in enumerate(card_ids)}
+    records = np.array(
+        [(index[card_id], epoch, quality, elapsed_ms) for card_id, epoch, quality, elapsed_ms in reviews], dtype=RECORD
+    )
+    return {
+        f"{LOG}/{user_id}/chunks/{db.generate_key()}": _chunk(card_ids, records),
+        f"{LOG}/{user_id}/{OPEN_CHUNKS}": increment(1),
+    }
+
+
+def count_updates(user_id, reviews):
+    """Return the multi-path update that adds (deck ID, card ID, quality) reviews to the per-deck counts"""
+    counts = {}
+    for deck_id, card_id, quality in reviews:
+        reviews_count, correct = counts.get((deck_id, card_id), (0, 0))
+        counts[(deck_id, card_id)] = (reviews_count + 1, correct + (quality >= 3))
+    updates = {}
+    for (deck_id, card_id), (reviews_count, correct) in counts.items():
+        path = f"{COUNTS}/{user_id}/{deck_id}/{card_id}"
+        updates[f"{path}/reviews"] = increment(reviews_count)
+        if correct:
+            updates[f"{path}/correct"] = increment(correct)
+    return updates
+
+
+def read_counts(db, user_id, deck_id):
+    """Return {card_id: (reviews, correct reviews)} for the cards of one deck the user has reviewed"""
+    counts = db.child(COUNTS).child(user_id).child(deck_id).get().val() or {}
+    return {
+        card_id: (int(count.get("reviews") or 0), int(count.get("correct") or 0))
+        for card_id, count in counts.items()
+        if isinstance(count, dict)
+    }
+
+
+def _as_dict(value):
+    # Firebase returns an object whose keys are all small integers as a list
+    if isinstance(value, list):
+        return {str(index): item for index, item in enumerate(value) if item is not None}
+    return dict(value or {})
+
+
+def _chunk_records(chunk, legacy_cards):
+    """Return (card IDs by index, records) of a chunk in either form"""
+    if isinstance(chunk, str):
+        return legacy_cards, unpack(chunk)
+    cards = {int(index): card_id for index, card_id in _as_dict(chunk.get("cards")).items()}
+    return cards, unpack(chunk.get("records") or "")
+
+
+def _merge(parts):
+    """Concatenate (cards, records) parts into one, giving each card a single index"""
+    cards, indexes, merged = {}, {}, []
+    for part_cards, records in parts:
+        if not len(records):
+            continue
+        records = records.copy()
+        # An index with no card (a damaged legacy log) points at no card in the merged log too
+        lookup = {index: UNKNOWN for index in np.unique(records["card"]).tolist()}
+        for index in lookup:
+            card_id = part_cards.get(index)
+            if card_id is not None:
+                if card_id not in indexes:
+                    indexes[card_id] = len(indexes)
+                    cards[indexes[card_id]] = card_id
+                lookup[index] = indexes[card_id]
+        records["card"] = [lookup[index] for index in records["card"].tolist()]
+        merged.append(records)
+    return cards, np.concatenate(merged) if merged else np.zeros(0, dtype=RECORD)
+
+
+def read_log(db, user_id):
+    """Return (cards, records) for a user: a dict of index to card ID and every review in the
+    order it was logged as one structured array whose ``card`` fields are those indexes"""
+    log = db.child(LOG).child(user_id).get().val() or {}
+    legacy_cards = {int(index): card_id for index, card_id in _as_dict(log.get("cards")).items()}
+    chunks = _as_dict(log.get("chunks"))
+    return _merge(_chunk_records(chunks[key], legacy_cards) for key in sorted(chunks))
+
+
+def card_counts(cards, records, card_ids):
+    """Return {card_id: (reviews, correct reviews)} for the given cards, counted with NumPy"""
+    if not len(records):
+        return {}
+    size = max(cards, default=0) + 1
+    known = records[records["card"] < size]
+    reviews = np.bincount(known["card"], minlength=size)
+    correct = np.bincount(known["card"], weights=known["quality"] >= 3, minlength=size)
+    return {
+        card_id: (int(reviews[index]), int(correct[index])) for index, card_id in cards.items() if card_id in card_ids
+    }
+
+
+def card_histories(cards, records):
+    """Return {card_id: [(epoch, quality), ...]} in review order"""
+    histories = {}
+    order = np.argsort(records["epoch"], kind="stable")
+    for record in records[order]:
+        card_id = cards.get(int(record["card"]))
+        if card_id:
+            histories.setdefault(card_id, []).append((int(record["epoch"]), int(record["quality"])))
+    return histories
+
+
+def rebuild_counts(db, user_id, card_decks):
+    """Replace a user's ``user_review_counts`` with counts taken from their whole review log.
+
+    ``card_decks`` maps card IDs to deck IDs; reviews of cards not in it are not counted.
+    Returns the number of cards counted."""
+    cards, records = read_log(db, user_id)
+    counts = {}
+    for card_id, (reviews, correct) in card_counts(cards, records, set(card_decks)).items():
+        counts.setdefault(card_decks[card_id], {})[card_id] = {"reviews": reviews, "correct": correct}
+    db.child(COUNTS).child(user_id).set(counts)
+    return sum(len(deck) for deck in counts.values())
+
+
+def _merge_updates(user_id, chunks, parts):
+    """Return (multi-path update, chunks after) merging consecutive ``chunks`` into chunks of up to
+    ``CHUNK_REVIEWS`` records, where ``parts`` has the (cards, records) of every chunk.
+
+    Each merged chunk keeps the key of the first chunk it replaces, so the log stays in order."""
+    keys = sorted(chunks)
+    updates, groups, current, size = {}, [], [], 0
+    for key in keys:
+        count = len(parts[key][1])
+        if current and size + count > CHUNK_REVIEWS:
+            groups.append(current)
+            current, size = [], 0
+        current.append(key)
+        size += count
+    if current:
+        groups.append(current)
+
+    for group in groups:
+        if len(group) == 1 and not isinstance(chunks[group[0]], str):
+            continue
+        cards, records = _merge(parts[key] for key in group)
+        updates[f"{LOG}/{user_id}/chunks/{group[0]}"] = _chunk([cards[index] for index in range(len(cards))], records)
+        for key in group[1:]:
+            updates[f"{LOG}/{user_id}/chunks/{key}"] = None
+    return updates, len(groups)
+
+
+def compact_recent(db, user_id):
+    """Merge the chunks appended since the last merge, once ``COMPACT_AFTER`` of them have been appended.
+
+    Costs one read of the ``open_chunks`` count. A merge first resets the count with a
+    conditional write, so of the requests that see it due only one merges and two merges
+    never rewrite the same chunks; it then reads only the counted chunks and the one before
+    them, which may still have room. Returns whether chunks were merged."""
+    path = f"{LOG}/{user_id}/{OPEN_CHUNKS}"
+    if (db.child(path).get().val() or 0) < COMPACT_AFTER:
+        return False
+    # The ETag is read before the count, as in firebase_ops.transaction
+    etag = db.child(path).get_etag()
+    appended = db.child(path).get().val() or 0
+    if appended < COMPACT_AFTER:
+        return False
+    result = db.child(path).conditional_set(0, etag)
+    if isinstance(result, dict) and list(result) == ["ETag"]:
+        return False
+
+    newest = db.child(LOG).child(user_id).child("chunks").order_by_key().limit_to_last(appended + 1).get().val()
+    chunks = _as_dict(newest)
+    # Chunks in the old form are left to compact_log, which has the log's cards to read them
+    legacy = [key for key, chunk in chunks.items() if isinstance(chunk, str)]
+    chunks = {key: chunk for key, chunk in chunks.items() if not legacy or key > max(legacy)}
+    updates, _ = _merge_updates(user_id, chunks, {key: _chunk_records(chunk, {}) for key, chunk in chunks.items()})
+    if updates:
+        db.update(updates)
+    return True
+
+
+def compact_log(db, user_id):
+    """Merge a user's chunks into as few chunks of up to ``CHUNK_REVIEWS`` records as possible.
+
+    Each merged chunk keeps the key of the first chunk it replaces, so the log stays in
+    order, and the rewrite is one multi-path update. Chunks in the old form are rewritten
+    with their own cards, after which the log's shared ``cards`` mapping is removed.
+    Returns (chunks before, chunks after)."""
+    log = db.child(LOG).child(user_id).get().val() or {}
+    legacy_cards = {int(index): card_id for index, card_id in _as_dict(log.get("cards")).items()}
+    chunks = _as_dict(log.get("chunks"))
+    parts = {key: _chunk_records(chunks[key], legacy_cards) for key in chunks}
+
+    updates, after = _merge_updates(user_id, chunks, parts)
+    if "cards" in log or "card_count" in log:
+        updates[f"{LOG}/{user_id}/cards"] = None
+        updates[f"{LOG}/{user_id}/card_count"] = None
+    if updates:
+        updates[f"{LOG}/{user_id}/{OPEN_CHUNKS}"] = None
+        db.update(updates)
+    return len(chunks), after
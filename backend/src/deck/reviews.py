@@ -0,0 +1,131 @@
+"""reviews.py is a file in deck folder that applies a sequence of card reviews by one user in memory.
+
+The batch and sync review endpoints use it to read the progress they need once per deck,
+run SM-2 over every review in order and collect all the writes, including the review log
+chunk, into one multi-path update."""
+
+from datetime import datetime, timezone
+
+try:
+    from . import sm2
+    from .due_index import DueCounts, index_updates
+    from .loader import load_deck_progress
+    from .progress import progress_updates
+    from .review_log import append_updates, count_updates
+    from .scheduler import deck_reviewer, read_settings
+except ImportError:
+    from deck import sm2
+    from deck.due_index import DueCounts, index_updates
+    from deck.loader import load_deck_progress
+    from deck.progress import progress_updates
+    from deck.review_log import append_updates, count_updates
+    from deck.scheduler import deck_reviewer, read_settings
+
+
+def parse_answered_at(value, default):
+    """Parse a review's ``answeredAt``, sent as an ISO 8601 string or epoch milliseconds.
+
+    Raises ValueError or TypeError when it is neither."""
+    if value is None:
+        return default
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.fromtimestamp(value / 1000, timezone.utc)
+    answered_at = datetime.fromisoformat(value)
+    return answered_at if answered_at.tzinfo else answered_at.replace(tzinfo=timezone.utc)
+
+
+def is_quality(value):
+    return isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= 5
+
+
+def parse_elapsed_ms(value):
+    """Return the milliseconds a review took to answer, as sent in ``elapsedMs``; 0 when missing or invalid"""
+    if not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0:
+        return 0
+    return min(int(value), 2**32 - 1)
+
+
+def apply_reviews(db, user_id, reviews, fuzz=False):
+    """Apply reviews to the user's card progress in memory.
+
+    ``reviews`` is a list of dicts with ``card_id``, ``quality``, ``answered_at`` (a datetime)
+    and optionally ``deck_id`` and ``elapsed_ms``, already in the order they happened. Cards without a deck are
+    looked up once each. Returns (updates, results, not_found): the multi-path update that
+    stores the final progress, due index entries, review log chunk and review counts, the
+    outcome of each review and the IDs of cards that do not exist. Reviews answered before the card's stored ``last_review``
+    are marked ``stale`` and do not change its schedule. Each deck is scheduled with the
+    algorithm the user chose for it; with ``fuzz`` each card is moved to the least loaded
+    day near its interval."""
+    card_decks = {}
+    for review in reviews:
+        if review.get("deck_id"):
+            card_decks.setdefault(review["card_id"], review["deck_id"])
+    for card_id in {review["card_id"] for review in reviews} - set(card_decks):
+        card_decks[card_id] = db.child("card").child(card_id).child("deckId").get().val()
+
+    # One progress read per deck in the batch
+    cards_by_deck = {}
+    for card_id, deck_id in card_decks.items():
+        if deck_id:
+            cards_by_deck.setdefault(deck_id, set()).add(card_id)
+    progress = {}
+    for deck_id, card_ids in cards_by_deck.items():
+        progress.update(load_deck_progress(db, user_id, deck_id, card_ids))
+
+    due_counts = {deck_id: DueCounts(db, user_id, deck_id) for deck_id in cards_by_deck} if fuzz else {}
+    settings = read_settings(db, user_id) if cards_by_deck else {}
+    reviewers = {deck_id: deck_reviewer(settings, deck_id) for deck_id in cards_by_deck}
+
+    results, not_found, changed, logged = [], [], {}, []
+    for review in reviews:
+        card_id = review["card_id"]
+        if not card_decks.get(card_id):
+            not_found.append(card_id)
+            continue
+        logged.append(review)
+        current = progress.get(card_id) or sm2.new_progress(review["answered_at"])
+        if current.get("last_review") and parse_answered_at(current["last_review"], None) > review["answered_at"]:
+            # A review that arrives after a later one for the same card was applied cannot be
+            # replayed into the schedule; it is kept out of SM-2 so it does not rewind it
+            results.append({"cardId": card_id, "stale": True, "nextReview": current["next_review"]})
+            continue
+        deck_counts = due_counts.get(card_decks[card_id])
+        update = reviewers[card_decks[card_id]](current, review["quality"], review["answered_at"], deck_counts)
+        if deck_counts is not None:
+            # Cards without progress are not in the due list yet
+            deck_counts.move(current["next_review"] if card_id in progress else None, update["next_review"])
+        progress[card_id] = {**current, **update}
+        changed[card_id] = card_decks[card_id]
+        results.append(
+            {
+                "cardId": card_id,
+                "nextReview": progress[card_id]["next_review"],
+                "newInterval": progress[card_id]["interval"],
+                "newEase": progress[card_id]["ease_factor"],
+            }
+        )
+
+    # Every review of an existing card is logged and counted, including stale ones
+    updates = append_updates(
+        db,
+        user_id,
+        [
+            (
+                review["card_id"],
+                int(review["answered_at"].timestamp()),
+                review["quality"],
+                review.get("elapsed_ms", 0),
+            )
+            for review in logged
+        ],
+    )
+    updates.update(
+        count_updates(
+            user_id, [(card_decks[review["card_id"]], review["card_id"], review["quality"]) for review in logged]
+        )
+    )
+
+    for card_id, deck_id in changed.items():
+        updates.update(progress_updates(user_id, deck_id, card_id, progress[card_id]))
+        updates.update(index_updates(user_id, deck_id, card_id, progress[card_id]))
+    return updates, results, not_found
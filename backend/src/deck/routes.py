@@ -22,21 +22,68 @@
 
 """routes.py is a file in deck folder that has all the functions defined that manipulate the deck. All CRUD functions are defined here."""
 
+import click
 from flask import Blueprint, jsonify, request
 from flask_cors import cross_origin
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 import json
 import base64
-import requests
 
 try:
     from .. import firebase
+    from ..cards.card_index import AmbiguousCard, index_path, lookup_card
+    from ..common.leaderboard_windows import WINDOWS, deck_board, top_snapshots
+    from ..common.response_cache import cards_key, deck_key, deck_list_key, response_cache
+    from .due_index import DAY, FUZZ_REVIEWS, DueCounts, index_updates, practice_queue, review_forecast
+    from .leaderboard import read_page, read_rank, read_summary, rebuild_summaries, save_score
+    from .loader import load_cards, load_deck_cards, load_deck_progress
+    from .progress import PROGRESS, migrate_user_progress, progress_updates, read_card_progress
+    from .review_log import LOG, append_updates, compact_log, compact_recent, count_updates, read_counts, rebuild_counts
+    from .reviews import apply_reviews, is_quality, parse_answered_at, parse_elapsed_ms
+    from .fsrs import fit_parameters
+    from .scheduler import SCHEDULERS, SETTINGS, collect_histories, deck_reviewer, deck_scheduler, read_settings
+    from .seen_reviews import claim_reviews, prune_seen_reviews, release_reviews
+    from .simulate import DEFAULT_QUALITY, format_report, simulate
+    from .sm2 import new_progress
+    from ..gamification.service import record_review, record_reviews
+    from ..gamification.worker import gamification_queue
 except ImportError:
     from __init__ import firebase
-
-
-deck_bp = Blueprint("deck_bp", __name__)
+    from cards.card_index import AmbiguousCard, index_path, lookup_card
+    from common.leaderboard_windows import WINDOWS, deck_board, top_snapshots
+    from common.response_cache import cards_key, deck_key, deck_list_key, response_cache
+    from deck.due_index import DAY, FUZZ_REVIEWS, DueCounts, index_updates, practice_queue, review_forecast
+    from deck.leaderboard import read_page, read_rank, read_summary, rebuild_summaries, save_score
+    from deck.loader import load_cards, load_deck_cards, load_deck_progress
+    from deck.progress import PROGRESS, migrate_user_progress, progress_updates, read_card_progress
+    from deck.review_log import (
+        LOG,
+        append_updates,
+        compact_log,
+        compact_recent,
+        count_updates,
+        read_counts,
+        rebuild_counts,
+    )
+    from deck.reviews import apply_reviews, is_quality, parse_answered_at, parse_elapsed_ms
+    from deck.fsrs import fit_parameters
+    from deck.scheduler import SCHEDULERS, SETTINGS, collect_histories, deck_reviewer, deck_scheduler, read_settings
+    from deck.seen_reviews import claim_reviews, prune_seen_reviews, release_reviews
+    from deck.simulate import DEFAULT_QUALITY, format_report, simulate
+    from deck.sm2 import new_progress
+    from gamification.service import record_review, record_reviews
+    from gamification.worker import gamification_queue
+
+
+MAX_SCHEDULE_DAYS = 365
+MAX_BATCH_REVIEWS = 500
+
+deck_bp = Blueprint("deck_bp", __name__, cli_group="deck")
 db = firebase.database()
+window_top = top_snapshots(firebase.database)
+
+MAX_LEADERBOARD_PAGE = 100
+MAX_NEIGHBOURS = 10
 
 
 @deck_bp.route("/deck/<id>", methods=["GET"])
@@ -44,8 +91,8 @@ db = firebase.database()
 def getdeck(id):
     """This method fetches a specific deck by its ID."""
     try:
-        deck = db.child("deck").child(id).get()
-        return jsonify(deck=deck.val(), message="Fetched deck successfully", status=200), 200
+        deck = response_cache.get(deck_key(id), lambda db: db.child("deck").child(id).get().val(), db)
+        return jsonify(deck=deck, message="Fetched deck successfully", status=200), 200
     except Exception as e:
         return jsonify(decks=[], message=f"An error occurred: {e}", status=400), 400
 
@@ -55,16 +102,10 @@ def getdeck(id):
 def get_deck_stats(id):
     """This method calculates stats of a specific deck by its ID."""
     try:
-        leaderboard_entries = db.child("leaderboard").child(id).get()
-        total_users = 0
-        total_correct = 0
-        total_incorrect = 0
-        if leaderboard_entries.val():
-            for entry in leaderboard_entries.each():
-                data = entry.val()
-                total_correct += data.get("correct", 0)
-                total_incorrect += data.get("incorrect", 0)
-                total_users += 1
+        summary = read_summary(db, id)
+        total_users = summary["users"]
+        total_correct = summary["correct"]
+        total_incorrect = summary["incorrect"]
         avg_correct = total_correct / total_users if total_users > 0 else 0
         avg_incorrect = total_incorrect / total_users if total_users > 0 else 0
         return jsonify(
@@ -88,29 +129,45 @@ def getdecks():
     localId = args.get("localId")
 
     try:
-        decks = []
-        if localId:
-            user_decks = db.child("deck").order_by_child("userId").equal_to(localId).get()
-            for deck in user_decks.each():
-                obj = deck.val()
-                obj["id"] = deck.key()
-                cards = db.child("card").order_by_child("deckId").equal_to(deck.key()).get()
-                obj["cards_count"] = len(cards.val()) if cards.val() else 0
-                decks.append(obj)
-        else:
-            alldecks = db.child("deck").order_by_child("visibility").equal_to("public").get()
-            for deck in alldecks.each():
-                obj = deck.val()
-                obj["id"] = deck.key()
-                cards = db.child("card").order_by_child("deckId").equal_to(deck.key()).get()
-                obj["cards_count"] = len(cards.val()) if cards.val() else 0
-                decks.append(obj)
-
+        decks = response_cache.get(deck_list_key(localId), lambda db: _list_decks(db, localId), db)
         return jsonify(decks=decks, message="Fetching decks successfully", status=200), 200
     except Exception as e:
         return jsonify(decks=[], message=f"An error occurred {e}", status=400), 400
 
 
+def _list_decks(db, localId):
+    if localId:
+        user_decks = db.child("deck").order_by_child("userId").equal_to(localId).get()
+    else:
+        user_decks = db.child("deck").order_by_child("visibility").equal_to("public").get()
+
+    # cards_count is maintained on the deck node by every card write, so the
+    # deck query alone answers this request
+    decks = []
+    for deck in user_decks.each() or []:
+        obj = deck.val()
+        obj["id"] = deck.key()
+        obj["cards_count"] = obj.get("cards_count", 0)
+        decks.append(obj)
+    return decks
+
+
+def _invalidate_deck(id, owner=None):
+    """Drop a deck and the deck lists it may be on from the response cache.
+
+    The owner is read from the deck when not given."""
+    if owner is None:
+        owner = db.child("deck").child(id).child("userId").get().val()
+    response_cache.invalidate(deck_key(id), deck_list_key(owner), deck_list_key())
+
+
+@deck_bp.route("/cache/metrics", methods=["GET"])
+@cross_origin(supports_credentials=True)
+def cache_metrics():
+    """Return this process's response cache hits, misses and invalidations since it started."""
+    return jsonify(metrics=response_cache.metrics(), message="Fetched cache metrics successfully", status=200), 200
+
+
 @deck_bp.route("/deck/create", methods=["POST"])
 @cross_origin(supports_credentials=True)
 def create():
@@ -132,6 +189,7 @@ def create():
                 "lastOpened": None,
             }
         )
+        response_cache.invalidate(deck_list_key(localId), deck_list_key())
 
         return jsonify(message="Create Deck Successful", status=201), 201
     except Exception as e:
@@ -152,6 +210,7 @@ def update(id):
         db.child("deck").child(id).update(
             {"userId": localId, "title": title, "description": description, "visibility": visibility}
         )
+        _invalidate_deck(id, localId)
 
         return jsonify(message="Update Deck Successful", status=201), 201
     except Exception as e:
@@ -163,7 +222,9 @@ def update(id):
 def delete(id):
     """Delete a deck."""
     try:
+        owner = db.child("deck").child(id).child("userId").get().val()
         db.child("deck").child(id).remove()
+        _invalidate_deck(id, owner)
         return jsonify(message="Delete Deck Successful", status=200), 200
     except Exception as e:
         return jsonify(message=f"Delete Deck Failed {e}", status=400), 400
@@ -172,10 +233,16 @@ def delete(id):
 @deck_bp.route("/deck/updateLastOpened/<id>", methods=["PATCH"])
 @cross_origin(supports_credentials=True)
 def update_last_opened(id):
-    """Update the lastOpened timestamp when a deck is opened."""
+    """Update the lastOpened timestamp when a deck is opened.
+
+    The client sends the ``localId`` of the user opening the deck, whose deck list shows it.
+    Other lists keep the old timestamp until they expire."""
     try:
         current_time = datetime.utcnow().isoformat()
         db.child("deck").child(id).update({"lastOpened": current_time})
+        # Decks are opened far more often than they change, so the owner is not read just to invalidate
+        localId = (request.get_json(silent=True) or {}).get("localId")
+        response_cache.invalidate(deck_key(id), *([deck_list_key(localId)] if localId else []))
         return jsonify(message="Deck lastOpened updated successfully", status=200), 200
     except Exception as e:
         return jsonify(message=f"Failed to update lastOpened: {e}", status=400), 400
@@ -184,32 +251,71 @@ def update_last_opened(id):
 @deck_bp.route("/deck/<deckId>/leaderboard", methods=["GET"])
 @cross_origin(supports_credentials=True)
 def get_leaderboard(deckId):
-    """This endpoint fetches the leaderboard data for a specific deck."""
-    try:
-        # Fetch leaderboard data for the given deck
-        leaderboard_entries = db.child("leaderboard").child(deckId).get()
-        leaderboard = []
-        for entry in leaderboard_entries.each():
-            data = entry.val()
-            leaderboard.append(
-                {
-                    "userEmail": data.get("userEmail"),
-                    "correct": data.get("correct", 0),
-                    "incorrect": data.get("incorrect", 0),
-                    "lastAttempt": data.get("lastAttempt"),
-                }
-            )
+    """This endpoint fetches a page of the leaderboard of a specific deck.
 
-        # Sort leaderboard by score (correct answers) then by last attempt (descending)
-        leaderboard.sort(key=lambda x: (x["correct"], x["lastAttempt"]), reverse=True)
+    ``limit`` (default and maximum 100) entries are returned, most correct answers first and
+    the most recent attempt first on ties; pass the ``next_cursor`` of a page as ``cursor`` to
+    get the next one.
+
+    With ``window`` (daily, weekly or monthly) users are ranked by the correct answers they
+    gave on the deck in the current period, from a snapshot of the top users; there is only one page."""
+    try:
+        limit = request.args.get("limit", str(MAX_LEADERBOARD_PAGE))
+        if not limit.isdigit() or not 1 <= int(limit) <= MAX_LEADERBOARD_PAGE:
+            return jsonify(
+                {"leaderboard": [], "message": f"limit must be between 1 and {MAX_LEADERBOARD_PAGE}", "status": 400}
+            ), 400
+        window = request.args.get("window")
+        if window is not None:
+            if window not in WINDOWS:
+                return jsonify(
+                    {"leaderboard": [], "message": f"window must be one of {', '.join(WINDOWS)}", "status": 400}
+                ), 400
+            leaderboard = [
+                {"userEmail": entry["name"], "correct": entry["score"], "rank": entry["rank"]}
+                for entry in window_top.get(deck_board(deckId), window)[: int(limit)]
+            ]
+            next_cursor = None
+        else:
+            try:
+                leaderboard, next_cursor = read_page(db, deckId, int(limit), request.args.get("cursor"))
+            except ValueError:
+                return jsonify({"leaderboard": [], "message": "Invalid cursor", "status": 400}), 400
 
         return jsonify(
-            {"leaderboard": leaderboard, "message": "Leaderboard data fetched successfully", "status": 200}
+            {
+                "leaderboard": leaderboard,
+                "next_cursor": next_cursor,
+                "message": "Leaderboard data fetched successfully",
+                "status": 200,
+            }
         ), 200
     except Exception as e:
         return jsonify({"leaderboard": [], "message": f"An error occurred: {e}", "status": 400}), 400
 
 
+@deck_bp.route("/deck/<deckId>/leaderboard/rank/<userId>", methods=["GET"])
+@cross_origin(supports_credentials=True)
+def get_leaderboard_rank(deckId, userId):
+    """This endpoint fetches a user's rank on a deck's leaderboard and up to ``neighbours``
+    (default 2, maximum 10) entries on each side of it, nearest first, without reading the
+    whole leaderboard."""
+    try:
+        neighbours = request.args.get("neighbours", "2")
+        if not neighbours.isdigit() or int(neighbours) > MAX_NEIGHBOURS:
+            return jsonify({"message": f"neighbours must be between 0 and {MAX_NEIGHBOURS}", "status": 400}), 400
+
+        ranked = read_rank(db, deckId, userId, int(neighbours))
+        if ranked is None:
+            return jsonify({"entry": None, "message": "User has no score on this deck", "status": 404}), 404
+        entry, above, below = ranked
+        return jsonify(
+            {"entry": entry, "above": above, "below": below, "message": "Rank fetched successfully", "status": 200}
+        ), 200
+    except Exception as e:
+        return jsonify({"message": f"An error occurred: {e}", "status": 400}), 400
+
+
 @deck_bp.route("/deck/<deck_id>/update-leaderboard", methods=["POST"])
 @cross_origin(supports_credentials=True)
 def update_leaderboard(deck_id):
@@ -224,15 +330,17 @@ def update_leaderboard(deck_id):
         if not user_id:
             return jsonify({"message": "User ID is required"}), 400  # Validate userId presence
 
-        # Use user_id from request body to update the leaderboard
-        leaderboard_ref = db.child("leaderboard").child(deck_id).child(user_id)
-        leaderboard_ref.update(
+        # Use user_id from request body to update the leaderboard and the deck's summary
+        save_score(
+            db,
+            deck_id,
+            user_id,
             {
                 "userEmail": user_email,
                 "correct": correct,
                 "incorrect": incorrect,
                 "lastAttempt": datetime.now().isoformat(),
-            }
+            },
         )
 
         return jsonify({"message": "Leaderboard updated successfully"}), 200
@@ -273,127 +381,179 @@ def get_user_score(deckId, userId):
 @deck_bp.route("/deck/<user_id>/record-answer", methods=["POST"])
 @cross_origin(supports_credentials=True)
 def record_answer(user_id):
-    """Update card progress using SM-2 algorithm with frontend-provided ease"""
+    """Update card progress using SM-2 algorithm with frontend-provided ease.
+
+    The card is identified by ``cardId`` when the client sends it. Older clients send the
+    card's front, back and hint instead, which are resolved through the card_hash index; a card
+    found in several decks without a ``deckId`` is answered with 409 unless the user has studied
+    it in only one of them. ``deckId`` is optional; without it the card's deck is read to find
+    the progress partition."""
     try:
         data = request.get_json()
+        card_id = data.get("cardId")
         front = data.get("front")
         back = data.get("back")
         hint = data.get("hint")
         quality = data.get("quality")
 
-        if None in (user_id, front, back, hint, quality):
+        if quality is None or (not card_id and None in (front, back, hint)):
             return jsonify({"message": "All fields must be provided"}), 400
+        if not is_quality(quality):
+            return jsonify({"message": "quality must be an integer from 0 to 5"}), 400
 
-        # Find card by front/back/hint
-        query_result = db.child("card").order_by_child("front").equal_to(front).get()
-        card_id = next(
-            (
-                card.key()
-                for card in query_result.each()
-                if card.val().get("back") == back and card.val().get("hint") == hint
-            ),
-            None,
-        )
-        print("user id", user_id)
-        print("card_id", card_id)
-
+        deck_id = data.get("deckId")
         if not card_id:
-            return jsonify({"message": "Card not found"}), 404
+            try:
+                card_id, deck_id = lookup_card(db, front, back, hint, deck_id, user_id)
+            except AmbiguousCard as e:
+                return jsonify({"message": str(e)}), 409
 
-        progress_ref = db.child("user_card_progress").child(user_id).child(card_id)
+        # Progress is stored per deck, so the card's deck is needed before it can be read
+        if card_id and not deck_id:
+            deck_id = db.child("card").child(card_id).child("deckId").get().val()
 
-        progress = progress_ref.get().val() or {
-            "interval": 1,
-            "repetitions": 0,
-            "ease_factor": 2.5,
-            "next_review": datetime.now(timezone.utc).isoformat(),
-        }
+        if not card_id or not deck_id:
+            return jsonify({"message": "Card not found"}), 404
 
-        # Extract current values
-        current_interval = progress["interval"]
-        current_repetitions = progress["repetitions"]
-        current_ease = progress["ease_factor"]
-
-        # https://github.com/thyagoluciano/sm2
-        if quality < 3:  # Incorrect or needs retry
-            new_interval = 1
-            new_repetitions = 0
-            new_ease = max(1.3, current_ease - 0.2)
-            next_review_delta = timedelta(days=1)
-        else:  # Correct answer
-            new_repetitions = current_repetitions + 1
-
-            # Calculate interval
-            if current_repetitions == 0:
-                new_interval = 1
-            elif current_repetitions == 1:
-                new_interval = 6
+        now = datetime.now(timezone.utc)
+        progress = read_card_progress(db, user_id, deck_id, card_id) or new_progress(now)
+        due_counts = DueCounts(db, user_id, deck_id) if FUZZ_REVIEWS else None
+        review = deck_reviewer(read_settings(db, user_id), deck_id)
+        progress_update = review(progress, quality, now, due_counts)
+
+        # Write the progress, the deck's due index, the review log and the review counts in one multi-path update
+        progress = {**progress, **progress_update}
+        updates = progress_updates(user_id, deck_id, card_id, progress)
+        updates.update(index_updates(user_id, deck_id, card_id, progress))
+        record = (card_id, int(now.timestamp()), quality, parse_elapsed_ms(data.get("elapsedMs")))
+        updates.update(append_updates(db, user_id, [record]))
+        updates.update(count_updates(user_id, [(deck_id, card_id, quality)]))
+        db.update(updates)
+        _compact_recent_reviews(user_id)
+
+        # Streak, XP and achievements are applied by the background gamification workers;
+        # the result can be fetched from /gamification/latest/<user_id>
+        try:
+            if gamification_queue.enabled:
+                gamification_queue.submit(
+                    user_id, {"quality": quality, "card_id": card_id, "timezone": data.get("timezone", "UTC")}
+                )
+                gamification_info = {"queued": True}
             else:
-                new_interval = round(current_interval * current_ease, 2)
-
-            # Calculate new ease factor (SM-2 formula)
-            quality_bonus = 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02)
-            new_ease = max(1.3, current_ease + quality_bonus)
-            next_review_delta = timedelta(days=new_interval)
-
-        progress_update = {
-            "interval": new_interval,
-            "repetitions": new_repetitions,
-            "ease_factor": new_ease,
-            "next_review": (datetime.now(timezone.utc) + next_review_delta).isoformat(),
-            "last_review": datetime.now(timezone.utc).isoformat(),
-            "confidence": quality,  # Store quality as confidence level
-        }
+                gamification_info = record_review(db, user_id, quality, card_id, data.get("timezone", "UTC"))
+        except Exception as e:
+            # If gamification fails, log but continue
+            print(f"Gamification error: {str(e)}")
+            gamification_info = {}
 
-        db.child("user_card_progress").child(user_id).child(card_id).update(progress_update)
+        return jsonify(
+            {
+                "message": "Progress updated",
+                "nextReview": progress_update["next_review"],
+                "newInterval": progress_update["interval"],
+                "newEase": progress_update["ease_factor"],
+                "gamification": gamification_info,
+            }
+        ), 200
 
-        # Record activity for streaks
-        try:
-            # First record activity to track streak
-            activity_data = {"timezone": "UTC"}  # Default to UTC if no timezone provided
-
-            # Call gamification API to record activity
-            gamification_response = requests.post(
-                f"{request.host_url}gamification/record-activity/{user_id}",
-                json=activity_data,
-                headers={"Content-Type": "application/json"},
-            )
+    except Exception as e:
+        return jsonify({"message": f"Error: {str(e)}"}), 500
 
-            # Award XP for reviewing a card
-            xp_data = {"activity_type": "review_card", "metadata": {"quality": quality, "card_id": card_id}}
 
-            # Call gamification API to award XP
-            xp_response = requests.post(
-                f"{request.host_url}gamification/award-xp/{user_id}",
-                json=xp_data,
-                headers={"Content-Type": "application/json"},
-            )
+def _compact_recent_reviews(user_id):
+    """Merge the user's newest review log chunks once enough have been appended"""
+    try:
+        compact_recent(db, user_id)
+    except Exception as e:
+        # The reviews are saved; the chunks are merged by a later request instead
+        print(f"Review log compaction error: {str(e)}")
 
-            # Get gamification data from responses
-            streak_data = gamification_response.json() if gamification_response.status_code == 200 else {}
-            xp_data = xp_response.json() if xp_response.status_code == 200 else {}
-
-            # Combine gamification data with response
-            gamification_info = {
-                "streak": streak_data.get("streak", {}),
-                "achievements_earned": (
-                    streak_data.get("achievements_earned", []) + xp_data.get("achievements_earned", [])
-                ),
-                "xp_earned": xp_data.get("xp_earned", 0),
-                "level_up": xp_data.get("level_up", False),
-                "new_level": xp_data.get("level", 0),
+
+def _parse_reviews(data, reviews, require_ids=False):
+    """Validate a list of reviews from a request and return them sorted by when they were answered.
+
+    Returns (reviews, error message)."""
+    now = datetime.now(timezone.utc)
+    parsed = []
+    for review in reviews:
+        if not isinstance(review, dict) or not review.get("cardId") or not is_quality(review.get("quality")):
+            return None, "Each review needs a cardId and a quality from 0 to 5"
+        if require_ids and (not review.get("id") or review.get("answeredAt") is None):
+            return None, "Each review needs an id and answeredAt"
+        try:
+            answered_at = parse_answered_at(review.get("answeredAt"), now)
+        except (TypeError, ValueError):
+            return None, f"Invalid answeredAt for card {review['cardId']}"
+        parsed.append(
+            {
+                "id": review.get("id"),
+                "card_id": review["cardId"],
+                "quality": review["quality"],
+                "answered_at": answered_at,
+                "deck_id": review.get("deckId") or data.get("deckId"),
+                "elapsed_ms": parse_elapsed_ms(review.get("elapsedMs")),
             }
-        except Exception as e:
-            # If gamification fails, log but continue
-            print(f"Gamification error: {str(e)}")
-            gamification_info = {}
+        )
+    parsed.sort(key=lambda review: review["answered_at"])
+    return parsed, None
+
+
+def _session_gamification(user_id, reviews, not_found, user_timezone):
+    """Apply streak, XP and achievements for a batch of reviews with one update"""
+    events = [
+        {"quality": review["quality"], "card_id": review["card_id"], "timezone": user_timezone}
+        for review in reviews
+        if review["card_id"] not in not_found
+    ]
+    try:
+        if not events:
+            return {}
+        if gamification_queue.enabled:
+            gamification_queue.submit_many(user_id, events)
+            return {"queued": True}
+        return record_reviews(db, user_id, events)
+    except Exception as e:
+        # If gamification fails, log but continue
+        print(f"Gamification error: {str(e)}")
+        return {}
+
+
+@deck_bp.route("/deck/<user_id>/record-answers", methods=["POST"])
+@cross_origin(supports_credentials=True)
+def record_answers(user_id):
+    """Record a whole study session of answers in one request.
+
+    The body is ``{"reviews": [{"cardId", "quality", "answeredAt"}, ...]}`` with optional
+    ``deckId`` and ``timezone`` for the whole batch (``deckId`` may also be set per review).
+    ``answeredAt`` is an ISO 8601 string or epoch milliseconds and defaults to now. SM-2 is
+    applied to the reviews in the order they were answered, every progress change is
+    written with one multi-path update and gamification runs once for the batch."""
+    try:
+        data = request.get_json(silent=True) or {}
+        reviews = data.get("reviews")
+
+        if not isinstance(reviews, list) or not reviews:
+            return jsonify({"message": "reviews must be a non-empty list"}), 400
+        if len(reviews) > MAX_BATCH_REVIEWS:
+            return jsonify({"message": f"At most {MAX_BATCH_REVIEWS} reviews can be sent at once"}), 400
+
+        parsed, error = _parse_reviews(data, reviews)
+        if error:
+            return jsonify({"message": error}), 400
+
+        updates, results, not_found = apply_reviews(db, user_id, parsed, FUZZ_REVIEWS)
+        if updates:
+            db.update(updates)
+            _compact_recent_reviews(user_id)
+
+        # One gamification update for the whole session
+        gamification_info = _session_gamification(user_id, parsed, not_found, data.get("timezone", "UTC"))
 
         return jsonify(
             {
                 "message": "Progress updated",
-                "nextReview": progress_update["next_review"],
-                "newInterval": new_interval,
-                "newEase": new_ease,
+                "results": results,
+                "notFound": not_found,
                 "gamification": gamification_info,
             }
         ), 200
@@ -402,45 +562,72 @@ def record_answer(user_id):
         return jsonify({"message": f"Error: {str(e)}"}), 500
 
 
-@deck_bp.route("/deck/<deck_id>/practice-cards/<user_id>", methods=["GET"])
+@deck_bp.route("/deck/<user_id>/sync-reviews", methods=["POST"])
 @cross_origin(supports_credentials=True)
-def get_practice_cards(deck_id, user_id):
-    """Get cards due for review using spaced repetition"""
+def sync_reviews(user_id):
+    """Apply reviews queued by an offline client. Safe to retry.
+
+    The body is ``{"reviews": [{"id", "cardId", "quality", "answeredAt"}, ...]}`` where ``id``
+    is generated by the client for each review. Reviews whose ID was already synced are
+    skipped, the rest are applied in ``answeredAt`` order and written with one update."""
     try:
-        deck_cards = db.child("card").order_by_child("deckId").equal_to(deck_id).get()
-        card_ids = [card.key() for card in deck_cards.each()]
+        data = request.get_json(silent=True) or {}
+        reviews = data.get("reviews")
 
-        progress_ref = db.child("user_card_progress").child(user_id).get()
-        all_progress = progress_ref.val() or {}
+        if not isinstance(reviews, list) or not reviews:
+            return jsonify({"message": "reviews must be a non-empty list"}), 400
+        if len(reviews) > MAX_BATCH_REVIEWS:
+            return jsonify({"message": f"At most {MAX_BATCH_REVIEWS} reviews can be sent at once"}), 400
 
-        practice_cards = []
-        now = datetime.now(timezone.utc)  # Use UTC consistently
+        parsed, error = _parse_reviews(data, reviews, require_ids=True)
+        if error:
+            return jsonify({"message": error}), 400
 
-        for card_id in card_ids:
-            card_data = db.child("card").child(card_id).get().val()
-            progress = all_progress.get(card_id)
+        now = datetime.now(timezone.utc)
+        claimed, duplicates, expired = claim_reviews(db, user_id, parsed, now)
+        try:
+            updates, results, not_found = apply_reviews(db, user_id, claimed, FUZZ_REVIEWS)
+            if updates:
+                db.update(updates)
+        except Exception:
+            release_reviews(db, user_id, claimed)
+            raise
+        if updates:
+            _compact_recent_reviews(user_id)
+
+        gamification_info = _session_gamification(user_id, claimed, not_found, data.get("timezone", "UTC"))
+        prune_seen_reviews(db, user_id, now)
 
-            if not progress:
-                practice_cards.append({**card_data, "progress": None, "due_date": datetime.min.isoformat()})
-                continue
+        return jsonify(
+            {
+                "message": "Reviews synced",
+                "applied": [review["id"] for review in claimed if review["card_id"] not in not_found],
+                "duplicates": [review["id"] for review in duplicates],
+                "expired": [review["id"] for review in expired],
+                "notFound": not_found,
+                "results": results,
+                "gamification": gamification_info,
+            }
+        ), 200
+
+    except Exception as e:
+        return jsonify({"message": f"Error: {str(e)}"}), 500
 
-            try:
-                next_review = datetime.fromisoformat(progress["next_review"])
-                if next_review <= now:
-                    practice_cards.append({**card_data, "progress": progress, "due_date": progress["next_review"]})
-            except (KeyError, ValueError):
-                practice_cards.append({**card_data, "progress": progress, "due_date": datetime.min.isoformat()})
-
-        # Sort priority:
-        # 1. New cards (denoted by no progress)
-        # 2. Oldest due dates
-        # 3. Lowest ease factors
-        practice_cards.sort(key=lambda x: (x["due_date"], x["progress"]["ease_factor"] if x["progress"] else 0))
-
-        result_cards = []
-        for card in practice_cards[:20]:
-            card.pop("due_date", None)
-            result_cards.append(card)
+
+@deck_bp.route("/deck/<deck_id>/practice-cards/<user_id>", methods=["GET"])
+@cross_origin(supports_credentials=True)
+def get_practice_cards(deck_id, user_id):
+    """Get cards due for review using spaced repetition.
+
+    New cards come first, then the cards that have been due the longest, read from the
+    user's due index for the deck rather than by scanning every card in it. Only the picked
+    cards are read, by key; the whole deck is read only when the index has to be rebuilt."""
+    try:
+        queue = practice_queue(db, user_id, deck_id, limit=20)
+        cards = load_cards(db, [card_id for card_id, _ in queue])
+        result_cards = [
+            {**cards[card_id], "id": card_id, "progress": progress} for card_id, progress in queue if card_id in cards
+        ]
 
         return jsonify({"cards": result_cards, "message": "Spaced repetition cards retrieved"}), 200
 
@@ -451,44 +638,63 @@ def get_practice_cards(deck_id, user_id):
 @deck_bp.route("/deck/<deck_id>/practice-schedule/<user_id>", methods=["GET"])
 @cross_origin(supports_credentials=True)
 def practice_schedule(deck_id, user_id):
-    """Get the practice schedule for future iterations of cards"""
+    """Get the forecast of how many reviews are due on each of the next ``days`` days (default 7).
+
+    Each day lists its date, the start of the day as an epoch and the IDs of the cards due.
+    With ``compact=true`` only the counts are returned, in a list starting at ``start``.
+    Overdue cards are counted on today and new cards, which have no date yet, separately."""
     try:
-        deck_cards = db.child("card").order_by_child("deckId").equal_to(deck_id).get()
-        card_ids = [card.key() for card in deck_cards.each()]
+        days = request.args.get("days", "7")
+        if not days.isdigit() or not 1 <= int(days) <= MAX_SCHEDULE_DAYS:
+            return jsonify({"message": f"days must be between 1 and {MAX_SCHEDULE_DAYS}", "status": 400}), 400
+        compact = request.args.get("compact", "false").lower() in ("1", "true")
 
-        progress_ref = db.child("user_card_progress").child(user_id).get()
-        all_progress = progress_ref.val() or {}
+        day_start, buckets, overdue, new_cards = review_forecast(db, user_id, deck_id, int(days))
 
-        practice_cards = []
-        now = datetime.now(timezone.utc)  # Use UTC consistently
+        response = {"start": day_start, "overdue": overdue, "new": new_cards}
+        if compact:
+            response["counts"] = [len(bucket) for bucket in buckets]
+        else:
+            response["schedule"] = [
+                {
+                    "date": datetime.fromtimestamp(day_start + index * DAY, timezone.utc).strftime("%Y-%m-%d"),
+                    "start": day_start + index * DAY,
+                    "count": len(bucket),
+                    "cardIds": bucket,
+                }
+                for index, bucket in enumerate(buckets)
+            ]
 
-        for card_id in card_ids:
-            card_data = db.child("card").child(card_id).get().val()
-            progress = all_progress.get(card_id)
+        return jsonify({**response, "message": "Practice schedule retrieved", "status": 200}), 200
 
-            if not progress:
-                practice_cards.append({**card_data, "progress": None, "due_date": datetime.min.isoformat()})
-                continue
+    except Exception as e:
+        return jsonify({"message": f"Error: {str(e)}"}), 500
 
-            try:
-                next_review = datetime.fromisoformat(progress["next_review"])
-                if next_review <= now:
-                    practice_cards.append({**card_data, "progress": progress, "due_date": progress["next_review"]})
-            except (KeyError, ValueError):
-                practice_cards.append({**card_data, "progress": progress, "due_date": datetime.min.isoformat()})
-
-        # Sort priority:
-        # 1. New cards (denoted by no progress)
-        # 2. Oldest due dates
-        # 3. Lowest ease factors
-        practice_cards.sort(key=lambda x: (x["due_date"], x["progress"]["ease_factor"] if x["progress"] else 0))
-
-        result_cards = []
-        for card in practice_cards[:20]:
-            card.pop("due_date", None)
-            result_cards.append(card)
 
-        return jsonify({"cards": result_cards, "message": "Spaced repetition cards retrieved"}), 200
+@deck_bp.route("/deck/<deck_id>/scheduler/<user_id>", methods=["GET", "PUT"])
+@cross_origin(supports_credentials=True)
+def deck_scheduler_setting(deck_id, user_id):
+    """Get or set the spaced repetition algorithm (``sm2`` or ``fsrs``) the user's reviews of a deck are scheduled with.
+
+    PUT takes ``{"scheduler": name}``. Cards keep their progress when the algorithm changes."""
+    try:
+        if request.method == "PUT":
+            name = (request.get_json(silent=True) or {}).get("scheduler")
+            if name not in SCHEDULERS:
+                return jsonify({"message": f"scheduler must be one of {', '.join(SCHEDULERS)}", "status": 400}), 400
+            db.child(SETTINGS).child(user_id).child("decks").child(deck_id).set(name)
+            return jsonify({"scheduler": name, "message": "Scheduler updated", "status": 200}), 200
+
+        settings = read_settings(db, user_id)
+        fitted = (settings.get("fsrs") or {}).get("fitted_at")
+        return jsonify(
+            {
+                "scheduler": deck_scheduler(settings, deck_id),
+                "fsrsFittedAt": fitted,
+                "message": "Scheduler retrieved",
+                "status": 200,
+            }
+        ), 200
 
     except Exception as e:
         return jsonify({"message": f"Error: {str(e)}"}), 500
@@ -574,11 +780,17 @@ def import_deck():
         new_deck = db.child("deck").push(deck_data)
         deck_id = new_deck["name"]  # Get the new deck ID
 
-        # Create the cards
+        # Create the cards and index them by content
+        card_index = {}
         for card in import_data["cards"]:
             card["deckId"] = deck_id
             card["userId"] = user_id
-            db.child("card").push(card)
+            card_ref = db.child("card").push(card)
+            card_index[index_path(card)] = card_ref["name"]
+
+        if card_index:
+            db.update(card_index)
+        response_cache.invalidate(deck_list_key(user_id), deck_list_key(), cards_key(deck_id))
 
         return jsonify({"deckId": deck_id, "message": "Deck imported successfully", "status": 201}), 201
 
@@ -592,13 +804,13 @@ def card_statistics(deck_id, user_id):
     """Get comprehensive statistics about cards in a deck for a specific user"""
     try:
         # Get all cards for this deck
-        deck_cards = db.child("card").order_by_child("deckId").equal_to(deck_id).get()
-        if not deck_cards.val():
+        deck_cards = load_deck_cards(db, deck_id)
+        if not deck_cards:
             return jsonify({"message": "No cards found for this deck", "statistics": {}}), 200
 
-        # Fetch progress data for all cards
-        progress_ref = db.child("user_card_progress").child(user_id).get()
-        all_progress = progress_ref.val() or {}
+        # Fetch progress data for all cards, and each card's review counts for this deck
+        all_progress = load_deck_progress(db, user_id, deck_id, deck_cards)
+        logged = read_counts(db, user_id, deck_id)
 
         # Initialize statistics containers
         now = datetime.now(timezone.utc)
@@ -619,9 +831,7 @@ def card_statistics(deck_id, user_id):
         }
 
         # Process each card in the deck
-        for card in deck_cards.each():
-            card_id = card.key()
-            card_data = card.val()
+        for card_id, card_data in deck_cards.items():
             statistics["total_cards"] += 1
 
             # Get card progress
@@ -659,15 +869,17 @@ def card_statistics(deck_id, user_id):
             else:
                 statistics["confidence_levels"]["high"] += 1
 
-            # Get correct answer count
-            correct_count = progress.get("correct", 0)
+            if card_id in logged:
+                total_reviews, correct_count = logged[card_id]
+            else:
+                # Reviewed before the review log existed: estimate from the stored progress
+                correct_count = progress.get("correct", 0)
+                total_reviews = progress.get("repetitions", 0)
+                if progress.get("last_review"):  # If there was at least one review
+                    total_reviews = max(1, total_reviews)
             card_info["correct_count"] = correct_count
+            card_info["total_reviews"] = total_reviews
             statistics["performance"]["correct_count"] += correct_count
-
-            # Count total reviews based on repetitions if available
-            total_reviews = progress.get("repetitions", 0)
-            if progress.get("last_review"):  # If there was at least one review
-                total_reviews = max(1, total_reviews)
             statistics["performance"]["total_reviews"] += total_reviews
 
             # Process next review date
@@ -711,3 +923,160 @@ def card_statistics(deck_id, user_id):
 
     except Exception as e:
         return jsonify({"message": f"Error retrieving card statistics: {str(e)}", "status": 400}), 400
+
+
+@deck_bp.cli.command("backfill-card-counts")
+def backfill_card_counts():
+    """Recompute ``cards_count`` on every deck from the cards that actually exist.
+
+    Run with ``flask --app api deck backfill-card-counts`` from ``backend/src`` to repair
+    decks created before the counter was maintained, or counts that drifted."""
+    counts = {}
+    for deck in db.child("deck").shallow().get().val() or []:
+        counts[deck] = 0
+
+    for card in db.child("card").get().each() or []:
+        deck_id = card.val().get("deckId")
+        if deck_id in counts:
+            counts[deck_id] += 1
+
+    if counts:
+        db.update({f"deck/{deck_id}/cards_count": count for deck_id, count in counts.items()})
+    print(f"Updated cards_count on {len(counts)} decks")
+
+
+@deck_bp.cli.command("rebuild-card-index")
+def rebuild_card_index():
+    """Rewrite the whole ``card_hash`` index from the cards, one ``card_hash/<hash>/<deck>`` entry per card.
+
+    Run with ``flask --app api deck rebuild-card-index`` from ``backend/src`` after upgrading
+    from the unscoped ``card_hash/<hash>`` index, which this replaces."""
+    index = {}
+    for card in db.child("card").get().each() or []:
+        if card.val().get("deckId"):
+            _, key, deck_id = index_path(card.val()).split("/")
+            index.setdefault(key, {})[deck_id] = card.key()
+    db.child("card_hash").set(index)
+    decks = {deck_id for entries in index.values() for deck_id in entries}
+    print(f"Indexed {sum(len(entries) for entries in index.values())} cards in {len(decks)} decks")
+
+
+@deck_bp.cli.command("rebuild-leaderboard-summaries")
+def rebuild_leaderboard_summaries():
+    """Recompute the deck summaries, ``leaderboard_totals`` and ``user_leaderboard`` from the leaderboard entries.
+
+    Run with ``flask --app api deck rebuild-leaderboard-summaries`` from ``backend/src``
+    after upgrading an existing database, or if a summary drifted."""
+    decks, users = rebuild_summaries(db)
+    print(f"Rebuilt the leaderboard summary of {decks} decks and the totals and scores of {users} users")
+
+
+@deck_bp.cli.command("migrate-progress")
+def migrate_progress():
+    """Move progress stored as ``user_card_progress/<user>/<card>`` to ``user_card_progress/<user>/<deck>/<card>``.
+
+    Run with ``flask --app api deck migrate-progress`` from ``backend/src``. Users are
+    migrated one at a time with one update each, and the command can be re-run safely."""
+    card_decks = {card.key(): card.val().get("deckId") for card in db.child("card").get().each() or []}
+
+    users = moved = orphaned = 0
+    for user_id in db.child(PROGRESS).shallow().get().val() or []:
+        user_moved, user_orphaned = migrate_user_progress(db, user_id, card_decks)
+        users += 1
+        moved += user_moved
+        orphaned += user_orphaned
+    print(f"Moved {moved} progress entries for {users} users ({orphaned} entries for deleted cards left in place)")
+
+
+@deck_bp.cli.command("rebuild-review-counts")
+def rebuild_review_counts():
+    """Recompute every user's ``user_review_counts`` from their review log.
+
+    Run with ``flask --app api deck rebuild-review-counts`` from ``backend/src`` once after
+    upgrading, so reviews logged before the counts were kept show in card statistics. A
+    user's counts are replaced in one write, so reviews they record while it runs may be lost
+    from the counts; run it when few reviews are being recorded."""
+    card_decks = {
+        card.key(): card.val()["deckId"] for card in db.child("card").get().each() or [] if card.val().get("deckId")
+    }
+
+    users = cards = 0
+    for user_id in db.child(LOG).shallow().get().val() or []:
+        cards += rebuild_counts(db, user_id, card_decks)
+        users += 1
+    print(f"Rebuilt the review counts of {cards} cards for {users} users")
+
+
+@deck_bp.cli.command("simulate-load")
+@click.option("--users", default=100000, show_default=True, help="Number of simulated users.")
+@click.option("--cards", default=100, show_default=True, help="Cards in each user's deck.")
+@click.option("--days", default=30, show_default=True, help="Number of days to simulate.")
+@click.option("--new-per-day", default=10, show_default=True, help="New cards an active user studies each day.")
+@click.option("--activity", default=0.7, show_default=True, help="Chance a user studies on a given day.")
+@click.option(
+    "--quality",
+    default=",".join(str(p) for p in DEFAULT_QUALITY),
+    show_default=True,
+    help="Comma-separated probabilities of answering with quality 0 to 5.",
+)
+@click.option("--peak-hours", default=4.0, show_default=True, help="Hours over which each day's reviews arrive.")
+@click.option("--seed", default=0, show_default=True, help="Random seed.")
+def simulate_load(users, cards, days, new_per_day, activity, quality, peak_hours, seed):
+    """Estimate the daily review, write and XP load of a user population under the SM-2 scheduler.
+
+    Run with ``flask --app api deck simulate-load`` from ``backend/src``. Nothing is read
+    from or written to Firebase."""
+    try:
+        load = simulate(users, cards, days, new_per_day, activity, [float(p) for p in quality.split(",")], seed)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--quality")
+    print(format_report(load, peak_hours))
+
+
+@deck_bp.cli.command("fit-fsrs")
+@click.option("--all-users", is_flag=True, help="Also fit users who have not opted any deck into FSRS.")
+def fit_fsrs(all_users):
+    """Fit each user's FSRS parameters to their review log.
+
+    Run with ``flask --app api deck fit-fsrs`` from ``backend/src``, e.g. nightly. Users
+    with too little history keep the default parameters."""
+    if all_users:
+        users = list(db.child(LOG).shallow().get().val() or [])
+    else:
+        users = [
+            user.key()
+            for user in db.child(SETTINGS).get().each() or []
+            if "fsrs" in ((user.val() or {}).get("decks") or {}).values()
+        ]
+
+    fitted = 0
+    for user_id in users:
+        result = fit_parameters(collect_histories(db, user_id))
+        if result is None:
+            continue
+        params, loss, reviews = result
+        db.child(SETTINGS).child(user_id).child("fsrs").set(
+            {
+                "params": params,
+                "log_loss": round(loss, 4),
+                "reviews": reviews,
+                "fitted_at": datetime.now(timezone.utc).isoformat(),
+            }
+        )
+        fitted += 1
+    print(f"Fitted FSRS parameters for {fitted} of {len(users)} users")
+
+
+@deck_bp.cli.command("compact-review-log")
+def compact_review_log():
+    """Merge the small chunks appended to each user's review log into chunks of up to 512 reviews.
+
+    Run with ``flask --app api deck compact-review-log`` from ``backend/src`` once after
+    upgrading; since then each request merges a user's newest chunks as they are appended."""
+    users = before = after = 0
+    for user_id in db.child(LOG).shallow().get().val() or []:
+        user_before, user_after = compact_log(db, user_id)
+        users += 1
+        before += user_before
+        after += user_after
+    print(f"Compacted {before} review log chunks into {after} for {users} users")
@@ -0,0 +1,58 @@
+"""scheduler.py is a file in deck folder that picks the spaced repetition algorithm used for a user's deck.
+
+A scheduler is a module with ``review(progress, quality, reviewed_at, due_counts=None,
+params=None)`` returning the progress fields a review changes. SM-2 is the default; users
+opt a deck into FSRS, whose parameters are fitted to their review log by ``flask --app api
+deck fit-fsrs``. Both live at ``user_scheduler/<user>`` as ``{"decks": {deck: name},
+"fsrs": {"params": [...], ...}}`` so one keyed read gives everything a review needs."""
+
+try:
+    from . import fsrs, sm2
+    from .review_log import card_histories, read_log
+except ImportError:
+    from deck import fsrs, sm2
+    from deck.review_log import card_histories, read_log
+
+SCHEDULERS = {"sm2": sm2, "fsrs": fsrs}
+DEFAULT_SCHEDULER = "sm2"
+SETTINGS = "user_scheduler"
+
+
+def read_settings(db, user_id):
+    """Return the user's scheduler settings"""
+    return db.child(SETTINGS).child(user_id).get().val() or {}
+
+
+def deck_scheduler(settings, deck_id):
+    """Return the name of the scheduler the user chose for a deck"""
+    name = (settings.get("decks") or {}).get(deck_id)
+    return name if name in SCHEDULERS else DEFAULT_SCHEDULER
+
+
+def fsrs_params(settings):
+    """Return the user's fitted FSRS parameters, or None to use the defaults"""
+    params = (settings.get("fsrs") or {}).get("params")
+    if isinstance(params, dict):
+        # Firebase may hand a stored list back as an object keyed by index
+        params = [params[key] for key in sorted(params, key=int)]
+    return params if params and len(params) == len(fsrs.DEFAULT_PARAMS) else None
+
+
+def collect_histories(db, user_id):
+    """Return the review history of every card in the user's review log, for ``fsrs.fit_parameters``"""
+    cards, records = read_log(db, user_id)
+    return list(card_histories(cards, records).values())
+
+
+def deck_reviewer(settings, deck_id):
+    """Return a ``review(progress, quality, reviewed_at, due_counts=None)`` function applying the
+    scheduler the user chose for a deck"""
+    name = deck_scheduler(settings, deck_id)
+    params = fsrs_params(settings) if name == "fsrs" else None
+
+    def review(progress, quality, reviewed_at, due_counts=None):
+        update = SCHEDULERS[name].review(progress, quality, reviewed_at, due_counts, params)
+        update["scheduler"] = name
+        return update
+
+    return review
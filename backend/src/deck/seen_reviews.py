@@ -0,0 +1,92 @@
+"""seen_reviews.py is a file in deck folder that remembers which client review IDs a user has already synced.
+
+Offline clients replay their queued reviews when they reconnect and may send the same
+review more than once. Each review ID is stored as a 16 character hash under the UTC day
+it was answered, ``user_seen_reviews/<user>/d<epoch day>/<hash>``, so a sync reads only the days
+it touches. Days older than ``SEEN_REVIEW_DAYS`` are pruned; reviews answered before then
+cannot be checked and are rejected as expired."""
+
+import hashlib
+import os
+
+try:
+    from ..common.firebase_ops import transaction
+    from .due_index import DAY
+except ImportError:
+    from common.firebase_ops import transaction
+    from deck.due_index import DAY
+
+SEEN = "user_seen_reviews"
+SEEN_REVIEW_DAYS = int(os.getenv("SEEN_REVIEW_DAYS", "60"))
+
+
+def review_key(review_id):
+    """Return the compact key stored for a client review ID"""
+    return hashlib.sha256(str(review_id).encode("utf-8")).hexdigest()[:16]
+
+
+def _day(review):
+    return int(review["answered_at"].timestamp()) // DAY
+
+
+def _day_key(day):
+    # Prefixed so Firebase never mistakes the day numbers for array indexes
+    return f"d{day}"
+
+
+def claim_reviews(db, user_id, reviews, now):
+    """Mark reviews as seen and return (claimed, duplicates, expired) lists of them.
+
+    Each day's set is updated with a conditional write, so when two syncs carrying the
+    same review run at once exactly one of them claims it. Reviews repeated within the
+    list are duplicates of their first occurrence."""
+    oldest_day = int(now.timestamp()) // DAY - SEEN_REVIEW_DAYS
+    by_day, expired = {}, []
+    for review in reviews:
+        if _day(review) < oldest_day:
+            expired.append(review)
+        else:
+            by_day.setdefault(_day(review), []).append(review)
+
+    claimed_ids = set()
+    for day, day_reviews in by_day.items():
+        outcome = {}
+
+        def claim(current):
+            seen = dict(current or {})
+            outcome["claimed"] = set()
+            for review in day_reviews:
+                key = review_key(review["id"])
+                if key not in seen:
+                    seen[key] = 1
+                    outcome["claimed"].add(review["id"])
+            return seen
+
+        transaction(db, f"{SEEN}/{user_id}/{_day_key(day)}", claim)
+        claimed_ids |= outcome["claimed"]
+
+    claimed, duplicates = [], []
+    for review in reviews:
+        if _day(review) < oldest_day:
+            continue
+        if review["id"] in claimed_ids:
+            claimed.append(review)
+            claimed_ids.discard(review["id"])
+        else:
+            duplicates.append(review)
+    return claimed, duplicates, expired
+
+
+def release_reviews(db, user_id, reviews):
+    """Forget claimed reviews whose changes could not be written, so the client can retry them"""
+    if reviews:
+        db.update({f"{SEEN}/{user_id}/{_day_key(_day(review))}/{review_key(review['id'])}": None for review in reviews})
+
+
+def prune_seen_reviews(db, user_id, now):
+    """Delete the user's seen-review days that are older than the retention window"""
+    oldest_day = int(now.timestamp()) // DAY - SEEN_REVIEW_DAYS
+    days = db.child(SEEN).child(user_id).shallow().get().val() or []
+    stale = {f"{SEEN}/{user_id}/{day}": None for day in days if int(day[1:]) < oldest_day}
+    if stale:
+        db.update(stale)
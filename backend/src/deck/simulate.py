@@ -0,0 +1,202 @@
+"""simulate.py is a file in deck folder that simulates the review load a population of users puts on the backend.
+
+Every user studies one deck with the SM-2 scheduler used by the review endpoints. Each
+day an active user reviews every card that is due plus a number of new cards, answering
+with qualities drawn from a configurable distribution. The state of all users and cards
+is kept in NumPy arrays and stepped one day at a time, so 100k users run in seconds.
+Run it with ``flask --app api deck simulate-load``."""
+
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import math
+
+import numpy as np
+
+try:
+    from ..common.leaderboard_windows import XP_BOARD, counter_updates
+    from ..gamification.service import XP_CORRECT_ANSWER, XP_REVIEW_CARD, XP_STREAK_MULTIPLIER
+    from ..gamification.xp_leaderboard import index_updates as xp_index_updates
+    from .due_index import FUZZ_REVIEWS, index_updates
+    from .progress import LEGACY_PROGRESS_READS, progress_updates
+    from .review_log import count_updates
+    from .sm2 import DAY, schedule_batch
+except ImportError:
+    from common.leaderboard_windows import XP_BOARD, counter_updates
+    from gamification.service import XP_CORRECT_ANSWER, XP_REVIEW_CARD, XP_STREAK_MULTIPLIER
+    from gamification.xp_leaderboard import index_updates as xp_index_updates
+    from deck.due_index import FUZZ_REVIEWS, index_updates
+    from deck.progress import LEGACY_PROGRESS_READS, progress_updates
+    from deck.review_log import count_updates
+    from deck.sm2 import DAY, schedule_batch
+
+# The request counts below follow the requests the endpoints make, with the server's
+# REVIEW_FUZZ and PROGRESS_LEGACY_READS settings, for clients that send each card's ``cardId``
+# and ``deckId``; tests/test_simulate.py checks them against the endpoints. A record-answer
+# without ``deckId`` makes one more request per review to read the card's deck.
+
+# record-answer, per review: the card's progress read, the user's settings read, the
+# multi-path update and the read of the review log's open chunk count; with REVIEW_FUZZ also
+# the query counting the deck's due cards. The merge of the log's newest chunks every
+# COMPACT_AFTER requests is left out.
+REVIEW_REQUESTS = 4 + int(FUZZ_REVIEWS)
+# record-answer, per first review of a card: the read of its progress at the legacy location
+NEW_CARD_REQUESTS = int(LEGACY_PROGRESS_READS)
+DECK_READ_REQUESTS = 1
+# record-answers, per session: the deck's progress read, the settings read, the multi-path
+# update and the open chunk count read; with PROGRESS_LEGACY_READS also the shallow read of the
+# user's legacy progress keys, and with REVIEW_FUZZ the due count query
+SESSION_REQUESTS = 4 + int(LEGACY_PROGRESS_READS) + int(FUZZ_REVIEWS)
+# One gamification profile update, per review or per session: ETag read, profile read,
+# conditional write, then the update of the user's XP leaderboard entry and XP window counters
+GAMIFICATION_REQUESTS = 4
+
+# The path counts are taken from the update builders the endpoints use, applied to one review.
+# record-answer writes the progress, the due index entries, one review log chunk and the
+# increment of the log's open chunk count (the chunk is keyed by a new push key, so these are
+# counted here rather than built) and the review count increments.
+_WRONG_COUNTS, _CORRECT_COUNTS = (len(count_updates("user", [("deck", "card", quality)])) for quality in (0, 5))
+PATHS_PER_REVIEW = (
+    len(progress_updates("user", "deck", "card", {}))
+    + len(index_updates("user", "deck", "card", {}))
+    + 2
+    + _WRONG_COUNTS
+)
+# A review answered with quality 3 or more also increments the correct answer count
+PATHS_PER_CORRECT = _CORRECT_COUNTS - _WRONG_COUNTS
+# The gamification update after each review moves the user's XP leaderboard entry (its
+# histogram bucket only moves every RANK_BUCKET_XP, so is left out) and adds to the XP counters
+GAMIFICATION_PATHS = len(xp_index_updates("user", 0, {"xp": 1}, 1)) + len(
+    counter_updates(XP_BOARD, "user", 1, datetime.now(timezone.utc), "user@example.com")
+)
+
+DEFAULT_QUALITY = (0.05, 0.05, 0.10, 0.25, 0.30, 0.25)
+
+
+@dataclass
+class DailyLoad:
+    """Totals for each simulated day, as arrays indexed by day"""
+
+    active_users: np.ndarray
+    sessions: np.ndarray
+    reviews: np.ndarray
+    new_cards: np.ndarray
+    xp: np.ndarray
+    correct: np.ndarray
+
+    @property
+    def paths_written(self):
+        return self.reviews * (PATHS_PER_REVIEW + GAMIFICATION_PATHS) + self.correct * PATHS_PER_CORRECT
+
+
+def _empty_load(days):
+    return DailyLoad(*(np.zeros(days, dtype=np.int64) for _ in range(6)))
+
+
+def _xp_table():
+    """Return the XP awarded for a review, indexed by [streak, quality], as the gamification service awards it.
+
+    The streak bonus stops growing at 50%, so the last row is used for every longer streak."""
+    longest = int(np.ceil(0.5 / XP_STREAK_MULTIPLIER))
+    table = np.zeros((longest + 1, 6), dtype=np.int64)
+    for streak in range(longest + 1):
+        for quality in range(6):
+            xp = XP_REVIEW_CARD + XP_CORRECT_ANSWER.get(quality, 0)
+            if streak > 1:
+                xp = math.ceil(xp * (1 + min(0.5, streak * XP_STREAK_MULTIPLIER)))
+            table[streak, quality] = xp
+    return table
+
+
+def _draw_qualities(rng, cumulative, size):
+    """Draw ``size`` answer qualities from the cumulative quality distribution"""
+    draws = rng.random(size, dtype=np.float32)
+    answers = np.zeros(size, dtype=np.int8)
+    for threshold in cumulative[:-1]:
+        answers += draws >= threshold
+    return answers
+
+
+def simulate(users, cards, days, new_per_day=20, activity=0.7, quality=DEFAULT_QUALITY, seed=0, chunk_size=10000):
+    """Simulate ``users`` users studying a deck of ``cards`` cards for ``days`` days and return a DailyLoad.
+
+    ``activity`` is the chance a user studies on a given day and ``quality`` the
+    probabilities of answering with quality 0 to 5. Users are simulated ``chunk_size`` at a
+    time to bound memory; every chunk is fully vectorized over its users and cards."""
+    quality = np.asarray(quality, dtype=np.float64)
+    if quality.shape != (6,) or quality.min() < 0 or not np.isclose(quality.sum(), 1):
+        raise ValueError("quality must be 6 probabilities, for qualities 0 to 5, that sum to 1")
+
+    rng = np.random.default_rng(seed)
+    cumulative = np.cumsum(quality)
+    xp_table = _xp_table()
+    load = _empty_load(days)
+    card_index = np.arange(cards, dtype=np.int32)
+
+    for start in range(0, users, chunk_size):
+        n = min(chunk_size, users - start)
+        # One row per user and one column per card, flattened so reviewed cards are picked with one index
+        interval = np.ones(n * cards)
+        repetitions = np.zeros(n * cards, dtype=np.int64)
+        ease = np.full(n * cards, 2.5)
+        due_day = np.full((n, cards), np.iinfo(np.int32).max, dtype=np.int32)
+        introduced = np.zeros(n, dtype=np.int32)
+        streak = np.zeros(n, dtype=np.int64)
+
+        for day in range(days):
+            active = rng.random(n) < activity
+            streak = np.where(active, streak + 1, 0)
+
+            # Cards are introduced in order, so a user's new cards are the next slice of the deck
+            new_limit = np.where(active, np.minimum(introduced + new_per_day, cards), introduced)
+            new_mask = (card_index >= introduced[:, None]) & (card_index < new_limit[:, None])
+            review_mask = new_mask | ((due_day <= day) & active[:, None])
+            new_cards = int((new_limit - introduced).sum())
+            introduced = new_limit
+
+            reviewed = np.flatnonzero(review_mask)
+            answers = _draw_qualities(rng, cumulative, len(reviewed))
+            interval[reviewed], repetitions[reviewed], ease[reviewed], next_review = schedule_batch(
+                interval[reviewed], repetitions[reviewed], ease[reviewed], answers, day * DAY
+            )
+            # A card becomes available on the first day at or after its next review time
+            due_day.ravel()[reviewed] = -(-next_review // DAY)
+
+            user_streak = np.minimum(streak[reviewed // cards], len(xp_table) - 1)
+            load.active_users[day] += active.sum()
+            load.sessions[day] += review_mask.any(axis=1).sum()
+            load.reviews[day] += len(reviewed)
+            load.new_cards[day] += new_cards
+            load.xp[day] += int(xp_table[user_streak, answers].sum())
+            load.correct[day] += int((answers >= 3).sum())
+
+    return load
+
+
+def format_report(load, peak_hours=4):
+    """Return a printable table of the daily load and the peak request rates it implies.
+
+    Request rates assume each day's reviews arrive within ``peak_hours`` hours."""
+    lines = [f"{'day':>4} {'active':>9} {'sessions':>9} {'reviews':>11} {'new':>10} {'paths':>11} {'xp':>12}"]
+    for day in range(len(load.reviews)):
+        lines.append(
+            f"{day:>4} {load.active_users[day]:>9} {load.sessions[day]:>9} {load.reviews[day]:>11} "
+            f"{load.new_cards[day]:>10} {load.paths_written[day]:>11} {load.xp[day]:>12}"
+        )
+
+    peak = int(np.argmax(load.reviews))
+    seconds = peak_hours * 60 * 60
+    reviews = int(load.reviews[peak])
+    sessions = int(load.sessions[peak])
+    single = reviews * (REVIEW_REQUESTS + GAMIFICATION_REQUESTS) + int(load.new_cards[peak]) * NEW_CARD_REQUESTS
+    single_qps = single / seconds
+    no_deck_qps = (single + reviews * DECK_READ_REQUESTS) / seconds
+    batch_qps = sessions * (SESSION_REQUESTS + GAMIFICATION_REQUESTS) / seconds
+    xp_per_review = load.xp.sum() / max(1, load.reviews.sum())
+    lines += [
+        "",
+        f"Peak day {peak}: {reviews} reviews from {sessions} sessions",
+        f"Firebase requests/s over {peak_hours}h: {single_qps:.1f} with record-answer "
+        f"({no_deck_qps:.1f} without deckId), {batch_qps:.1f} with record-answers",
+        f"Average XP per review: {xp_per_review:.2f}",
+    ]
+    return "\n".join(lines)
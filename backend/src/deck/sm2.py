@@ -0,0 +1,119 @@
+"""sm2.py is a file in deck folder that implements the SM-2 spaced repetition scheduler used for card progress.
+
+``schedule`` applies one review to one card. ``schedule_batch`` applies one review to each
+card in NumPy arrays, for the simulation and forecasting tools, and gives exactly the same
+results as calling ``schedule`` on every card.
+
+https://github.com/thyagoluciano/sm2"""
+
+from datetime import timedelta
+
+import numpy as np
+
+DAY = 24 * 60 * 60
+MIN_EASE = 1.3
+# Load-balanced scheduling may move a card up to 5% of its interval (at least a day) either way
+FUZZ_FACTOR = 0.05
+MIN_FUZZ_INTERVAL = 3
+
+
+def _quality_bonus(quality):
+    return 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02)
+
+
+# _quality_bonus for qualities 0-5, so schedule_batch can look bonuses up instead of computing them
+_QUALITY_BONUS = np.array([_quality_bonus(quality) for quality in range(6)])
+
+
+def schedule(interval, repetitions, ease, quality):
+    """Return the (interval in days, repetitions, ease factor) of a card after a review with ``quality`` (0-5)"""
+    if quality < 3:  # Incorrect or needs retry
+        return 1, 0, max(MIN_EASE, ease - 0.2)
+
+    # Correct answer
+    if repetitions == 0:
+        new_interval = 1
+    elif repetitions == 1:
+        new_interval = 6
+    else:
+        # Rounded to 2 decimals the same way as np.round so both APIs agree exactly
+        new_interval = round(interval * ease * 100) / 100
+
+    return new_interval, repetitions + 1, max(MIN_EASE, ease + _quality_bonus(quality))
+
+
+def next_review_epoch(reviewed_at, interval):
+    """Return the epoch (seconds) a card is next due, ``interval`` days after ``reviewed_at``"""
+    return reviewed_at + round(interval * DAY)
+
+
+def schedule_batch(interval, repetitions, ease, quality, reviewed_at):
+    """Apply one review to each card, given as arrays of equal length (``reviewed_at`` may be a scalar epoch).
+
+    Returns arrays of the new interval, repetitions, ease factor and next review epoch."""
+    interval = np.asarray(interval, dtype=np.float64)
+    repetitions = np.asarray(repetitions, dtype=np.int64)
+    ease = np.asarray(ease, dtype=np.float64)
+    quality = np.asarray(quality, dtype=np.int64)
+
+    correct = quality >= 3
+    grown = np.round(interval * ease, 2)
+    new_interval = np.where(repetitions == 0, 1.0, np.where(repetitions == 1, 6.0, grown))
+    new_interval = np.where(correct, new_interval, 1.0)
+    new_repetitions = np.where(correct, repetitions + 1, 0)
+    new_ease = np.maximum(MIN_EASE, np.where(correct, ease + _QUALITY_BONUS[quality], ease - 0.2))
+    next_review = np.asarray(reviewed_at, dtype=np.int64) + np.rint(new_interval * DAY).astype(np.int64)
+    return new_interval, new_repetitions, new_ease, next_review
+
+
+def fuzz_range(interval):
+    """Return the (earliest, latest) whole-day intervals a card due in ``interval`` days may be moved to,
+    or None if the interval is too short to move"""
+    if interval < MIN_FUZZ_INTERVAL:
+        return None
+    spread = max(1, round(interval * FUZZ_FACTOR))
+    days = round(interval)
+    return days - spread, days + spread
+
+
+def balance_interval(interval, reviewed_at, due_counts):
+    """Return the interval within ``fuzz_range(interval)`` whose day has the fewest cards due.
+
+    ``reviewed_at`` is an epoch and ``due_counts(first_day, last_day)`` returns a mapping of
+    epoch day (UTC) to the number of the user's cards due that day. Ties go to the day
+    nearest the SM-2 interval, then the earlier day."""
+    window = fuzz_range(interval)
+    if window is None:
+        return interval
+    earliest, latest = window
+    counts = due_counts((reviewed_at + earliest * DAY) // DAY, (reviewed_at + latest * DAY) // DAY)
+    return min(
+        range(earliest, latest + 1),
+        key=lambda days: (counts.get((reviewed_at + days * DAY) // DAY, 0), abs(days - interval), days),
+    )
+
+
+def new_progress(now):
+    """Return the progress of a card the user has never reviewed"""
+    return {"interval": 1, "repetitions": 0, "ease_factor": 2.5, "next_review": now.isoformat()}
+
+
+def review(progress, quality, reviewed_at, due_counts=None, params=None):
+    """Return the progress fields that change when a card is answered with ``quality`` (0-5) at ``reviewed_at``.
+
+    With ``due_counts`` (see ``balance_interval``) the next review is moved to the least
+    loaded day near the SM-2 interval. SM-2 has no per-user ``params``; the argument keeps
+    the signature shared with the other schedulers."""
+    new_interval, new_repetitions, new_ease = schedule(
+        progress["interval"], progress["repetitions"], progress["ease_factor"], quality
+    )
+    if due_counts is not None:
+        new_interval = balance_interval(new_interval, int(reviewed_at.timestamp()), due_counts)
+    return {
+        "interval": new_interval,
+        "repetitions": new_repetitions,
+        "ease_factor": new_ease,
+        "next_review": (reviewed_at + timedelta(days=new_interval)).isoformat(),
+        "last_review": reviewed_at.isoformat(),
+        "confidence": quality,  # Store quality as confidence level
+    }
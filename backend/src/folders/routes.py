@@ -28,8 +28,10 @@ from flask_cors import cross_origin  # type: ignore
 
 try:
     from .. import firebase
+    from ..common.response_cache import folders_key, response_cache
 except ImportError:
     from __init__ import firebase
+    from common.response_cache import folders_key, response_cache
 
 folder_bp = Blueprint("folder_bp", __name__)
 
@@ -60,27 +62,38 @@ def getfolders():
     args = request.args
     userId = args and args["userId"]
     try:
-        user_folders = db.child("folder").order_by_child("userId").equal_to(userId).get()
-        folders = []
-        for folder in user_folders.each():
-            obj = folder.val()
-            obj["id"] = folder.key()
-            decks = db.child("folder_deck").order_by_child("folderId").equal_to(folder.key()).get()
-            obj["decks"] = []
-            if decks.each():
-                for deck in decks.each():
-                    deck_obj = deck.val()
-                    deck_obj["id"] = deck.key()
-                    obj["decks"].append(deck_obj)
-
-            obj["decks_count"] = len(obj["decks"])
-            folders.append(obj)
-
+        folders = response_cache.get(folders_key(userId), lambda db: _list_folders(db, userId), db)
         return jsonify(folders=folders, message="Fetched folders successfully", status=200), 200
     except Exception as e:
         return jsonify(folders=[], message=f"An error occurred: {e}", status=400), 400
 
 
+def _list_folders(db, userId):
+    user_folders = db.child("folder").order_by_child("userId").equal_to(userId).get()
+    folders = []
+    for folder in user_folders.each():
+        obj = folder.val()
+        obj["id"] = folder.key()
+        decks = db.child("folder_deck").order_by_child("folderId").equal_to(folder.key()).get()
+        obj["decks"] = []
+        if decks.each():
+            for deck in decks.each():
+                deck_obj = deck.val()
+                deck_obj["id"] = deck.key()
+                obj["decks"].append(deck_obj)
+
+        obj["decks_count"] = len(obj["decks"])
+        folders.append(obj)
+    return folders
+
+
+def _invalidate_folders(folder_id, owner=None):
+    """Drop the folder list of a folder's owner from the response cache, reading the owner when not given"""
+    if owner is None:
+        owner = db.child("folder").child(folder_id).child("userId").get().val()
+    response_cache.invalidate(folders_key(owner))
+
+
 @folder_bp.route("/folder/create", methods=["POST"])
 @cross_origin(supports_credentials=True)
 def createfolder():
@@ -95,6 +108,7 @@ def createfolder():
         user_id = data["userId"]
         folder_ref = db.child("folder").push({"name": folder_name, "userId": user_id})
         new_folder_id = folder_ref["name"]  # Retrieve auto-generated ID
+        _invalidate_folders(new_folder_id, user_id)
         return jsonify(
             folder={"id": new_folder_id, "name": folder_name, "decks": []},
             message="Folder created successfully",
@@ -117,6 +131,7 @@ def updatefolder(id):
         folder_name = data.get("name")
 
         db.child("folder").child(id).update({"name": folder_name})
+        _invalidate_folders(id)
 
         return jsonify(message="Folder updated successfully", status=201), 201
     except Exception as e:
@@ -131,7 +146,9 @@ def deletefolder(id):
     DELETE /folder/delete/{id}
     """
     try:
+        owner = db.child("folder").child(id).child("userId").get().val()
         db.child("folder").child(id).remove()
+        _invalidate_folders(id, owner)
 
         return jsonify(message="Folder deleted successfully", status=200), 200
     except Exception as e:
@@ -152,6 +169,7 @@ def adddecktofolder():
         deck_id = data["deckId"]
 
         db.child("folder_deck").push({"folderId": folder_id, "deckId": deck_id})
+        _invalidate_folders(folder_id)
 
         return jsonify(message="Deck added to folder successfully", status=201), 201
     except Exception as e:
@@ -176,6 +194,7 @@ def removedeckfromfolder():
             if fd.val().get("deckId") == deck_id:
                 db.child("folder_deck").child(fd.key()).remove()
                 break
+        _invalidate_folders(folder_id)
 
         return jsonify(message="Deck removed from folder successfully", status=200), 200
     except Exception as e:
@@ -0,0 +1,393 @@
+"""service.py is a file in the gamification folder that holds the XP, level, streak and achievement logic.
+
+The functions here work on an in-memory profile, so a caller reads ``user_gamification/<user>``
+once, applies every change and writes it back once. The write is conditional on the profile
+not having changed since it was read, so concurrent updates from several server processes
+are retried instead of losing XP. The gamification routes and the deck review endpoint both
+call into this module directly instead of going through HTTP."""
+
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import math
+
+try:
+    from ..common.firebase_ops import transaction
+    from ..common.leaderboard_windows import XP_BOARD, counter_updates
+    from .xp_leaderboard import display_name, index_updates
+except ImportError:
+    from common.firebase_ops import transaction
+    from common.leaderboard_windows import XP_BOARD, counter_updates
+    from gamification.xp_leaderboard import display_name, index_updates
+
+# XP Constants
+XP_REVIEW_CARD = 5  # Base XP for reviewing a card
+XP_CORRECT_ANSWER = {
+    0: 0,  # Complete blackout
+    1: 1,  # Incorrect - Barely recognized
+    2: 2,  # Incorrect - But recognized answer
+    3: 5,  # Correct - But difficult recall
+    4: 8,  # Correct - After some hesitation
+    5: 10,  # Perfect recall
+}
+XP_PERFECT_DECK = 50  # Bonus for completing all cards in a deck with perfect recall
+XP_STREAK_MULTIPLIER = 0.1  # 10% XP bonus per day of streak
+
+# Level system constants
+XP_PER_LEVEL = 100  # Base XP required for first level
+LEVEL_SCALING = 1.5  # How much each level scales in XP requirement
+
+# Achievement IDs and XP rewards. Each achievement is unlocked once the profile value at
+# "metric" (section.field) reaches "threshold"; adding one here needs no other code.
+ACHIEVEMENTS = {
+    "streak_3_days": {
+        "name": "Learning Rhythm",
+        "description": "Maintain a 3-day study streak",
+        "xp_reward": 30,
+        "metric": "streak.current_streak",
+        "threshold": 3,
+    },
+    "streak_7_days": {
+        "name": "Weekly Warrior",
+        "description": "Maintain a 7-day study streak",
+        "xp_reward": 100,
+        "metric": "streak.current_streak",
+        "threshold": 7,
+    },
+    "streak_30_days": {
+        "name": "Monthly Master",
+        "description": "Maintain a 30-day study streak",
+        "xp_reward": 500,
+        "metric": "streak.current_streak",
+        "threshold": 30,
+    },
+    "perfect_recall_10": {
+        "name": "Memory Novice",
+        "description": "Get perfect recall on 10 cards",
+        "xp_reward": 50,
+        "metric": "stats.perfect_recalls",
+        "threshold": 10,
+    },
+    "perfect_recall_50": {
+        "name": "Memory Expert",
+        "description": "Get perfect recall on 50 cards",
+        "xp_reward": 200,
+        "metric": "stats.perfect_recalls",
+        "threshold": 50,
+    },
+    "perfect_recall_100": {
+        "name": "Memory Master",
+        "description": "Get perfect recall on 100 cards",
+        "xp_reward": 500,
+        "metric": "stats.perfect_recalls",
+        "threshold": 100,
+    },
+    "complete_deck": {
+        "name": "Deck Complete",
+        "description": "Complete your first deck",
+        "xp_reward": 100,
+        "metric": "stats.decks_completed",
+        "threshold": 1,
+    },
+    "complete_5_decks": {
+        "name": "Deck Collector",
+        "description": "Complete 5 different decks",
+        "xp_reward": 300,
+        "metric": "stats.decks_completed",
+        "threshold": 5,
+    },
+    "first_quiz": {
+        "name": "Quiz Taker",
+        "description": "Complete your first quiz",
+        "xp_reward": 50,
+        "metric": "stats.quizzes_completed",
+        "threshold": 1,
+    },
+    "perfect_quiz": {
+        "name": "Perfect Quiz",
+        "description": "Get a perfect score on a quiz",
+        "xp_reward": 100,
+        "metric": "stats.perfect_quizzes",
+        "threshold": 1,
+    },
+}
+
+# Rule table evaluated by evaluate_achievements: (achievement_id, section, field, threshold)
+ACHIEVEMENT_RULES = [
+    (achievement_id, *achievement["metric"].split("."), achievement["threshold"])
+    for achievement_id, achievement in ACHIEVEMENTS.items()
+]
+
+
+def calculate_level(xp):
+    """Calculate user level based on XP"""
+    if xp == 0:
+        return 0
+
+    # Formula: level = log(xp/base_xp, scaling_factor) + 1
+    # This creates increasing XP requirements per level
+    return min(100, math.floor(math.log(xp / XP_PER_LEVEL, LEVEL_SCALING) + 1))
+
+
+def xp_for_next_level(current_level):
+    """Calculate XP needed for next level"""
+    return math.floor(XP_PER_LEVEL * (LEVEL_SCALING**current_level))
+
+
+def new_profile():
+    """Return the profile of a user who has no gamification data yet"""
+    return {
+        "xp": 0,
+        "achievements": {},
+        "streak": {"current_streak": 0, "longest_streak": 0, "last_activity_date": None},
+        "stats": {
+            "cards_reviewed": 0,
+            "perfect_recalls": 0,
+            "decks_completed": 0,
+            "quizzes_completed": 0,
+            "perfect_quizzes": 0,
+        },
+    }
+
+
+def _with_defaults(profile):
+    """Fill in any sections Firebase dropped from a stored profile because they were empty"""
+    profile = dict(profile or {})
+    defaults = new_profile()
+    for key, value in defaults.items():
+        profile.setdefault(key, value)
+    for key, value in defaults["stats"].items():
+        profile["stats"].setdefault(key, value)
+    return profile
+
+
+def update_profile(db, user_id, change):
+    """Apply ``change(profile)`` to a user's profile and write it back as one conditional write.
+
+    If another writer updated the profile in between, ``change`` is run again on the new
+    value, so it must only modify the profile it is given. The user's XP leaderboard entry
+    and daily, weekly and monthly XP counters are then updated if their XP or achievements
+    changed. The user's email is kept on the profile as ``user_email``, looked up once for
+    profiles that do not have it yet, so the counters carry the name the windowed boards
+    show. Returns the profile that was written and whatever the successful ``change`` call
+    returned."""
+    outcome = {}
+
+    def apply(current):
+        profile = _with_defaults(current)
+        # (XP, achievements) the leaderboard entry was written with; None if it has none yet
+        outcome["previous"] = (profile["xp"], len(profile["achievements"] or {})) if current else None
+        if not profile.get("user_email"):
+            if "user_email" not in outcome:
+                outcome["user_email"] = display_name(db, user_id)
+            profile["user_email"] = outcome["user_email"]
+        outcome["profile"] = profile
+        outcome["result"] = change(profile)
+        return profile
+
+    transaction(db, f"user_gamification/{user_id}", apply)
+    profile, previous = outcome["profile"], outcome["previous"]
+    if previous is None:
+        updates = index_updates(user_id, None, profile, calculate_level(profile["xp"]), profile["user_email"])
+    elif previous != (profile["xp"], len(profile["achievements"] or {})):
+        updates = index_updates(user_id, previous[0], profile, calculate_level(profile["xp"]))
+    else:
+        updates = {}
+    xp_earned = profile["xp"] - (previous[0] if previous else 0)
+    if xp_earned > 0:
+        now = datetime.now(timezone.utc)
+        updates.update(counter_updates(XP_BOARD, user_id, xp_earned, now, profile["user_email"]))
+    if updates:
+        db.update(updates)
+    return profile, outcome["result"]
+
+
+def add_level_info(profile):
+    """Add the calculated level fields the frontend displays to a profile"""
+    current_xp = profile.get("xp", 0)
+    current_level = calculate_level(current_xp)
+    next_level_xp = xp_for_next_level(current_level)
+
+    profile["level"] = current_level
+    profile["next_level_xp"] = next_level_xp
+    profile["xp_progress"] = current_xp - xp_for_next_level(current_level - 1) if current_level > 0 else current_xp
+    profile["xp_needed"] = next_level_xp - xp_for_next_level(current_level - 1) if current_level > 0 else next_level_xp
+    return profile
+
+
+def grant_achievement(profile, achievement_id):
+    """Add an achievement and its XP reward to the profile.
+
+    Returns the achievement record, or None when it is unknown or was already earned."""
+    if achievement_id not in ACHIEVEMENTS:
+        return None
+
+    achievements = profile.setdefault("achievements", {})
+    if achievement_id in achievements:
+        return None
+
+    achievement = ACHIEVEMENTS[achievement_id]
+    achievement_data = {
+        "id": achievement_id,
+        "name": achievement["name"],
+        "description": achievement["description"],
+        "date_earned": datetime.now(timezone.utc).isoformat(),
+        "xp_awarded": achievement["xp_reward"],
+    }
+    achievements[achievement_id] = achievement_data
+    profile["xp"] = profile.get("xp", 0) + achievement["xp_reward"]
+    return achievement_data
+
+
+def evaluate_achievements(profile):
+    """Grant every achievement whose rule the in-memory profile now satisfies.
+
+    All rules are checked in a single pass and no I/O is done, so the caller saves the
+    profile once afterwards. Returns the newly earned achievement records."""
+    unlocked = profile.get("achievements") or {}
+    earned = []
+    for achievement_id, section, field, threshold in ACHIEVEMENT_RULES:
+        if achievement_id in unlocked:
+            continue
+        if (profile.get(section) or {}).get(field, 0) >= threshold:
+            earned.append(grant_achievement(profile, achievement_id))
+    return earned
+
+
+def _local_now(user_timezone):
+    """Return the current time in the user's timezone, falling back to UTC for unknown names"""
+    try:
+        tz = ZoneInfo(user_timezone or "UTC")
+    except (ZoneInfoNotFoundError, ValueError):
+        tz = timezone.utc
+    return datetime.now(timezone.utc).astimezone(tz)
+
+
+def apply_activity(profile, user_timezone="UTC"):
+    """Update the study streak for activity happening now"""
+    current_date = _local_now(user_timezone)
+    current_date_str = current_date.strftime("%Y-%m-%d")
+
+    streak_data = profile.get("streak", {})
+    last_activity_date = streak_data.get("last_activity_date")
+    current_streak = streak_data.get("current_streak", 0)
+    longest_streak = streak_data.get("longest_streak", 0)
+
+    # If this is first activity ever
+    if not last_activity_date:
+        current_streak = 1
+        longest_streak = max(longest_streak, 1)
+    else:
+        # Calculate days difference
+        last_date = datetime.strptime(last_activity_date, "%Y-%m-%d").date()
+        days_diff = (current_date.date() - last_date).days
+
+        # Same day - no streak update
+        if days_diff == 0:
+            pass
+        # Next day - increment streak
+        elif days_diff == 1:
+            current_streak += 1
+            longest_streak = max(longest_streak, current_streak)
+        # Missed a day or more - reset streak
+        else:
+            current_streak = 1
+
+    profile["streak"] = {
+        "current_streak": current_streak,
+        "longest_streak": longest_streak,
+        "last_activity_date": current_date_str,
+    }
+
+
+def apply_xp(profile, activity_type, metadata=None):
+    """Award the XP for one activity and update the stats achievements are based on.
+
+    Returns the XP earned; the profile's XP and stats are updated in place."""
+    metadata = metadata or {}
+    stats = profile.setdefault("stats", {})
+    xp_earned = 0
+
+    if activity_type == "review_card":
+        # Base XP for reviewing plus a bonus based on quality rating (0-5)
+        quality = metadata.get("quality", 0)
+        xp_earned = XP_REVIEW_CARD + XP_CORRECT_ANSWER.get(quality, 0)
+
+        # Streak multiplier (if any)
+        current_streak = profile.get("streak", {}).get("current_streak", 0)
+        if current_streak > 1:
+            # Apply streak bonus (up to 50% more XP at 5 day streak)
+            streak_bonus = min(0.5, current_streak * XP_STREAK_MULTIPLIER)
+            xp_earned = math.ceil(xp_earned * (1 + streak_bonus))
+
+        stats["cards_reviewed"] = stats.get("cards_reviewed", 0) + 1
+
+        # Track perfect recalls
+        if quality == 5:
+            stats["perfect_recalls"] = stats.get("perfect_recalls", 0) + 1
+
+    elif activity_type == "complete_deck":
+        xp_earned = XP_PERFECT_DECK
+
+        stats["decks_completed"] = stats.get("decks_completed", 0) + 1
+
+    elif activity_type == "complete_quiz":
+        score = metadata.get("score", 0)
+        total = metadata.get("total", 0)
+
+        # Base XP for completing quiz
+        xp_earned = 20
+
+        # Bonus XP for good scores
+        if total > 0:
+            score_percent = score / total
+            if score_percent == 1.0:  # Perfect score
+                xp_earned += 30
+                stats["perfect_quizzes"] = stats.get("perfect_quizzes", 0) + 1
+            elif score_percent >= 0.9:  # 90%+ score
+                xp_earned += 20
+            elif score_percent >= 0.8:  # 80%+ score
+                xp_earned += 10
+
+        stats["quizzes_completed"] = stats.get("quizzes_completed", 0) + 1
+
+    profile["xp"] = profile.get("xp", 0) + xp_earned
+    return xp_earned
+
+
+def record_reviews(db, user_id, reviews):
+    """Apply the streak and XP updates for a sequence of card reviews by one user.
+
+    Each review is a dict with ``quality`` and optionally ``card_id`` and ``timezone``.
+    The profile is read once and written once however many reviews there are, and the
+    returned summary is also stored on the profile as ``last_result``."""
+
+    def change(profile):
+        old_level = calculate_level(profile.get("xp", 0))
+
+        xp_earned = 0
+        for review in reviews:
+            apply_activity(profile, review.get("timezone", "UTC"))
+            xp_earned += apply_xp(
+                profile, "review_card", {"quality": review.get("quality", 0), "card_id": review.get("card_id")}
+            )
+        achievements_earned = evaluate_achievements(profile)
+
+        new_level = calculate_level(profile["xp"])
+        result = {
+            "streak": profile["streak"],
+            "achievements_earned": achievements_earned,
+            "xp_earned": xp_earned,
+            "level_up": new_level > old_level,
+            "new_level": new_level,
+            "reviews": len(reviews),
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }
+        profile["last_result"] = result
+        return result
+
+    return update_profile(db, user_id, change)[1]
+
+
+def record_review(db, user_id, quality, card_id=None, user_timezone="UTC"):
+    """Apply the streak and XP updates for one card review with one conditional profile write"""
+    return record_reviews(db, user_id, [{"quality": quality, "card_id": card_id, "timezone": user_timezone}])
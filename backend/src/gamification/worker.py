@@ -0,0 +1,352 @@
+"""worker.py is a file in the gamification folder that applies gamification updates on background worker threads.
+
+The review endpoint only puts an event on a queue and returns. Each worker owns a shard
+of users, so events for one user are always handled by the same thread in order, and
+every batch it takes is grouped by user into one profile read-modify-write.
+
+Configuration comes from the environment:
+
+- ``GAMIFICATION_ASYNC``: set to ``false`` to apply updates inside the request instead.
+- ``GAMIFICATION_WORKERS``: number of worker threads (default 2).
+- ``GAMIFICATION_QUEUE_DB``: path of a SQLite file; when set, queued events survive restarts.
+
+An event whose update fails is handed out again after ``retry_delay`` seconds, up to
+``max_attempts`` times in all, and then logged and dropped.
+"""
+
+import atexit
+from collections import OrderedDict
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+
+try:
+    from .. import firebase
+    from .service import record_reviews
+except ImportError:
+    from __init__ import firebase
+    from gamification.service import record_reviews
+
+
+class MemoryEventStore:
+    """Keeps queued events in one in-process queue per shard.
+
+    Failed events wait in a per-shard retry list and are handed out ahead of newer events
+    once their delay has passed."""
+
+    def __init__(self, shards, max_attempts=5, retry_delay=30):
+        self._queues = [queue.Queue() for _ in range(shards)]
+        self._retries = [[] for _ in range(shards)]
+        self._max_attempts = max_attempts
+        self._retry_delay = retry_delay
+        self._lock = threading.Lock()
+
+    def put(self, shard, user_id, event):
+        self._queues[shard].put((None, user_id, event, 0))
+
+    def put_many(self, shard, user_id, events):
+        for event in events:
+            self.put(shard, user_id, event)
+
+    def take(self, shard, limit, timeout):
+        """Wait up to ``timeout`` seconds for an event, then return it with any others already waiting."""
+        items = self._due_retries(shard, limit)
+        if not items:
+            try:
+                items = [self._queues[shard].get(timeout=timeout)]
+            except queue.Empty:
+                return self._due_retries(shard, limit)
+        while len(items) < limit:
+            try:
+                items.append(self._queues[shard].get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _due_retries(self, shard, limit):
+        now = time.time()
+        with self._lock:
+            retries = self._retries[shard]
+            # Retries are appended in ready order, so the due ones are at the front
+            count = 0
+            while count < min(limit, len(retries)) and retries[count][0] <= now:
+                count += 1
+            self._retries[shard] = retries[count:]
+        return [item for _, item in retries[:count]]
+
+    def ack(self, items):
+        pass
+
+    def retry(self, shard, items):
+        """Hand failed events out again after the retry delay, dropping those out of attempts."""
+        ready_at = time.time() + self._retry_delay
+        with self._lock:
+            for _, user_id, event, attempts in items:
+                if attempts + 1 >= self._max_attempts:
+                    logging.error(f"Dropping gamification event for user {user_id} after {attempts + 1} attempts")
+                else:
+                    self._retries[shard].append((ready_at, (None, user_id, event, attempts + 1)))
+
+    def pending(self):
+        with self._lock:
+            retrying = sum(len(retries) for retries in self._retries)
+        return sum(q.qsize() for q in self._queues) + retrying
+
+
+class SQLiteEventStore:
+    """Keeps queued events in a SQLite file so they survive a restart.
+
+    Taken events are leased rather than deleted; they are deleted once processed. Events
+    whose lease runs out (the worker crashed) are handed out again, which also lets several
+    server processes share one file. A failed update counts an attempt and leases the event
+    until the retry delay has passed."""
+
+    def __init__(self, path, shards, lease_seconds=60, max_attempts=5, retry_delay=30):
+        self._shards = shards
+        self._lease_seconds = lease_seconds
+        self._max_attempts = max_attempts
+        self._retry_delay = retry_delay
+        self._ready = threading.Condition()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS gamification_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_hash INTEGER NOT NULL,
+                user_id TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                leased_until REAL NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0
+            )"""
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(gamification_events)")]
+        if "attempts" not in columns:
+            # Files written before failed events were counted
+            self._conn.execute("ALTER TABLE gamification_events ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+
+    def put(self, shard, user_id, event):
+        with self._ready:
+            self._conn.execute(
+                "INSERT INTO gamification_events (user_hash, user_id, payload) VALUES (?, ?, ?)",
+                (zlib.crc32(user_id.encode("utf-8")), user_id, json.dumps(event)),
+            )
+            self._ready.notify_all()
+
+    def put_many(self, shard, user_id, events):
+        user_hash = zlib.crc32(user_id.encode("utf-8"))
+        with self._ready:
+            # One transaction for the whole batch
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO gamification_events (user_hash, user_id, payload) VALUES (?, ?, ?)",
+                    [(user_hash, user_id, json.dumps(event)) for event in events],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._ready.notify_all()
+
+    def _lease(self, shard, limit):
+        now = time.time()
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = self._conn.execute(
+                """SELECT id, user_id, payload FROM gamification_events
+                   WHERE user_hash % ? = ? AND leased_until < ? ORDER BY id LIMIT ?""",
+                (self._shards, shard, now, limit),
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE gamification_events SET leased_until = ? WHERE id = ?",
+                [(now + self._lease_seconds, row[0]) for row in rows],
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        return [(row_id, user_id, json.loads(payload)) for row_id, user_id, payload in rows]
+
+    def take(self, shard, limit, timeout):
+        """Lease up to ``limit`` events for a shard, waiting up to ``timeout`` seconds for one to arrive."""
+        with self._ready:
+            items = self._lease(shard, limit)
+            if not items:
+                self._ready.wait(timeout)
+                items = self._lease(shard, limit)
+        return items
+
+    def ack(self, items):
+        with self._ready:
+            self._conn.executemany("DELETE FROM gamification_events WHERE id = ?", [(item[0],) for item in items])
+
+    def retry(self, shard, items):
+        """Hand failed events out again after the retry delay, dropping those out of attempts."""
+        ids = [(item[0],) for item in items]
+        with self._ready:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "UPDATE gamification_events SET attempts = attempts + 1, leased_until = ? WHERE id = ?",
+                    [(time.time() + self._retry_delay, row_id) for (row_id,) in ids],
+                )
+                dropped = self._conn.execute(
+                    "SELECT user_id, attempts FROM gamification_events WHERE attempts >= ?", (self._max_attempts,)
+                ).fetchall()
+                self._conn.execute("DELETE FROM gamification_events WHERE attempts >= ?", (self._max_attempts,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        for user_id, attempts in dropped:
+            logging.error(f"Dropping gamification event for user {user_id} after {attempts} attempts")
+
+    def pending(self):
+        with self._ready:
+            return self._conn.execute("SELECT COUNT(*) FROM gamification_events").fetchone()[0]
+
+
+class GamificationQueue:
+    """Queue of gamification events drained by a pool of worker threads.
+
+    Threads are started on the first ``submit`` so that forking servers start them in
+    each worker process. Each thread gets its own database handle from ``db_factory``
+    because pyrebase handles keep per-query state and cannot be shared between threads."""
+
+    def __init__(
+        self,
+        db_factory,
+        workers=2,
+        durable_path=None,
+        enabled=True,
+        batch_size=100,
+        poll_interval=1.0,
+        max_results=10000,
+        max_attempts=5,
+        retry_delay=30,
+    ):
+        self.enabled = enabled
+        self._db_factory = db_factory
+        self._workers = max(1, workers)
+        self._durable_path = durable_path
+        self._batch_size = batch_size
+        self._poll_interval = poll_interval
+        self._max_attempts = max_attempts
+        self._retry_delay = retry_delay
+        self._store = None
+        self._threads = []
+        self._latest = OrderedDict()
+        self._max_results = max_results
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def _shard(self, user_id):
+        return zlib.crc32(user_id.encode("utf-8")) % self._workers
+
+    def _get_store(self):
+        if self._store is None:
+            if self._durable_path:
+                self._store = SQLiteEventStore(
+                    self._durable_path, self._workers, max_attempts=self._max_attempts, retry_delay=self._retry_delay
+                )
+            else:
+                self._store = MemoryEventStore(
+                    self._workers, max_attempts=self._max_attempts, retry_delay=self._retry_delay
+                )
+        return self._store
+
+    def start(self):
+        """Start the worker threads if they are not already running."""
+        with self._lock:
+            store = self._get_store()
+            if self._threads:
+                return store
+            self._stopping.clear()
+            for shard in range(self._workers):
+                thread = threading.Thread(
+                    target=self._run, args=(shard,), name=f"gamification-worker-{shard}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+            atexit.register(self.stop)
+            return store
+
+    def stop(self, timeout=5):
+        """Ask the workers to finish the batch they are on and wait for them to exit."""
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, user_id, event):
+        """Queue an event for a user; it is applied in the order it was submitted."""
+        self.start().put(self._shard(user_id), user_id, event)
+
+    def submit_many(self, user_id, events):
+        """Queue several events for a user at once, in order."""
+        self.start().put_many(self._shard(user_id), user_id, events)
+
+    def latest(self, user_id):
+        """Return the most recent result this process computed for a user, if any.
+
+        Other server processes do not see it; the routes read the copy stored on the profile."""
+        return self._latest.get(user_id)
+
+    def pending(self):
+        return self._get_store().pending()
+
+    def _remember(self, user_id, result):
+        with self._lock:
+            self._latest[user_id] = result
+            self._latest.move_to_end(user_id)
+            while len(self._latest) > self._max_results:
+                self._latest.popitem(last=False)
+
+    def process_batch(self, shard, db, timeout=0):
+        """Take one batch of events for a shard and apply it. Returns the number of events handled."""
+        store = self._get_store()
+        items = store.take(shard, self._batch_size, timeout)
+        if not items:
+            return 0
+
+        # Coalesce the batch so each user's profile is read and written once
+        by_user = {}
+        for item in items:
+            by_user.setdefault(item[1], []).append(item)
+
+        for user_id, user_items in by_user.items():
+            try:
+                result = record_reviews(db, user_id, [item[2] for item in user_items])
+            except Exception:
+                logging.exception(f"Gamification update failed for user {user_id}")
+                store.retry(shard, user_items)
+                continue
+            store.ack(user_items)
+            self._remember(user_id, result)
+        return len(items)
+
+    def _run(self, shard):
+        db = self._db_factory()
+        while not self._stopping.is_set():
+            try:
+                self.process_batch(shard, db, self._poll_interval)
+            except Exception:
+                logging.exception("Gamification worker error")
+                time.sleep(self._poll_interval)
+
+        # Apply whatever is still queued before the process exits
+        while self.process_batch(shard, db):
+            pass
+
+
+gamification_queue = GamificationQueue(
+    firebase.database,
+    workers=int(os.getenv("GAMIFICATION_WORKERS", "2")),
+    durable_path=os.getenv("GAMIFICATION_QUEUE_DB"),
+    enabled=os.getenv("GAMIFICATION_ASYNC", "true").lower() != "false",
+)
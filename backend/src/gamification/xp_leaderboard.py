@@ -0,0 +1,117 @@
+"""xp_leaderboard.py is a file in the gamification folder that keeps the denormalized XP leaderboard.
+
+Every profile write also updates ``xp_leaderboard/<user>`` = {xp, level, achievements_count,
+user_email}, indexed by ``xp``, so a page of the leaderboard is one ordered, limited query
+instead of reading every profile and looking up every user's email.
+
+Realtime Database queries cannot count, so ranks come from ``xp_histogram/<bucket>``: the
+number of users whose XP falls in each ``RANK_BUCKET_XP`` wide bucket, kept with server-side
+increments. A user's rank is the users in the buckets above theirs, read with one query that
+starts at the next bucket, plus those ahead of them in their own bucket, found with one query
+bounded to that bucket."""
+
+try:
+    from ..common.firebase_ops import increment
+    from ..common.ranking import as_counts, ranked_between
+    from ..common.ranking import read_page as read_ranked_page
+except ImportError:
+    from common.firebase_ops import increment
+    from common.ranking import as_counts, ranked_between
+    from common.ranking import read_page as read_ranked_page
+
+XP_LEADERBOARD = "xp_leaderboard"
+XP_HISTOGRAM = "xp_histogram"
+RANK_BUCKET_XP = 100
+
+
+def _bucket(xp):
+    return int(xp // RANK_BUCKET_XP)
+
+
+def display_name(db, user_id):
+    """Return the email shown for a user on the leaderboard"""
+    user_data = db.child("users").child(user_id).get().val()
+    if not user_data:
+        return "Unknown"
+    return user_data.get("email", "User-" + user_id[:5])
+
+
+def index_updates(user_id, old_xp, profile, level, user_email=None):
+    """Return the multi-path update that moves a user's leaderboard entry to ``profile``.
+
+    ``old_xp`` is the XP the entry was counted with, or None for a user who is not on the
+    leaderboard yet; ``user_email`` is only written when given."""
+    xp = profile.get("xp", 0)
+    entry = f"{XP_LEADERBOARD}/{user_id}"
+    updates = {
+        f"{entry}/xp": xp,
+        f"{entry}/level": level,
+        f"{entry}/achievements_count": len(profile.get("achievements") or {}),
+    }
+    if user_email is not None:
+        updates[f"{entry}/user_email"] = user_email
+    if old_xp is None or _bucket(old_xp) != _bucket(xp):
+        if old_xp is not None:
+            updates[f"{XP_HISTOGRAM}/{_bucket(old_xp)}"] = increment(-1)
+        updates[f"{XP_HISTOGRAM}/{_bucket(xp)}"] = increment(1)
+    return updates
+
+
+def _leaderboard_entry(user_id, entry, rank):
+    return {
+        "user_id": user_id,
+        "user_email": entry.get("user_email", "Unknown"),
+        "xp": entry.get("xp", 0),
+        "level": entry.get("level", 0),
+        "achievements_count": entry.get("achievements_count", 0),
+        "rank": rank,
+    }
+
+
+def read_page(db, limit, cursor=None):
+    """Return (entries, next cursor) for a page of the leaderboard, highest XP first.
+
+    Pass a page's cursor to get the next one; it is None on the last page. Raises ValueError
+    for a malformed cursor."""
+    page, next_cursor = read_ranked_page(db, XP_LEADERBOARD, "xp", limit, cursor)
+    return [_leaderboard_entry(user_id, entry, rank) for rank, user_id, entry in page], next_cursor
+
+
+def read_rank(db, user_id):
+    """Return a user's leaderboard entry with their rank, or None if they are not on the leaderboard"""
+    entry = db.child(XP_LEADERBOARD).child(user_id).get().val()
+    if not entry:
+        return None
+    xp = entry.get("xp", 0)
+    bucket = _bucket(xp)
+
+    # Firebase orders integer keys numerically, so this reads only the buckets above the user's
+    higher = db.child(XP_HISTOGRAM).order_by_key().start_at(str(bucket + 1)).get().val()
+    above = sum(as_counts(higher).values())
+    same_bucket = ranked_between(db, XP_LEADERBOARD, "xp", xp, (bucket + 1) * RANK_BUCKET_XP)
+    ahead = sum(
+        1
+        for other_id, other in same_bucket
+        if _bucket(other["xp"]) == bucket and (other["xp"], other_id) > (xp, user_id)
+    )
+    return _leaderboard_entry(user_id, entry, above + ahead + 1)
+
+
+def rebuild_index(db, profiles, level_of):
+    """Rewrite the whole leaderboard and histogram from ``{user_id: profile}`` with one multi-path update.
+
+    Existing emails are kept; users without one are looked up once. Returns the number of users."""
+    existing = db.child(XP_LEADERBOARD).get().val() or {}
+    leaderboard, histogram = {}, {}
+    for user_id, profile in profiles.items():
+        xp = (profile or {}).get("xp", 0)
+        user_email = (existing.get(user_id) or {}).get("user_email") or display_name(db, user_id)
+        leaderboard[user_id] = {
+            "xp": xp,
+            "level": level_of(xp),
+            "achievements_count": len((profile or {}).get("achievements") or {}),
+            "user_email": user_email,
+        }
+        histogram[str(_bucket(xp))] = histogram.get(str(_bucket(xp)), 0) + 1
+    db.update({XP_LEADERBOARD: leaderboard, XP_HISTOGRAM: histogram})
+    return len(leaderboard)
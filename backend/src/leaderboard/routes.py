@@ -1,44 +1,110 @@
 """routes.py is a file in the leaderboard folder that has all the functions defined that manipulate the leaderboard."""
 
-from flask import Blueprint, jsonify  # type: ignore
+from datetime import datetime, timezone
+import os
+
+from flask import Blueprint, jsonify, request  # type: ignore
 from flask_cors import cross_origin  # type: ignore
 # from __init__ import firebase
 
 try:
     from .. import firebase
+    from ..common.leaderboard_windows import (
+        CORRECT_BOARD,
+        DECK_WINDOW_ROOT,
+        WINDOWS,
+        XP_BOARD,
+        deck_board,
+        expire_periods,
+        top_snapshots,
+    )
+    from ..common.snapshot import Snapshot
+    from ..deck.leaderboard import top_totals
 except ImportError:
     from __init__ import firebase
+    from common.leaderboard_windows import (
+        CORRECT_BOARD,
+        DECK_WINDOW_ROOT,
+        WINDOWS,
+        XP_BOARD,
+        deck_board,
+        expire_periods,
+        top_snapshots,
+    )
+    from common.snapshot import Snapshot
+    from deck.leaderboard import top_totals
+
+# Only the top GLOBAL_LEADERBOARD_SIZE users are ranked; the snapshot of them is refreshed
+# in the background once it is GLOBAL_LEADERBOARD_REFRESH seconds old
+GLOBAL_LEADERBOARD_SIZE = int(os.getenv("GLOBAL_LEADERBOARD_SIZE", "100"))
+GLOBAL_LEADERBOARD_REFRESH = float(os.getenv("GLOBAL_LEADERBOARD_REFRESH", "60"))
+DEFAULT_PAGE_SIZE = 20
 
-leaderboard_bp = Blueprint("leaderboard_bp", __name__)
+leaderboard_bp = Blueprint("leaderboard_bp", __name__, cli_group="leaderboard")
 
 db = firebase.database()
 
+# The snapshot is refreshed on a background thread, which must not share ``db`` with the
+# request threads: a pyrebase handle keeps the path and query being built on itself
+global_top = Snapshot(lambda: top_totals(firebase.database(), GLOBAL_LEADERBOARD_SIZE), GLOBAL_LEADERBOARD_REFRESH)
+window_top = top_snapshots(firebase.database)
+
 
 @leaderboard_bp.route("/leaderboard/global", methods=["GET"])
 @cross_origin(supports_credentials=True)
 def get_global_leaderboard():
-    """Fetch a global leaderboard across all decks."""
+    """Fetch a page of the global leaderboard across all decks.
+
+    ``offset`` (default 0) and ``limit`` (default 20) select the page within the top
+    ``GLOBAL_LEADERBOARD_SIZE`` users; ``next_offset`` is null on the last page. With
+    ``window`` (daily, weekly or monthly) users are ranked by the correct answers they gave
+    in the current period instead of all time."""
     try:
-        leaderboard_entries = db.child("leaderboard").get()
-        global_scores = {}
-
-        if leaderboard_entries.val():
-            for deck in leaderboard_entries.each():
-                deck_data = deck.val()
-                for user_id, data in deck_data.items():
-                    if user_id not in global_scores:
-                        global_scores[user_id] = {
-                            "userEmail": data.get("userEmail"),
-                            "total_correct": 0,
-                            "total_incorrect": 0,
-                        }
-                    global_scores[user_id]["total_correct"] += data.get("correct", 0)
-                    global_scores[user_id]["total_incorrect"] += data.get("incorrect", 0)
-
-        leaderboard = sorted(global_scores.values(), key=lambda x: x["total_correct"], reverse=True)
+        offset = request.args.get("offset", "0")
+        limit = request.args.get("limit", str(DEFAULT_PAGE_SIZE))
+        if not offset.isdigit() or not limit.isdigit() or not 1 <= int(limit) <= GLOBAL_LEADERBOARD_SIZE:
+            return jsonify(
+                {
+                    "message": f"offset must be a number and limit between 1 and {GLOBAL_LEADERBOARD_SIZE}",
+                    "status": 400,
+                }
+            ), 400
+        offset, limit = int(offset), int(limit)
+        window = request.args.get("window")
+        if window is not None and window not in WINDOWS:
+            return jsonify({"message": f"window must be one of {', '.join(WINDOWS)}", "status": 400}), 400
+
+        if window:
+            top = [
+                {"userEmail": entry["name"], "total_correct": entry["score"]}
+                for entry in window_top.get(CORRECT_BOARD, window)
+            ]
+        else:
+            top = global_top.get()
+        leaderboard = [
+            {**entry, "rank": rank} for rank, entry in enumerate(top[offset : offset + limit], start=offset + 1)
+        ]
+        next_offset = offset + limit if offset + limit < len(top) else None
 
         return jsonify(
-            {"leaderboard": leaderboard, "message": "Global leaderboard fetched successfully", "status": 200}
+            {
+                "leaderboard": leaderboard,
+                "next_offset": next_offset,
+                "message": "Global leaderboard fetched successfully",
+                "status": 200,
+            }
         ), 200
     except Exception as e:
         return jsonify({"message": f"Error fetching global leaderboard: {e}", "status": 400}), 400
+
+
+@leaderboard_bp.cli.command("expire-windows")
+def expire_windows():
+    """Delete daily, weekly and monthly leaderboard periods that are past their retention.
+
+    Run with ``flask --app api leaderboard expire-windows`` from ``backend/src``, e.g. daily."""
+    now = datetime.now(timezone.utc)
+    boards = [XP_BOARD, CORRECT_BOARD]
+    boards += [deck_board(deck_id) for deck_id in db.child(DECK_WINDOW_ROOT).shallow().get().val() or []]
+    expired = sum(expire_periods(db, board, now) for board in boards)
+    print(f"Deleted {expired} expired periods from {len(boards)} leaderboards")
@@ -9,8 +9,12 @@ import json
 
 try:
     from .. import firebase
+    from ..cards.card_index import index_path
+    from ..common.response_cache import cards_key, deck_list_key, response_cache
 except ImportError:
     from __init__ import firebase
+    from cards.card_index import index_path
+    from common.response_cache import cards_key, deck_list_key, response_cache
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -152,11 +156,17 @@ def create_new_deck(user_id, flashcard_json):
     new_deck = db.child("deck").push(deck_data)
     deck_id = new_deck["name"]  # Get the new deck ID
 
-    # Create the cards
+    # Create the cards and index them by content
+    card_index = {}
     for card in import_data["cards"]:
         card["deckId"] = deck_id
         card["userId"] = user_id
-        db.child("card").push(card)
+        card_ref = db.child("card").push(card)
+        card_index[index_path(card)] = card_ref["name"]
+
+    if card_index:
+        db.update(card_index)
+    response_cache.invalidate(deck_list_key(user_id), deck_list_key(), cards_key(deck_id))
 
     # logging.info(f"Deck created: {flashcard_json}")
     return jsonify({"deckId": deck_id, "message": "Deck imported successfully", "status": 201}), 201
@@ -6,8 +6,10 @@ from flask_cors import cross_origin  # type: ignore
 
 try:
     from .. import firebase
+    from ..deck.leaderboard import read_user_scores, read_user_totals
 except ImportError:
     from __init__ import firebase
+    from deck.leaderboard import read_user_scores, read_user_totals
 
 user_bp = Blueprint("user_bp", __name__)
 
@@ -20,19 +22,10 @@ user_bp.route("/user/<user_id>/stats", methods=["GET"])
 def get_user_stats(user_id):
     """Fetch aggregated user performance across all decks."""
     try:
-        leaderboard_entries = db.child("leaderboard").get()
-        total_correct = 0
-        total_incorrect = 0
-        total_decks = 0
-
-        if leaderboard_entries.val():
-            for deck in leaderboard_entries.each():
-                deck_data = deck.val()
-                if user_id in deck_data:
-                    user_data = deck_data[user_id]
-                    total_correct += user_data.get("correct", 0)
-                    total_incorrect += user_data.get("incorrect", 0)
-                    total_decks += 1
+        totals = read_user_totals(db, user_id)
+        total_correct = totals["correct"]
+        total_incorrect = totals["incorrect"]
+        total_decks = totals["decks"]
 
         return jsonify(
             {
@@ -52,22 +45,17 @@ def get_user_stats(user_id):
 def get_user_progress(user_id):
     """Fetch user's progress over time across all decks."""
     try:
-        leaderboard_entries = db.child("leaderboard").get()
         progress_data = []
 
-        if leaderboard_entries.val():
-            for deck in leaderboard_entries.each():
-                deck_data = deck.val()
-                if user_id in deck_data:
-                    user_data = deck_data[user_id]
-                    progress_data.append(
-                        {
-                            "deckId": deck.key(),
-                            "correct": user_data.get("correct", 0),
-                            "incorrect": user_data.get("incorrect", 0),
-                            "lastAttempt": user_data.get("lastAttempt", ""),
-                        }
-                    )
+        for deck_id, user_data in read_user_scores(db, user_id).items():
+            progress_data.append(
+                {
+                    "deckId": deck_id,
+                    "correct": user_data.get("correct", 0),
+                    "incorrect": user_data.get("incorrect", 0),
+                    "lastAttempt": user_data.get("lastAttempt", ""),
+                }
+            )
 
         return jsonify({"progress": progress_data, "message": "User progress fetched successfully", "status": 200}), 200
     except Exception as e:
@@ -0,0 +1,10 @@
+import pytest
+
+from src.common.response_cache import response_cache
+
+
+@pytest.fixture(autouse=True)
+def empty_response_cache():
+    """Start every test with an empty response cache, so no test is served another's database"""
+    response_cache.clear()
+    yield
@@ -0,0 +1,294 @@
+"""fake_firebase.py is a file in the tests folder that provides an in-memory stand-in for the pyrebase database.
+
+Tests that need real read/write behaviour (conditional writes, multi-path updates, indexed
+queries) use it instead of a MagicMock. Every handle returned by ``database()`` shares one
+store, like handles from ``firebase.database()`` share one Firebase project, so several
+threads can act as concurrent writers. Reads return what pyrebase would: objects keyed by small
+integers come back as arrays, and ordered query results are sorted again the way pyrebase does."""
+
+import copy
+import hashlib
+import itertools
+import json
+import threading
+import time
+
+from pyrebase.pyrebase import PyreResponse, convert_list_to_pyre, convert_to_pyre
+
+
+def _sort_key(value):
+    """Firebase ordering: null, false, true, numbers, strings, then objects"""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, str):
+        return (3, value)
+    return (4, 0)
+
+
+def _key_order(key):
+    """Firebase key ordering: keys that are 32-bit integers first, numerically, then the rest as strings"""
+    key = str(key)
+    if key.lstrip("-").isdigit() and key == str(int(key)) and -(2**31) <= int(key) < 2**31:
+        return (0, int(key))
+    return (1, key)
+
+
+def _as_returned(value):
+    """Return a stored value as Firebase returns it: an object whose keys are all small integers
+    becomes an array when at least half of the indexes up to the largest are set"""
+    if not isinstance(value, dict):
+        return value
+    value = {key: _as_returned(child) for key, child in value.items()}
+    if value and all(key.isdigit() and (key == "0" or not key.startswith("0")) for key in value):
+        size = max(int(key) for key in value) + 1
+        if len(value) * 2 > size:
+            return [value.get(str(index)) for index in range(size)]
+    return value
+
+
+def _parts(path):
+    return [part for part in path.split("/") if part]
+
+
+class FakeFirebase:
+    """The shared in-memory database.
+
+    ``before_conditional_write`` can be set to a callable taking the path; it runs before
+    each conditional write is checked, which lets a test slip a competing write in between
+    a read and a write. ``latency`` adds a delay to every read so threads interleave."""
+
+    def __init__(self, data=None, latency=0):
+        self.data = copy.deepcopy(data or {})
+        self.latency = latency
+        self.before_conditional_write = None
+        self.conflicts = 0
+        self.requests = []
+        self._lock = threading.RLock()
+        self._keys = itertools.count()
+
+    def database(self):
+        return FakeDatabase(self)
+
+    def read(self, path):
+        with self._lock:
+            node = self.data
+            for part in _parts(path):
+                if not isinstance(node, dict) or part not in node:
+                    return None
+                node = node[part]
+            return copy.deepcopy(node)
+
+    def write(self, path, value):
+        with self._lock:
+            parts = _parts(path)
+            value = self._resolve(path, value)
+            if not parts:
+                self.data = value if isinstance(value, dict) else {}
+                return
+            parents = [self.data]
+            for part in parts[:-1]:
+                child = parents[-1].get(part)
+                if not isinstance(child, dict):
+                    child = parents[-1][part] = {}
+                parents.append(child)
+            if value is None or value == {}:
+                parents[-1].pop(parts[-1], None)
+                # Firebase does not keep empty nodes
+                for depth in range(len(parents) - 1, 0, -1):
+                    if parents[depth]:
+                        break
+                    parents[depth - 1].pop(parts[depth - 1], None)
+            else:
+                parents[-1][parts[-1]] = value
+
+    def _resolve(self, path, value):
+        """Apply server values such as increments and drop null children, as Firebase does"""
+        if isinstance(value, dict):
+            server_value = value.get(".sv")
+            if isinstance(server_value, dict) and "increment" in server_value:
+                current = self.read(path)
+                return (current if isinstance(current, (int, float)) else 0) + server_value["increment"]
+            if server_value == "timestamp":
+                return int(time.time() * 1000)
+            resolved = {}
+            for key, child in value.items():
+                child = self._resolve(f"{path}/{key}", child)
+                if child is not None and child != {}:
+                    resolved[str(key)] = child
+            return resolved
+        if isinstance(value, (list, tuple)):
+            return {str(index): item for index, item in enumerate(value) if item is not None} or None
+        return value
+
+    def etag(self, path):
+        content = json.dumps(self.read(path), sort_keys=True)
+        return hashlib.md5(content.encode("utf-8")).hexdigest()
+
+    def new_key(self):
+        return f"-key{next(self._keys):08d}"
+
+
+class FakeDatabase:
+    """A handle with the same chained path and query API as ``pyrebase.Database``."""
+
+    def __init__(self, store):
+        self.store = store
+        self.path = ""
+        self.build_query = {}
+
+    def _take(self):
+        path, query = self.path, self.build_query
+        self.path, self.build_query = "", {}
+        return path, query
+
+    def child(self, *args):
+        new_path = "/".join(str(arg) for arg in args).strip("/")
+        self.path = f"{self.path}/{new_path}" if self.path else new_path
+        return self
+
+    def order_by_child(self, order):
+        self.build_query["orderBy"] = order
+        return self
+
+    def order_by_key(self):
+        self.build_query["orderBy"] = "$key"
+        return self
+
+    def order_by_value(self):
+        self.build_query["orderBy"] = "$value"
+        return self
+
+    def start_at(self, start):
+        self.build_query["startAt"] = start
+        return self
+
+    def end_at(self, end):
+        self.build_query["endAt"] = end
+        return self
+
+    def equal_to(self, equal):
+        self.build_query["equalTo"] = equal
+        return self
+
+    def limit_to_first(self, limit_first):
+        self.build_query["limitToFirst"] = limit_first
+        return self
+
+    def limit_to_last(self, limit_last):
+        self.build_query["limitToLast"] = limit_last
+        return self
+
+    def shallow(self):
+        self.build_query["shallow"] = True
+        return self
+
+    def generate_key(self):
+        return self.store.new_key()
+
+    def get(self, token=None, json_kwargs={}):
+        path, query = self._take()
+        self.store.requests.append(("get", path))
+        if self.store.latency:
+            time.sleep(self.store.latency)
+        value = self.store.read(path)
+        query_key = path.split("/")[-1]
+        if not isinstance(value, dict):
+            return PyreResponse(value, query_key)
+        if query.get("shallow"):
+            return PyreResponse(value.keys(), query_key)
+        if not query:
+            value = _as_returned(value)
+            if isinstance(value, list):
+                return PyreResponse(convert_list_to_pyre(value), query_key)
+            return PyreResponse(convert_to_pyre(value.items()), query_key)
+        items = [(key, _as_returned(child)) for key, child in self._apply_query(value, query)]
+        order = query.get("orderBy")
+        if order not in (None, "$key", "$value"):
+            # pyrebase sorts the response again on the client, exactly like this
+            items = sorted(items, key=lambda item: (order in item[1], item[1].get(order, "")))
+        return PyreResponse(convert_to_pyre(items), query_key)
+
+    @staticmethod
+    def _apply_query(value, query):
+        order = query.get("orderBy", "$key")
+        if order == "$key":
+            sort_value = lambda item: item[0]  # noqa: E731
+            bound = _key_order
+        elif order == "$value":
+            sort_value = lambda item: item[1]  # noqa: E731
+            bound = _sort_key
+        else:
+            sort_value = lambda item: item[1].get(order) if isinstance(item[1], dict) else None  # noqa: E731
+            bound = _sort_key
+
+        items = sorted(value.items(), key=lambda item: (bound(sort_value(item)), _key_order(item[0])))
+        if "equalTo" in query:
+            items = [item for item in items if sort_value(item) == query["equalTo"]]
+        if "startAt" in query:
+            items = [item for item in items if bound(sort_value(item)) >= bound(query["startAt"])]
+        if "endAt" in query:
+            items = [item for item in items if bound(sort_value(item)) <= bound(query["endAt"])]
+        if "limitToFirst" in query:
+            items = items[: query["limitToFirst"]]
+        if "limitToLast" in query:
+            items = items[-query["limitToLast"] :] if query["limitToLast"] else []
+        return items
+
+    def set(self, data, token=None, json_kwargs={}):
+        path, _ = self._take()
+        self.store.requests.append(("set", path))
+        self.store.write(path, data)
+        return data
+
+    def update(self, data, token=None, json_kwargs={}):
+        path, _ = self._take()
+        self.store.requests.append(("update", path))
+        with self.store._lock:
+            # A multi-path update is applied atomically
+            for key, value in data.items():
+                self.store.write(f"{path}/{key}" if path else key, value)
+        return data
+
+    def push(self, data, token=None, json_kwargs={}):
+        path, _ = self._take()
+        self.store.requests.append(("push", path))
+        key = self.store.new_key()
+        self.store.write(f"{path}/{key}", data)
+        return {"name": key}
+
+    def remove(self, token=None):
+        path, _ = self._take()
+        self.store.requests.append(("remove", path))
+        self.store.write(path, None)
+
+    def get_etag(self, token=None, json_kwargs={}):
+        path, _ = self._take()
+        self.store.requests.append(("get_etag", path))
+        return self.store.etag(path)
+
+    def conditional_set(self, data, etag, token=None, json_kwargs={}):
+        path, _ = self._take()
+        self.store.requests.append(("conditional_set", path))
+        if self.store.before_conditional_write:
+            self.store.before_conditional_write(path)
+        with self.store._lock:
+            current = self.store.etag(path)
+            if current != etag:
+                self.store.conflicts += 1
+                return {"ETag": current}
+            self.store.write(path, data)
+        return data
+
+    def conditional_remove(self, etag, token=None):
+        path, _ = self._take()
+        self.store.requests.append(("conditional_remove", path))
+        with self.store._lock:
+            current = self.store.etag(path)
+            if current != etag:
+                self.store.conflicts += 1
+                return {"ETag": current}
+            self.store.write(path, None)
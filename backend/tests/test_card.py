@@ -4,10 +4,12 @@ import sys
 sys.path.append("backend/src")
 import unittest
 import json
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
 from src.auth.routes import auth_bp
 from src.deck.routes import deck_bp
 from src.cards.routes import card_bp
+from src.cards.card_index import AmbiguousCard, card_hash, lookup_card
+from tests.fake_firebase import FakeFirebase
 from pathlib import Path
 
 # Add the parent directory to sys.path
@@ -216,12 +218,168 @@ class CardTestApp(unittest.TestCase):
     def test_delete_card_exception(self, mock_cards_db, mock_deck_db, mock_auth):
         """Test error handling in delete card functionality"""
         # Mock database to raise an exception
-        mock_cards_db.child.return_value.order_by_child.return_value.equal_to.side_effect = Exception("Database error")
+        mock_cards_db.child.return_value.child.return_value.get.side_effect = Exception("Database error")
         response = self.client.delete("/deck/test_deck/delete/test_card")
         self.assertEqual(response.status_code, 400)
         data = json.loads(response.data)
         self.assertEqual(data["message"], "Delete Card Failed")
 
+    @patch("src.cards.routes.db")
+    def test_create_cards_sets_deck_cards_count(self, mock_cards_db):
+        """Test that replacing a deck's cards stores the new total on the deck"""
+        mock_cards_db.child.return_value.order_by_child.return_value.equal_to.return_value.get.return_value.each.return_value = []
+        response = self.client.post(
+            "/deck/Test/card/create",
+            data=json.dumps(
+                {
+                    "localId": "Test",
+                    "cards": [
+                        {"front": "f1", "back": "b1", "hint": "h1"},
+                        {"front": "f2", "back": "b2", "hint": "h2"},
+                    ],
+                }
+            ),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        updates = mock_cards_db.update.call_args.args[0]
+        self.assertEqual(updates["deck/Test/cards_count"], 2)
+        self.assertEqual(updates["deck/Test/cards_version"], {".sv": {"increment": 1}})
+
+    @patch("src.cards.routes.db")
+    def test_create_cards_indexes_card_hashes(self, mock_cards_db):
+        """Test that created cards are indexed by content and replaced cards are unindexed"""
+        old_card = MagicMock()
+        old_card.key.return_value = "old_card"
+        old_card.val.return_value = {"deckId": "Test", "front": "old", "back": "b", "hint": "h"}
+        mock_cards_db.child.return_value.order_by_child.return_value.equal_to.return_value.get.return_value.each.return_value = [
+            old_card
+        ]
+        mock_cards_db.child.return_value.push.return_value = {"name": "new_card"}
+
+        response = self.client.post(
+            "/deck/Test/card/create",
+            data=json.dumps({"localId": "Test", "cards": [{"front": "f", "back": "b", "hint": "h"}]}),
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 201)
+        updates = mock_cards_db.update.call_args.args[0]
+        self.assertIsNone(updates[f"card_hash/{card_hash('old', 'b', 'h')}/Test"])
+        self.assertEqual(updates[f"card_hash/{card_hash('f', 'b', 'h')}/Test"], "new_card")
+
+    @patch("src.cards.routes.db")
+    def test_delete_card_decrements_deck_cards_count(self, mock_cards_db):
+        """Test that deleting a card removes it and decrements the deck counter"""
+        card_ref = mock_cards_db.child.return_value.child.return_value
+        card_ref.get.return_value.val.return_value = {"deckId": "test_deck", "front": "f", "back": "b", "hint": "h"}
+        # The card's index entry points at it
+        mock_cards_db.child.return_value.get.return_value.val.return_value = "test_card"
+        response = self.client.delete("/deck/test_deck/delete/test_card")
+        self.assertEqual(response.status_code, 200)
+        card_ref.remove.assert_called_once()
+        mock_cards_db.update.assert_called_once_with(
+            {
+                "deck/test_deck/cards_count": {".sv": {"increment": -1}},
+                "deck/test_deck/cards_version": {".sv": {"increment": 1}},
+                f"card_hash/{card_hash('f', 'b', 'h')}/test_deck": None,
+            }
+        )
+
+    def test_delete_card_keeps_twin_index_entry(self):
+        """Test that deleting a card leaves the index entry of an identical card in the same deck"""
+        card = {"deckId": "deck1", "front": "f", "back": "b", "hint": "h"}
+        store = FakeFirebase({"card": {"a": card, "b": card}, "card_hash": {card_hash("f", "b", "h"): {"deck1": "b"}}})
+
+        with patch("src.cards.routes.db", store.database()):
+            response = self.client.delete("/deck/deck1/delete/a")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(store.read(f"card_hash/{card_hash('f', 'b', 'h')}/deck1"), "b")
+
+    @patch("src.cards.routes.db")
+    def test_delete_card_wrong_deck(self, mock_cards_db):
+        """Test that a card cannot be deleted through another deck"""
+        card_ref = mock_cards_db.child.return_value.child.return_value
+        card_ref.get.return_value.val.return_value = {"deckId": "other_deck"}
+        response = self.client.delete("/deck/test_deck/delete/test_card")
+        self.assertEqual(response.status_code, 404)
+        card_ref.remove.assert_not_called()
+
+    def test_lookup_card_uses_deck_index(self):
+        """Test that an indexed card is found with a single keyed read in its deck's index"""
+        store = FakeFirebase({"card_hash": {card_hash("f", "b", "h"): {"deck1": "card1"}}})
+
+        self.assertEqual(lookup_card(store.database(), "f", "b", "h", "deck1"), ("card1", "deck1"))
+        self.assertEqual(store.requests, [("get", f"card_hash/{card_hash('f', 'b', 'h')}/deck1")])
+
+    def test_lookup_card_backfills_index(self):
+        """Test that cards missing from the index are found by front and then indexed in their deck"""
+        store = FakeFirebase(
+            {
+                "card": {
+                    "other_card": {"deckId": "deck1", "front": "f", "back": "other", "hint": "h"},
+                    "card1": {"deckId": "deck1", "front": "f", "back": "b", "hint": "h"},
+                }
+            }
+        )
+
+        self.assertEqual(lookup_card(store.database(), "f", "b", "h", "deck1"), ("card1", "deck1"))
+        self.assertEqual(store.read(f"card_hash/{card_hash('f', 'b', 'h')}/deck1"), "card1")
+
+    def test_lookup_card_keeps_identical_cards_in_other_decks_apart(self):
+        """Test that identical cards in two decks never resolve to each other"""
+        card = {"front": "f", "back": "b", "hint": "h"}
+        store = FakeFirebase(
+            {
+                "card": {
+                    "mine": {**card, "deckId": "deck1", "userId": "user1"},
+                    "theirs": {**card, "deckId": "deck2", "userId": "user2"},
+                }
+            }
+        )
+        db = store.database()
+
+        # Without a deck an unindexed card is found by front, preferring the user's own
+        self.assertEqual(lookup_card(db, "f", "b", "h", user_id="user1"), ("mine", "deck1"))
+        self.assertEqual(lookup_card(db, "f", "b", "h", "deck2"), ("theirs", "deck2"))
+        self.assertEqual(lookup_card(db, "f", "b", "h", "deck1"), ("mine", "deck1"))
+        self.assertEqual(lookup_card(db, "f", "b", "h", "deck3"), (None, None))
+        # Once both are indexed, a card the user has studied in neither deck cannot be chosen
+        with self.assertRaises(AmbiguousCard):
+            lookup_card(db, "f", "b", "h", user_id="user1")
+
+    def test_lookup_card_without_deck_uses_index(self):
+        """Test that an indexed card is found without its deck and without the front query"""
+        store = FakeFirebase({"card_hash": {card_hash("f", "b", "h"): {"deck1": "card1"}}})
+
+        self.assertEqual(lookup_card(store.database(), "f", "b", "h", user_id="user1"), ("card1", "deck1"))
+        self.assertEqual(store.requests, [("get", f"card_hash/{card_hash('f', 'b', 'h')}")])
+
+    def test_lookup_card_in_several_decks_uses_progress(self):
+        """Test that a card indexed in several decks resolves to the deck the user studies it in"""
+        store = FakeFirebase(
+            {
+                "card_hash": {card_hash("f", "b", "h"): {"deck1": "mine", "deck2": "theirs"}},
+                "user_card_progress": {"user1": {"deck2": {"theirs": {"repetitions": 1}}}},
+            }
+        )
+        db = store.database()
+
+        self.assertEqual(lookup_card(db, "f", "b", "h", user_id="user1"), ("theirs", "deck2"))
+        # Studied in neither, or in both, the deck cannot be chosen
+        with self.assertRaises(AmbiguousCard):
+            lookup_card(db, "f", "b", "h", user_id="user2")
+        store.data["user_card_progress"]["user1"]["deck1"] = {"mine": {"repetitions": 1}}
+        with self.assertRaises(AmbiguousCard):
+            lookup_card(db, "f", "b", "h", user_id="user1")
+        self.assertNotIn(("get", "card"), store.requests)
+
+    def test_card_hash_distinguishes_fields(self):
+        """Test that moving text between fields changes the hash"""
+        self.assertNotEqual(card_hash("ab", "c", ""), card_hash("a", "bc", ""))
+        self.assertEqual(card_hash("a", "b", "c"), card_hash("a", "b", "c"))
+
     def test_invalid_methods(self):
         """Test invalid HTTP methods for routes"""
         # Test PUT method on card/all route
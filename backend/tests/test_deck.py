@@ -5,9 +5,16 @@ sys.path.append("backend/src")
 import unittest
 from unittest.mock import patch, MagicMock, ANY
 import json
+import time
+from datetime import datetime, timedelta, timezone
+from src.cards.card_index import card_hash
+from src.deck.due_index import practice_queue
+from src.deck.leaderboard import SCORE_SCALE, attempt_score
+from src.deck.review_log import pack, read_log
 from src.deck.routes import deck_bp
+from src.deck.seen_reviews import claim_reviews
+from tests.fake_firebase import FakeDatabase, FakeFirebase
 from pathlib import Path
-from unittest.mock import call
 
 # Add the parent directory to sys.path
 sys.path.append(str(Path(__file__).parent.parent))
@@ -209,42 +216,22 @@ class TestDeck(unittest.TestCase):
                 response_data = json.loads(response.data)
                 assert response_data["message"] == "Failed to update lastOpened: Database update failed"
 
-    @patch("src.deck.routes.db")  # Mock the database connection
-    def test_get_leaderboard_route(self, mock_db):
+    def test_get_leaderboard_route(self):
         """Test the deck/<deckId>/leaderboard route of our app"""
         with self.app:
-            # Arrange: Set up mock return value for leaderboard entries
-            mock_entries = MagicMock()
-            mock_entries.each.return_value = [
-                MagicMock(
-                    val=lambda: {
-                        "userEmail": "user1@example.com",
-                        "correct": 10,
-                        "incorrect": 2,
-                        "lastAttempt": "2024-01-01T12:00:00",
-                    }
-                ),
-                MagicMock(
-                    val=lambda: {
-                        "userEmail": "user2@example.com",
-                        "correct": 15,
-                        "incorrect": 1,
-                        "lastAttempt": " 2024-01-02T12:00:00",
-                    }
-                ),
-                MagicMock(
-                    val=lambda: {
-                        "userEmail": "user3@example.com",
-                        "correct": 5,
-                        "incorrect": 0,
-                        "lastAttempt": "2024-01-03T12:00:00",
-                    }
-                ),
-            ]
-            mock_db.child.return_value.child.return_value.get.return_value = mock_entries
+            # Arrange: Set up leaderboard entries with the scores they are ordered by
+            entries = {
+                user_id: {"userEmail": f"{user_id}@example.com", "correct": correct, "incorrect": incorrect}
+                for user_id, correct, incorrect in [("user1", 10, 2), ("user2", 15, 1), ("user3", 5, 0)]
+            }
+            for day, entry in enumerate(entries.values(), start=1):
+                entry["lastAttempt"] = f"2024-01-0{day}T12:00:00"
+                entry["score"] = attempt_score(entry)
+            store = FakeFirebase({"leaderboard": {"TestDeck": entries}})
 
             # Act: Send a request to get the leaderboard for a specific deck
-            response = self.app.get("/deck/TestDeck/leaderboard")
+            with patch("src.deck.routes.db", store.database()):
+                response = self.app.get("/deck/TestDeck/leaderboard")
 
             # Assert: Check the response status code and the content of the response
             assert response.status_code == 200
@@ -254,6 +241,8 @@ class TestDeck(unittest.TestCase):
             assert response_data["leaderboard"][0]["userEmail"] == "user2@example.com"  # Highest score
             assert response_data["leaderboard"][1]["userEmail"] == "user1@example.com"  # Second highest score
             assert response_data["leaderboard"][2]["userEmail"] == "user3@example.com"  # Lowest score
+            assert [entry["rank"] for entry in response_data["leaderboard"]] == [1, 2, 3]
+            assert response_data["next_cursor"] is None
 
     @patch("src.deck.routes.db")  # Mock the database connection
     def test_update_leaderboard_success(self, mock_db):
@@ -266,9 +255,9 @@ class TestDeck(unittest.TestCase):
             correct = 10
             incorrect = 2
 
-            # Mock the database update
-            mock_leaderboard_ref = MagicMock()
-            mock_db.child.return_value.child.return_value.child.return_value = mock_leaderboard_ref
+            store = FakeFirebase()
+            mock_db.child.side_effect = store.database().child
+            mock_db.update.side_effect = store.database().update
 
             # Act: Send a POST request to update the leaderboard
             response = self.app.post(
@@ -287,15 +276,15 @@ class TestDeck(unittest.TestCase):
             assert response.status_code == 200
             response_data = json.loads(response.data)
             assert response_data["message"] == "Leaderboard updated successfully"
-            # Assert that the database update was called with the correct parameters
-            mock_leaderboard_ref.update.assert_called_once_with(
-                {
-                    "userEmail": user_email,
-                    "correct": correct,
-                    "incorrect": incorrect,
-                    "lastAttempt": ANY,  # Check that it's called but not the exact timestamp
-                }
-            )
+            # Assert that the entry and the deck summary were written
+            assert store.read(f"leaderboard/{deck_id}/{user_id}") == {
+                "userEmail": user_email,
+                "correct": correct,
+                "incorrect": incorrect,
+                "lastAttempt": ANY,  # Check that it's written but not the exact timestamp
+                "score": ANY,
+            }
+            assert store.read(f"leaderboard/{deck_id}/_summary") == {"correct": 10, "incorrect": 2, "users": 1}
 
     @patch("src.deck.routes.db")  # Mock the database connection
     def test_get_user_score_success(self, mock_db):
@@ -373,21 +362,16 @@ class TestDeck(unittest.TestCase):
             "title": "TestDeck",
             "description": "Test Description",
             "visibility": "public",
+            "cards_count": 2,
         }
         mock_deck.val.return_value = mock_deck_data
         mock_deck.key.return_value = "deck123"
         # Create mock for decks query
         mock_decks_query = MagicMock()
         mock_decks_query.each.return_value = [mock_deck]
-        # Create mock for cards query
-        mock_cards_query = MagicMock()
-        mock_cards_query.val.return_value = {"card1": {}, "card2": {}}  # Two cards
 
         # Set up the chain for deck query
-        mock_db.child.return_value.order_by_child.return_value.equal_to.return_value.get.side_effect = [
-            mock_decks_query,  # First call for decks
-            mock_cards_query,  # Second call for cards
-        ]
+        mock_db.child.return_value.order_by_child.return_value.equal_to.return_value.get.return_value = mock_decks_query
         # Make the request
         response = self.app.get("/deck/all", query_string=dict(localId="Test"))
 
@@ -398,8 +382,230 @@ class TestDeck(unittest.TestCase):
         assert response_data["decks"][0]["cards_count"] == 2
         assert response_data["decks"][0]["title"] == "TestDeck"
         assert response_data["decks"][0]["id"] == "deck123"
-        # Verify the mock calls
-        mock_db.child.assert_has_calls([call("deck"), call("card")], any_order=True)
+        # The maintained counter is used, so the cards are never queried
+        mock_db.child.assert_called_once_with("deck")
+
+    @patch("src.deck.routes.db")
+    def test_get_decks_missing_counter(self, mock_db):
+        """Test getdecks defaults cards_count to zero for decks without the counter"""
+        mock_deck = MagicMock()
+        mock_deck.val.return_value = {"userId": "Test", "title": "Old", "visibility": "public"}
+        mock_deck.key.return_value = "deck_old"
+        mock_db.child.return_value.order_by_child.return_value.equal_to.return_value.get.return_value.each.return_value = [
+            mock_deck
+        ]
+
+        response = self.app.get("/deck/all")
+
+        assert response.status_code == 200
+        response_data = json.loads(response.data)
+        assert response_data["decks"][0]["cards_count"] == 0
+
+    @patch("src.deck.routes.db")
+    def test_backfill_card_counts_command(self, mock_db):
+        """Test the backfill-card-counts command recounts cards per deck in one write"""
+        app = Flask(__name__)
+        app.register_blueprint(deck_bp)
+
+        mock_db.child.return_value.shallow.return_value.get.return_value.val.return_value = ["deck1", "deck2"]
+        mock_db.child.return_value.get.return_value.each.return_value = [
+            MagicMock(val=lambda: {"deckId": "deck1"}),
+            MagicMock(val=lambda: {"deckId": "deck1"}),
+            MagicMock(val=lambda: {"deckId": "deleted_deck"}),
+        ]
+
+        result = app.test_cli_runner().invoke(args=["deck", "backfill-card-counts"])
+
+        assert result.exit_code == 0
+        mock_db.update.assert_called_once_with({"deck/deck1/cards_count": 2, "deck/deck2/cards_count": 0})
+
+    def test_rebuild_card_index_command(self):
+        """Test the rebuild-card-index command replaces the unscoped index with per-deck entries"""
+        app = Flask(__name__)
+        app.register_blueprint(deck_bp)
+        card = {"front": "f", "back": "b", "hint": "h"}
+        store = FakeFirebase(
+            {
+                "card": {"a": {**card, "deckId": "deck1"}, "b": {**card, "deckId": "deck2"}},
+                "card_hash": {card_hash("f", "b", "h"): "a"},
+            }
+        )
+
+        with patch("src.deck.routes.db", store.database()):
+            result = app.test_cli_runner().invoke(args=["deck", "rebuild-card-index"])
+
+        assert result.exit_code == 0, result.output
+        assert "Indexed 2 cards in 2 decks" in result.output
+        assert store.read("card_hash") == {card_hash("f", "b", "h"): {"deck1": "a", "deck2": "b"}}
+
+    def record_answer_db(self):
+        """Fake database with one card and the card_hash entry for its content"""
+        return FakeFirebase(
+            {
+                "card": {"card1": {"deckId": "deck1", "front": "f", "back": "b", "hint": "h"}},
+                "card_hash": {card_hash("f", "b", "h"): {"deck1": "card1"}},
+            }
+        ).database()
+
+    @patch("src.deck.routes.gamification_queue")
+    def test_record_answer_with_card_id(self, mock_queue):
+        """Test record-answer uses the cardId and deckId directly without looking the card up"""
+        mock_queue.enabled = True
+        db = self.record_answer_db()
+
+        with patch("src.deck.routes.db", db):
+            response = self.app.post(
+                "/deck/user123/record-answer",
+                data=json.dumps({"cardId": "card1", "deckId": "deck1", "quality": 4}),
+                content_type="application/json",
+            )
+
+        assert response.status_code == 200
+        assert not [path for method, path in db.store.requests if path.startswith("card")]
+        assert db.store.read("user_card_progress/user123/deck1/card1/repetitions") == 1
+        assert db.store.read("user_due_cards/user123/deck1/due/card1/progress/repetitions") == 1
+        mock_queue.submit.assert_called_once_with("user123", {"quality": 4, "card_id": "card1", "timezone": "UTC"})
+        assert json.loads(response.data)["gamification"] == {"queued": True}
+
+    @patch("src.deck.routes.gamification_queue")
+    def test_record_answer_with_card_content(self, mock_queue):
+        """Test record-answer resolves legacy front/back/hint payloads through the deck's card_hash index"""
+        db = self.record_answer_db()
+
+        with patch("src.deck.routes.db", db):
+            response = self.app.post(
+                "/deck/user123/record-answer",
+                data=json.dumps({"deckId": "deck1", "front": "f", "back": "b", "hint": "h", "quality": 5}),
+                content_type="application/json",
+            )
+
+        assert response.status_code == 200
+        assert ("get", f"card_hash/{card_hash('f', 'b', 'h')}/deck1") in db.store.requests
+        assert ("get", "card") not in db.store.requests
+        assert db.store.read("user_card_progress/user123/deck1/card1/confidence") == 5
+
+    @patch("src.deck.routes.gamification_queue")
+    def test_record_answer_with_card_content_only(self, mock_queue):
+        """Test a legacy payload without cardId or deckId finds an indexed card without the front query"""
+        db = self.record_answer_db()
+
+        with (
+            patch("src.deck.routes.db", db),
+            patch.object(
+                FakeDatabase, "order_by_child", autospec=True, side_effect=FakeDatabase.order_by_child
+            ) as order,
+        ):
+            response = self.app.post(
+                "/deck/user123/record-answer",
+                data=json.dumps({"front": "f", "back": "b", "hint": "h", "quality": 5}),
+                content_type="application/json",
+            )
+
+        assert response.status_code == 200
+        assert not [args for args in order.call_args_list if args.args[1] == "front"]
+        assert db.store.read("user_card_progress/user123/deck1/card1/confidence") == 5
+
+    @patch("src.deck.routes.gamification_queue")
+    def test_record_answer_with_card_content_in_several_decks(self, mock_queue):
+        """Test a legacy payload for a card in two decks the user has not studied is a conflict"""
+        db = self.record_answer_db()
+        db.store.data["card_hash"][card_hash("f", "b", "h")]["deck2"] = "card2"
+
+        with patch("src.deck.routes.db", db):
+            response = self.app.post(
+                "/deck/user123/record-answer",
+                data=json.dumps({"front": "f", "back": "b", "hint": "h", "quality": 5}),
+                content_type="application/json",
+            )
+
+        assert response.status_code == 409
+        assert db.store.read("user_card_progress/user123") is None
+
+    @patch("src.deck.routes.record_review")
+    @patch("src.deck.routes.gamification_queue")
+    def test_record_answer_sync_gamification(self, mock_queue, mock_record_review):
+        """Test record-answer applies gamification in the request when the queue is disabled"""
+        mock_queue.enabled = False
+        mock_record_review.return_value = {"xp_earned": 13}
+        db = self.record_answer_db()
+
+        with patch("src.deck.routes.db", db):
+            response = self.app.post(
+                "/deck/user123/record-answer",
+                data=json.dumps({"cardId": "card1", "quality": 4}),
+                content_type="application/json",
+            )
+
+        assert response.status_code == 200
+        assert json.loads(response.data)["gamification"] == {"xp_earned": 13}
+        mock_record_review.assert_called_once_with(db, "user123", 4, "card1", "UTC")
+        mock_queue.submit.assert_not_called()
+
+    @patch("src.deck.routes.gamification_queue")
+    def test_record_answer_moves_legacy_progress(self, mock_queue):
+        """Test progress stored before the deck partitioning is read and moved into the deck"""
+        db = self.record_answer_db()
+        db.store.data["user_card_progress"] = {
+            "user123": {"card1": {"interval": 6, "repetitions": 2, "ease_factor": 2.5, "correct": 3}}
+        }
+
+        with patch("src.deck.routes.db", db):
+            response = self.app.post(
+                "/deck/user123/record-answer",
+                data=json.dumps({"cardId": "card1", "deckId": "deck1", "quality": 5}),
+                content_type="application/json",
+            )
+
+        assert response.status_code == 200
+        progress = db.store.read("user_card_progress/user123")
+        assert list(progress) == ["deck1"]
+        assert progress["deck1"]["card1"]["repetitions"] == 3
+        assert progress["deck1"]["card1"]["interval"] == 15
+        assert progress["deck1"]["card1"]["correct"] == 3
+
+    @patch("src.deck.routes.FUZZ_REVIEWS", True)
+    @patch("src.deck.routes.gamification_queue")
+    def test_record_answer_fuzz_picks_least_loaded_day(self, mock_queue):
+        """Test fuzz scheduling moves the card off the busy day SM-2 would pick"""
+        db = self.record_answer_db()
+        today = int(time.time()) // 86400
+        db.store.data["user_card_progress"] = {
+            "user123": {"deck1": {"card1": {"interval": 6, "repetitions": 2, "ease_factor": 2.5}}}
+        }
+        # SM-2 gives 15 days; three cards are already due that day and one the day before
+        due = {f"c{i}": {"next_review": (today + 15) * 86400 + i} for i in range(3)}
+        due["c3"] = {"next_review": (today + 14) * 86400}
+        db.store.data["user_due_cards"] = {"user123": {"deck1": {"due": due}}}
+
+        with patch("src.deck.routes.db", db):
+            response = self.app.post(
+                "/deck/user123/record-answer",
+                data=json.dumps({"cardId": "card1", "deckId": "deck1", "quality": 3}),
+                content_type="application/json",
+            )
+
+        assert response.status_code == 200
+        assert json.loads(response.data)["newInterval"] == 16
+        assert db.store.read("user_due_cards/user123/deck1/due/card1/next_review") // 86400 == today + 16
+
+    def test_record_answer_unknown_card(self):
+        """Test record-answer returns 404 when the card's deck cannot be found"""
+        with patch("src.deck.routes.db", self.record_answer_db()):
+            response = self.app.post(
+                "/deck/user123/record-answer",
+                data=json.dumps({"cardId": "missing", "quality": 4}),
+                content_type="application/json",
+            )
+        assert response.status_code == 404
+
+    def test_record_answer_missing_fields(self):
+        """Test record-answer rejects payloads without a card identifier"""
+        response = self.app.post(
+            "/deck/user123/record-answer",
+            data=json.dumps({"front": "f", "quality": 5}),
+            content_type="application/json",
+        )
+        assert response.status_code == 400
 
     @patch("src.deck.routes.db")
     def test_get_decks_error(self, mock_db):
@@ -450,7 +656,7 @@ class TestDeck(unittest.TestCase):
     def test_get_leaderboard_error(self, mock_db):
         """Test error handling in get_leaderboard route"""
         # Mock the database to raise an exception
-        mock_db.child.return_value.child.return_value.get.side_effect = Exception("Database error")
+        mock_db.child.side_effect = Exception("Database error")
 
         response = self.app.get("/deck/TestDeck/leaderboard")
         assert response.status_code == 400
@@ -474,9 +680,7 @@ class TestDeck(unittest.TestCase):
     def test_update_leaderboard_error(self, mock_db):
         """Test error handling in update_leaderboard route"""
         # Mock the database to raise an exception
-        mock_db.child.return_value.child.return_value.child.return_value.update.side_effect = Exception(
-            "Database error"
-        )
+        mock_db.child.return_value.get_etag.side_effect = Exception("Database error")
         response = self.app.post(
             "/deck/TestDeck/update-leaderboard",
             data=json.dumps(
@@ -680,3 +884,701 @@ class TestDeck(unittest.TestCase):
 
 if __name__ == "__main__":
     unittest.main()
+
+
+class TestPracticeEndpoints(unittest.TestCase):
+    def setUp(self):
+        app = Flask(__name__)
+        app.register_blueprint(deck_bp)
+        self.client = app.test_client()
+        self.store = FakeFirebase(
+            {
+                "deck": {"deck1": {"title": "Deck", "cards_count": 3}},
+                "card": {
+                    "c1": {"deckId": "deck1", "front": "f1", "back": "b1", "hint": "h1"},
+                    "c2": {"deckId": "deck1", "front": "f2", "back": "b2", "hint": "h2"},
+                    "c3": {"deckId": "deck1", "front": "f3", "back": "b3", "hint": "h3"},
+                    "other": {"deckId": "deck2", "front": "x", "back": "y", "hint": "z"},
+                },
+                "user_card_progress": {
+                    "user1": {
+                        "c1": {
+                            "interval": 6,
+                            "repetitions": 2,
+                            "ease_factor": 2.5,
+                            "next_review": "2000-01-01T00:00:00+00:00",
+                        },
+                        "c2": {
+                            "interval": 6,
+                            "repetitions": 2,
+                            "ease_factor": 2.5,
+                            "next_review": "2999-01-01T00:00:00+00:00",
+                        },
+                    }
+                },
+            }
+        )
+        self.db = self.store.database()
+
+    def practice(self):
+        with patch("src.deck.routes.db", self.db):
+            response = self.client.get("/deck/deck1/practice-cards/user1")
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data)["cards"]
+
+    def test_index_is_built_once_then_queried(self):
+        """Test the first practice call builds the index and later calls only query it"""
+        cards = self.practice()
+
+        # new card first, then overdue cards; c2 is not due yet
+        self.assertEqual([card["id"] for card in cards], ["c3", "c1"])
+        self.assertIsNone(cards[0]["progress"])
+        self.assertEqual(cards[1]["front"], "f1")
+        self.assertEqual(self.store.read("user_due_cards/user1/deck1/due/c1/next_review"), 946684800)
+
+        self.store.requests.clear()
+        self.practice()
+        self.assertNotIn(("set", "user_due_cards/user1/deck1"), self.store.requests)
+        self.assertNotIn(("get", "user_card_progress/user1"), self.store.requests)
+        # Only the picked cards are read, by key, never the whole deck
+        self.assertEqual([path for _, path in self.store.requests if path.startswith("card")], ["card/c3", "card/c1"])
+
+    def test_record_answer_moves_card_out_of_new_list(self):
+        """Test answering a new card schedules it in the due index"""
+        self.practice()
+        with patch("src.deck.routes.db", self.db), patch("src.deck.routes.gamification_queue"):
+            response = self.client.post(
+                "/deck/user1/record-answer",
+                data=json.dumps({"cardId": "c3", "quality": 5}),
+                content_type="application/json",
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(self.store.read("user_due_cards/user1/deck1/new"))
+        entry = self.store.read("user_due_cards/user1/deck1/due/c3")
+        self.assertGreater(entry["next_review"], time.time())
+        self.assertEqual(entry["progress"]["repetitions"], 1)
+        self.assertEqual([card["id"] for card in self.practice()], ["c1"])
+
+    def test_changed_deck_rebuilds_index(self):
+        """Test the index is rebuilt when the deck's cards_version moves on"""
+        self.practice()
+        self.db.update(
+            {"card/c4": {"deckId": "deck1", "front": "f4", "back": "b4", "hint": "h4"}, "deck/deck1/cards_version": 1}
+        )
+
+        self.assertEqual([card["id"] for card in self.practice()], ["c3", "c4", "c1"])
+        self.assertEqual(self.store.read("user_due_cards/user1/deck1/version"), 1)
+
+    def test_practice_queue_limit(self):
+        """Test the due query only returns as many cards as are still needed"""
+        self.assertEqual(practice_queue(self.db, "user1", "deck1", limit=1), [("c3", None)])
+
+    def test_practice_endpoints_do_not_fetch_cards_one_by_one(self):
+        """Test practice cards, schedule and statistics load the deck with at most one query
+        and read no card by key except the ones they return"""
+        for url in (
+            "/deck/deck1/practice-cards/user1",
+            "/deck/deck1/practice-schedule/user1",
+            "/deck/deck1/card-statistics/user1",
+        ):
+            self.store.requests.clear()
+            with patch("src.deck.routes.db", self.db):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            returned = {f"card/{card['id']}" for card in json.loads(response.data).get("cards", [])}
+            card_reads = [path for method, path in self.store.requests if method == "get" and path.startswith("card")]
+            self.assertLessEqual([path for path in card_reads if path not in returned], ["card"], url)
+
+    def test_practice_schedule_forecast(self):
+        """Test the schedule buckets reviews by day, counting overdue cards on today"""
+        day = 24 * 60 * 60
+        today = int(time.time()) // day * day
+        self.db.update(
+            {
+                "card/c4": {"deckId": "deck1", "front": "f4", "back": "b4", "hint": "h4"},
+                "user_card_progress/user1/c4": {
+                    "interval": 2,
+                    "repetitions": 1,
+                    "ease_factor": 2.5,
+                    "next_review": datetime.fromtimestamp(today + 2 * day + 60, timezone.utc).isoformat(),
+                },
+            }
+        )
+
+        with patch("src.deck.routes.db", self.db):
+            response = self.client.get("/deck/deck1/practice-schedule/user1?days=3")
+            compact = self.client.get("/deck/deck1/practice-schedule/user1?days=3&compact=true")
+
+        data = json.loads(response.data)
+        self.assertEqual(data["start"], today)
+        self.assertEqual([bucket["cardIds"] for bucket in data["schedule"]], [["c1"], [], ["c4"]])
+        date = datetime.fromtimestamp(today + 2 * day, timezone.utc).strftime("%Y-%m-%d")
+        self.assertEqual(data["schedule"][2]["date"], date)
+        self.assertEqual((data["overdue"], data["new"]), (1, 1))
+        self.assertEqual(json.loads(compact.data)["counts"], [1, 0, 1])
+        self.assertNotIn("schedule", json.loads(compact.data))
+
+    def test_practice_schedule_rejects_bad_days(self):
+        """Test the days parameter is validated"""
+        for days in ("0", "1000", "abc"):
+            with patch("src.deck.routes.db", self.db):
+                response = self.client.get(f"/deck/deck1/practice-schedule/user1?days={days}")
+            self.assertEqual(response.status_code, 400, days)
+
+    def test_legacy_progress_is_moved_into_deck_partition(self):
+        """Test deck endpoints read legacy progress once and move it under the deck"""
+        self.practice()
+
+        self.assertEqual(sorted(self.store.read("user_card_progress/user1/deck1")), ["c1", "c2"])
+        self.assertIsNone(self.store.read("user_card_progress/user1/c1"))
+
+    def test_partitioned_progress_reads_only_the_deck(self):
+        """Test that with legacy reads disabled only the deck's partition is downloaded"""
+        self.store.data["user_card_progress"] = {"user1": {"deck1": self.store.data["user_card_progress"]["user1"]}}
+
+        with patch("src.deck.progress.LEGACY_PROGRESS_READS", False):
+            self.store.requests.clear()
+            cards = self.practice()
+
+        self.assertEqual([card["id"] for card in cards], ["c3", "c1"])
+        progress_reads = [path for method, path in self.store.requests if path.startswith("user_card_progress")]
+        self.assertEqual(progress_reads, ["user_card_progress/user1/deck1"])
+
+    def test_migrate_progress_command(self):
+        """Test the migration moves every legacy entry and leaves partitions alone"""
+        self.store.data["user_card_progress"]["user2"] = {
+            "deck1": {"c1": {"interval": 1, "repetitions": 1}},
+            "deleted": {"interval": 1, "repetitions": 1},
+        }
+        app = Flask(__name__)
+        app.register_blueprint(deck_bp)
+
+        with patch("src.deck.routes.db", self.db):
+            result = app.test_cli_runner().invoke(args=["deck", "migrate-progress"])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Moved 2 progress entries for 2 users (1 entries", result.output)
+        self.assertEqual(sorted(self.store.read("user_card_progress/user1")), ["deck1"])
+        self.assertEqual(sorted(self.store.read("user_card_progress/user1/deck1")), ["c1", "c2"])
+        self.assertEqual(sorted(self.store.read("user_card_progress/user2")), ["deck1", "deleted"])
+
+    def record_answers(self, payload):
+        with patch("src.deck.routes.db", self.db):
+            return self.client.post(
+                "/deck/user1/record-answers", data=json.dumps(payload), content_type="application/json"
+            )
+
+    @patch("src.deck.routes.record_reviews")
+    @patch("src.deck.routes.gamification_queue")
+    def test_record_answers_batch(self, mock_queue, mock_record_reviews):
+        """Test a session is applied in answeredAt order with one write and one gamification update"""
+        mock_queue.enabled = False
+        mock_record_reviews.return_value = {"xp_earned": 40}
+        self.practice()  # moves the legacy progress into the deck first
+        self.store.requests.clear()
+
+        response = self.record_answers(
+            {
+                "deckId": "deck1",
+                "reviews": [
+                    {"cardId": "c3", "quality": 4, "answeredAt": "2030-01-01T10:05:00Z"},
+                    {"cardId": "c3", "quality": 2, "answeredAt": "2030-01-01T10:00:00Z"},
+                    {"cardId": "c1", "quality": 5, "answeredAt": 1893488400000},
+                ],
+            }
+        )
+
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual([result["cardId"] for result in data["results"]], ["c1", "c3", "c3"])
+        self.assertEqual(data["gamification"], {"xp_earned": 40})
+        self.assertEqual([method for method, _ in self.store.requests].count("update"), 1)
+
+        # c3 was failed first, then answered correctly: one repetition, due a day after the last answer
+        c3 = self.store.read("user_card_progress/user1/deck1/c3")
+        self.assertEqual(c3["repetitions"], 1)
+        self.assertEqual(c3["next_review"], "2030-01-02T10:05:00+00:00")
+        self.assertEqual(self.store.read("user_card_progress/user1/deck1/c1/repetitions"), 3)
+        self.assertEqual(self.store.read("user_due_cards/user1/deck1/due/c3/next_review"), 1893578700)
+
+        events = mock_record_reviews.call_args.args[2]
+        self.assertEqual([event["quality"] for event in events], [5, 2, 4])
+
+    @patch("src.deck.routes.FUZZ_REVIEWS", True)
+    @patch("src.deck.routes.gamification_queue")
+    def test_record_answers_fuzz_spreads_cards(self, mock_queue):
+        """Test cards learned together are spread over different days when fuzz scheduling is on"""
+        mock_queue.enabled = True
+        self.practice()
+
+        response = self.record_answers(
+            {
+                "deckId": "deck1",
+                "reviews": [
+                    {"cardId": "c1", "quality": 3, "answeredAt": "2030-01-01T10:00:00Z"},
+                    {"cardId": "c2", "quality": 3, "answeredAt": "2030-01-01T10:01:00Z"},
+                ],
+            }
+        )
+
+        self.assertEqual(response.status_code, 200)
+        # Both would be due in 15 days; the second goes to the nearest free day instead
+        results = json.loads(response.data)["results"]
+        self.assertEqual([result["newInterval"] for result in results], [15, 14])
+        self.assertEqual(self.store.read("user_card_progress/user1/deck1/c2/next_review"), "2030-01-15T10:01:00+00:00")
+
+    @patch("src.deck.routes.gamification_queue")
+    def test_record_answers_unknown_cards(self, mock_queue):
+        """Test cards that do not exist are reported and left out of gamification"""
+        mock_queue.enabled = True
+
+        response = self.record_answers({"reviews": [{"cardId": "c2", "quality": 3}, {"cardId": "gone", "quality": 3}]})
+
+        data = json.loads(response.data)
+        self.assertEqual(data["notFound"], ["gone"])
+        self.assertEqual([result["cardId"] for result in data["results"]], ["c2"])
+        mock_queue.submit_many.assert_called_once_with("user1", [{"quality": 3, "card_id": "c2", "timezone": "UTC"}])
+
+    def test_record_answers_validation(self):
+        """Test malformed batches are rejected before anything is written"""
+        for payload in (
+            {},
+            {"reviews": []},
+            {"reviews": [{"cardId": "c1"}]},
+            {"reviews": [{"cardId": "c1", "quality": 7}]},
+            {"reviews": [{"cardId": "c1", "quality": 3, "answeredAt": "yesterday"}]},
+            {"reviews": [{"cardId": "c1", "quality": 3}] * 501},
+        ):
+            self.store.requests.clear()
+            self.assertEqual(self.record_answers(payload).status_code, 400, payload)
+            self.assertEqual(self.store.requests, [])
+
+    def sync(self, reviews):
+        with patch("src.deck.routes.db", self.db), patch("src.deck.routes.gamification_queue") as mock_queue:
+            response = self.client.post(
+                "/deck/user1/sync-reviews",
+                data=json.dumps({"deckId": "deck1", "reviews": reviews}),
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200, response.data)
+        return json.loads(response.data), mock_queue
+
+    def test_sync_reviews_is_idempotent(self):
+        """Test replayed reviews are applied once, including repeats inside one request"""
+        answered = datetime.now(timezone.utc).isoformat()
+        reviews = [
+            {"id": "r1", "cardId": "c3", "quality": 5, "answeredAt": answered},
+            {"id": "r1", "cardId": "c3", "quality": 5, "answeredAt": answered},
+        ]
+
+        first, first_queue = self.sync(reviews)
+        second, second_queue = self.sync(reviews)
+
+        self.assertEqual((first["applied"], first["duplicates"]), (["r1"], ["r1"]))
+        self.assertEqual((second["applied"], second["duplicates"]), ([], ["r1", "r1"]))
+        self.assertEqual(self.store.read("user_card_progress/user1/deck1/c3/repetitions"), 1)
+        self.assertEqual(len(first_queue.submit_many.call_args.args[1]), 1)
+        second_queue.submit_many.assert_not_called()
+        day_sets = self.store.read("user_seen_reviews/user1")
+        self.assertEqual([len(seen) for seen in day_sets.values()], [1])
+
+    def test_sync_reviews_out_of_order(self):
+        """Test reviews are applied by answeredAt and late older reviews do not rewind a card"""
+        now = datetime.now(timezone.utc)
+        first, _ = self.sync(
+            [
+                {"id": "b", "cardId": "c3", "quality": 5, "answeredAt": (now - timedelta(hours=1)).isoformat()},
+                {"id": "a", "cardId": "c3", "quality": 1, "answeredAt": (now - timedelta(hours=2)).isoformat()},
+            ]
+        )
+        late, _ = self.sync(
+            [{"id": "c", "cardId": "c3", "quality": 0, "answeredAt": (now - timedelta(hours=3)).isoformat()}]
+        )
+
+        self.assertEqual(first["applied"], ["a", "b"])
+        self.assertEqual(late["results"][0]["stale"], True)
+        progress = self.store.read("user_card_progress/user1/deck1/c3")
+        self.assertEqual((progress["repetitions"], progress["confidence"]), (1, 5))
+
+    def test_sync_reviews_expired_and_pruned(self):
+        """Test reviews older than the seen-ID window are rejected and old days are pruned"""
+        old = datetime.now(timezone.utc) - timedelta(days=90)
+        self.store.data["user_seen_reviews"] = {"user1": {f"d{int(old.timestamp()) // 86400}": {"abc": 1}}}
+
+        data, _ = self.sync([{"id": "old", "cardId": "c3", "quality": 4, "answeredAt": old.isoformat()}])
+
+        self.assertEqual((data["applied"], data["expired"]), ([], ["old"]))
+        self.assertIsNone(self.store.read("user_seen_reviews/user1"))
+        self.assertIsNone(self.store.read("user_card_progress/user1/deck1/c3"))
+
+    def test_sync_reviews_concurrent_claims(self):
+        """Test two syncs of the same review racing on the seen set apply it only once"""
+        answered = datetime.now(timezone.utc)
+        review = {"id": "r1", "card_id": "c3", "quality": 5, "answered_at": answered}
+        other = self.store.database()
+        raced = []
+
+        def competing_sync(path):
+            if path.startswith("user_seen_reviews") and not raced:
+                raced.append(path)
+                claim_reviews(other, "user1", [dict(review)], answered)
+
+        self.store.before_conditional_write = competing_sync
+        claimed, duplicates, _ = claim_reviews(self.db, "user1", [review], answered)
+
+        self.assertEqual((claimed, len(duplicates)), ([], 1))
+        self.assertEqual(self.store.conflicts, 1)
+
+    def test_sync_reviews_releases_claims_on_failure(self):
+        """Test a failed write forgets the claimed IDs so the client can retry"""
+        answered = datetime.now(timezone.utc).isoformat()
+        with patch("src.deck.routes.apply_reviews", side_effect=Exception("Firebase unavailable")):
+            with patch("src.deck.routes.db", self.db):
+                response = self.client.post(
+                    "/deck/user1/sync-reviews",
+                    data=json.dumps({"reviews": [{"id": "r1", "cardId": "c3", "quality": 5, "answeredAt": answered}]}),
+                    content_type="application/json",
+                )
+
+        self.assertEqual(response.status_code, 500)
+        self.assertIsNone(self.store.read("user_seen_reviews/user1"))
+        data, _ = self.sync([{"id": "r1", "cardId": "c3", "quality": 5, "answeredAt": answered}])
+        self.assertEqual(data["applied"], ["r1"])
+
+    def test_sync_reviews_requires_ids(self):
+        """Test every synced review must carry its client ID and answer time"""
+        for review in (
+            {"cardId": "c3", "quality": 5, "answeredAt": "2030-01-01T00:00:00Z"},
+            {"id": "x", "cardId": "c3", "quality": 5},
+        ):
+            with patch("src.deck.routes.db", self.db):
+                response = self.client.post(
+                    "/deck/user1/sync-reviews", data=json.dumps({"reviews": [review]}), content_type="application/json"
+                )
+            self.assertEqual(response.status_code, 400)
+
+    def test_scheduler_setting(self):
+        """Test a user opts a deck into FSRS and back, and unknown schedulers are rejected"""
+        with patch("src.deck.routes.db", self.db):
+            default = self.client.get("/deck/deck1/scheduler/user1")
+            updated = self.client.put(
+                "/deck/deck1/scheduler/user1", data=json.dumps({"scheduler": "fsrs"}), content_type="application/json"
+            )
+            current = self.client.get("/deck/deck1/scheduler/user1")
+            invalid = self.client.put(
+                "/deck/deck1/scheduler/user1", data=json.dumps({"scheduler": "anki"}), content_type="application/json"
+            )
+
+        self.assertEqual(json.loads(default.data)["scheduler"], "sm2")
+        self.assertEqual(updated.status_code, 200)
+        self.assertEqual(json.loads(current.data)["scheduler"], "fsrs")
+        self.assertEqual(invalid.status_code, 400)
+        self.assertEqual(self.store.read("user_scheduler/user1"), {"decks": {"deck1": "fsrs"}})
+
+    @patch("src.deck.routes.gamification_queue")
+    def test_record_answers_with_fsrs_deck(self, mock_queue):
+        """Test reviews of a deck opted into FSRS are scheduled with the user's fitted parameters"""
+        mock_queue.enabled = True
+        params = [float(value) for value in range(1, 18)]
+        self.store.data["user_scheduler"] = {"user1": {"decks": {"deck1": "fsrs"}, "fsrs": {"params": params}}}
+
+        response = self.record_answers(
+            {"deckId": "deck1", "reviews": [{"cardId": "c3", "quality": 4, "answeredAt": "2030-01-01T00:00:00Z"}]}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        c3 = self.store.read("user_card_progress/user1/deck1/c3")
+        # A first "Good" starts at the third parameter's stability
+        self.assertEqual((c3["scheduler"], c3["stability"], c3["interval"]), ("fsrs", 3.0, 3))
+
+    def test_fit_fsrs_command(self):
+        """Test the fitting job stores parameters for users who opted into FSRS and have enough history"""
+        day = 86400
+        records = [(card, step * 5 * day, 4 if step % 4 else 1, 0) for step in range(8) for card in range(30)]
+        self.store.data["user_review_log"] = {
+            "user2": {"cards": {str(card): f"card{card}" for card in range(30)}, "chunks": {"-a": pack(records)}}
+        }
+        self.store.data["user_scheduler"] = {
+            "user1": {"decks": {"deck1": "sm2"}},
+            "user2": {"decks": {"deck1": "fsrs"}},
+        }
+        app = Flask(__name__)
+        app.register_blueprint(deck_bp)
+
+        with patch("src.deck.routes.db", self.db):
+            result = app.test_cli_runner().invoke(args=["deck", "fit-fsrs"])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Fitted FSRS parameters for 1 of 1 users", result.output)
+        fitted = self.store.read("user_scheduler/user2/fsrs")
+        self.assertEqual(fitted["reviews"], 30 * 7)
+        self.assertEqual(len(fitted["params"]), 17)
+        self.assertIsNone(self.store.read("user_scheduler/user1/fsrs"))
+
+    @patch("src.deck.routes.gamification_queue")
+    def test_reviews_are_logged(self, mock_queue):
+        """Test single and batch answers append to the review log with the same update as the progress"""
+        mock_queue.enabled = True
+        self.practice()
+        self.store.requests.clear()
+
+        with patch("src.deck.routes.db", self.db):
+            single = self.client.post(
+                "/deck/user1/record-answer",
+                data=json.dumps({"cardId": "c3", "deckId": "deck1", "quality": 4, "elapsedMs": 2500}),
+                content_type="application/json",
+            )
+        batch = self.record_answers(
+            {
+                "reviews": [
+                    {"cardId": "c1", "deckId": "deck1", "quality": 1, "answeredAt": 1893456000000, "elapsedMs": 900},
+                    {"cardId": "c3", "deckId": "deck1", "quality": 5, "answeredAt": 1893456060000},
+                    {"cardId": "missing", "quality": 5, "answeredAt": 1893456060000},
+                ],
+            }
+        )
+
+        self.assertEqual((single.status_code, batch.status_code), (200, 200))
+        self.assertEqual([method for method, _ in self.store.requests].count("update"), 2)
+        # Appending needs no transaction on the log
+        self.assertNotIn("user_review_log/user1/card_count", [path for _, path in self.store.requests])
+        cards, records = read_log(self.db, "user1")
+        self.assertEqual(cards, {0: "c3", 1: "c1"})
+        self.assertEqual(records[["card", "quality", "elapsed_ms"]].tolist(), [(0, 4, 2500), (1, 1, 900), (0, 5, 0)])
+        self.assertEqual(records["epoch"].tolist()[1:], [1893456000, 1893456060])
+        self.assertEqual(self.store.read("user_review_counts/user1/deck1/c3"), {"reviews": 2, "correct": 2})
+        self.assertEqual(self.store.read("user_review_counts/user1/deck1/c1"), {"reviews": 1})
+
+    def test_card_statistics_counts_logged_reviews(self):
+        """Test statistics use the deck's review counts, falling back to repetitions for older cards"""
+        self.store.data["user_review_counts"] = {
+            "user1": {"deck1": {"c3": {"reviews": 3, "correct": 2}}, "deck2": {"c9": {"reviews": 40}}}
+        }
+        self.store.data["user_card_progress"]["user1"]["c3"] = {"interval": 6, "repetitions": 1}
+
+        with patch("src.deck.routes.db", self.db):
+            response = self.client.get("/deck/deck1/card-statistics/user1")
+
+        statistics = json.loads(response.data)["statistics"]
+        cards = {card["id"]: card for card in statistics["cards_data"]}
+        self.assertEqual((cards["c3"]["total_reviews"], cards["c3"]["correct_count"]), (3, 2))
+        self.assertEqual(cards["c1"]["total_reviews"], 2)
+        self.assertEqual(statistics["performance"]["total_reviews"], 3 + 2 + 2)
+
+    def test_record_answer_rejects_invalid_quality(self):
+        """Test record-answer only accepts qualities 0 to 5"""
+        with patch("src.deck.routes.db", self.db):
+            response = self.client.post(
+                "/deck/user1/record-answer",
+                data=json.dumps({"cardId": "c3", "deckId": "deck1", "quality": 9}),
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 400)
+
+    def test_compact_review_log_command(self):
+        """Test the compaction command merges each user's small chunks"""
+        self.store.data["user_review_log"] = {
+            "user1": {"chunks": {f"-k{i}": pack([(0, i, 4, 0)]) for i in range(5)}},
+            "user2": {"chunks": {"-k": pack([(0, 1, 4, 0)])}},
+        }
+        app = Flask(__name__)
+        app.register_blueprint(deck_bp)
+
+        with patch("src.deck.routes.db", self.db):
+            result = app.test_cli_runner().invoke(args=["deck", "compact-review-log"])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Compacted 6 review log chunks into 2 for 2 users", result.output)
+        self.assertEqual(list(self.store.read("user_review_log/user1/chunks")), ["-k0"])
+
+    def test_rebuild_review_counts_command(self):
+        """Test the rebuild command counts each user's logged reviews under the cards' decks"""
+        self.store.data["user_review_log"] = {
+            "user1": {"cards": {"0": "c1", "1": "deleted"}, "chunks": {"-a": pack([(0, 1, 4, 0), (1, 2, 4, 0)])}},
+            "user2": {"chunks": {"-a": {"cards": ["c3"], "records": pack([(0, 1, 1, 0), (0, 2, 3, 0)])}}},
+        }
+        app = Flask(__name__)
+        app.register_blueprint(deck_bp)
+
+        with patch("src.deck.routes.db", self.db):
+            result = app.test_cli_runner().invoke(args=["deck", "rebuild-review-counts"])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Rebuilt the review counts of 2 cards for 2 users", result.output)
+        self.assertEqual(self.store.read("user_review_counts/user1"), {"deck1": {"c1": {"reviews": 1, "correct": 1}}})
+        self.assertEqual(self.store.read("user_review_counts/user2/deck1/c3"), {"reviews": 2, "correct": 1})
+
+
+class TestDeckLeaderboard(unittest.TestCase):
+    def setUp(self):
+        app = Flask(__name__)
+        app.register_blueprint(deck_bp)
+        self.cli = app.test_cli_runner()
+        self.client = app.test_client()
+        self.store = FakeFirebase()
+        self.db = self.store.database()
+
+    def save(self, user_id, correct, incorrect):
+        with patch("src.deck.routes.db", self.db):
+            response = self.client.post(
+                "/deck/deck1/update-leaderboard",
+                data=json.dumps(
+                    {
+                        "userId": user_id,
+                        "userEmail": f"{user_id}@example.com",
+                        "correct": correct,
+                        "incorrect": incorrect,
+                    }
+                ),
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def stats(self):
+        with patch("src.deck.routes.db", self.db):
+            return json.loads(self.client.get("/deck/deck1/stats").data)
+
+    def test_summary_follows_updates(self):
+        """Test the deck summary is kept in step as users save and re-save scores"""
+        self.save("user1", 10, 2)
+        self.save("user2", 4, 4)
+        self.save("user1", 6, 5)
+
+        self.assertEqual(self.store.read("leaderboard/deck1/_summary"), {"correct": 10, "incorrect": 9, "users": 2})
+        self.store.requests.clear()
+        stats = self.stats()
+        self.assertEqual((stats["average_correct"], stats["average_incorrect"], stats["total_users"]), (5, 4.5, 2))
+        self.assertEqual(self.store.requests, [("get", "leaderboard/deck1/_summary")])
+
+    def test_stats_without_scores(self):
+        """Test a deck nobody has scored on has empty stats"""
+        stats = self.stats()
+        self.assertEqual((stats["average_correct"], stats["total_users"]), (0, 0))
+
+    def test_leaderboard_skips_summary(self):
+        """Test the summary is not listed as a user on the leaderboard"""
+        self.save("user1", 3, 1)
+
+        with patch("src.deck.routes.db", self.db):
+            leaderboard = json.loads(self.client.get("/deck/deck1/leaderboard").data)["leaderboard"]
+
+        self.assertEqual([entry["userEmail"] for entry in leaderboard], ["user1@example.com"])
+
+    def leaderboard(self, path):
+        with patch("src.deck.routes.db", self.db):
+            response = self.client.get(path)
+        return response.status_code, json.loads(response.data)
+
+    def test_empty_leaderboard(self):
+        """Test a deck nobody has scored on has an empty leaderboard rather than an error"""
+        status, data = self.leaderboard("/deck/deck1/leaderboard")
+
+        self.assertEqual(status, 200)
+        self.assertEqual((data["leaderboard"], data["next_cursor"]), ([], None))
+
+    def test_leaderboard_pages(self):
+        """Test paging through a leaderboard with ties in correct answers and in score"""
+        for user_id, correct in [("a", 5), ("b", 3), ("c", 5), ("d", 1), ("e", 3)]:
+            self.save(user_id, correct, 0)
+        # Same correct answers and the same attempt time: ordered by descending user id
+        self.store.data["leaderboard"]["deck1"]["c"]["score"] = self.store.data["leaderboard"]["deck1"]["a"]["score"]
+
+        emails, ranks, cursor = [], [], None
+        while True:
+            path = "/deck/deck1/leaderboard?limit=2" + (f"&cursor={cursor}" if cursor else "")
+            status, data = self.leaderboard(path)
+            self.assertEqual(status, 200)
+            emails += [entry["userEmail"] for entry in data["leaderboard"]]
+            ranks += [entry["rank"] for entry in data["leaderboard"]]
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+
+        self.assertEqual([email.split("@")[0] for email in emails], ["c", "a", "e", "b", "d"])
+        self.assertEqual(ranks, [1, 2, 3, 4, 5])
+
+    def test_leaderboard_rejects_bad_paging(self):
+        """Test an out of range limit or malformed cursor is rejected"""
+        self.assertEqual(self.leaderboard("/deck/deck1/leaderboard?limit=0")[0], 400)
+        self.assertEqual(self.leaderboard("/deck/deck1/leaderboard?limit=101")[0], 400)
+        self.assertEqual(self.leaderboard("/deck/deck1/leaderboard?cursor=nope")[0], 400)
+
+    def test_rank_with_neighbours(self):
+        """Test a user's rank and neighbours come from the counts and bounded queries"""
+        for user_id, correct in [("a", 9), ("b", 7), ("c", 5), ("d", 5), ("e", 3), ("f", 1)]:
+            self.save(user_id, correct, 0)
+        self.save("c", 6, 0)
+        self.save("d", 5, 0)
+        self.store.requests.clear()
+
+        status, data = self.leaderboard("/deck/deck1/leaderboard/rank/d?neighbours=2")
+
+        self.assertEqual(status, 200)
+        self.assertEqual((data["entry"]["userEmail"], data["entry"]["rank"]), ("d@example.com", 4))
+        self.assertEqual([(entry["userEmail"][0], entry["rank"]) for entry in data["above"]], [("c", 3), ("b", 2)])
+        self.assertEqual([(entry["userEmail"][0], entry["rank"]) for entry in data["below"]], [("e", 5), ("f", 6)])
+        # The entry, the counts, then bounded queries for the same correct answers, above and below
+        self.assertEqual(
+            self.store.requests,
+            [("get", "leaderboard/deck1/d"), ("get", "leaderboard_counts/deck1")] + [("get", "leaderboard/deck1")] * 3,
+        )
+
+    def test_rank_at_the_edges(self):
+        """Test the best and worst users have no neighbours past the ends of the board"""
+        for user_id, correct in [("a", 2), ("b", 1)]:
+            self.save(user_id, correct, 0)
+
+        _, best = self.leaderboard("/deck/deck1/leaderboard/rank/a")
+        _, worst = self.leaderboard("/deck/deck1/leaderboard/rank/b")
+
+        self.assertEqual((best["entry"]["rank"], best["above"], len(best["below"])), (1, [], 1))
+        self.assertEqual((worst["entry"]["rank"], len(worst["above"]), worst["below"]), (2, 1, []))
+        self.assertEqual(self.leaderboard("/deck/deck1/leaderboard/rank/nobody")[0], 404)
+        self.assertEqual(self.leaderboard("/deck/deck1/leaderboard/rank/a?neighbours=11")[0], 400)
+
+    def test_counts_are_never_returned_as_a_list_sibling(self):
+        """Test counts keyed by small numbers stay out of the ordered queries over the entries"""
+        for user_id, correct in [("a", 2), ("b", 1), ("c", 0)]:
+            self.save(user_id, correct, 0)
+        # Firebase returns an object keyed by 0, 1, 2 as an array, which pyrebase cannot sort by score
+        self.store.data["leaderboard"]["deck2"] = {"_correct_counts": {"0": 1, "1": 1, "2": 1}}
+        self.assertIsInstance(self.db.child("leaderboard/deck2/_correct_counts").get().val(), list)
+        self.assertEqual(self.leaderboard("/deck/deck2/leaderboard")[0], 400)
+
+        status, page = self.leaderboard("/deck/deck1/leaderboard")
+        rank_status, rank = self.leaderboard("/deck/deck1/leaderboard/rank/b")
+
+        self.assertEqual((status, rank_status), (200, 200))
+        self.assertEqual([entry["userEmail"][0] for entry in page["leaderboard"]], ["a", "b", "c"])
+        self.assertEqual((rank["entry"]["rank"], len(rank["above"]), len(rank["below"])), (2, 1, 1))
+        self.assertEqual(self.store.read("leaderboard_counts/deck1"), {"c0": 1, "c1": 1, "c2": 1})
+
+        # Counts left under a deck's entries by older servers are removed by the rebuild
+        with patch("src.deck.routes.db", self.db):
+            self.cli.invoke(args=["deck", "rebuild-leaderboard-summaries"])
+        self.assertIsNone(self.store.read("leaderboard/deck2/_correct_counts"))
+
+    def test_rebuild_summaries_command(self):
+        """Test the rebuild command recomputes drifted and missing summaries"""
+        self.store.data["leaderboard"] = {
+            "deck1": {
+                "_summary": {"correct": 99, "incorrect": 99, "users": 99},
+                "user1": {"correct": 3, "incorrect": 1},
+                "user2": {"correct": 2, "incorrect": 0},
+            },
+            "deck2": {"user1": {"correct": 1, "incorrect": 1}},
+        }
+
+        with patch("src.deck.routes.db", self.db):
+            result = self.cli.invoke(args=["deck", "rebuild-leaderboard-summaries"])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Rebuilt the leaderboard summary of 2 decks and the totals and scores of 2 users", result.output)
+        self.assertEqual(self.store.read("leaderboard/deck1/_summary"), {"correct": 5, "incorrect": 1, "users": 2})
+        self.assertEqual(self.store.read("leaderboard/deck2/_summary"), {"correct": 1, "incorrect": 1, "users": 1})
+        self.assertEqual(self.store.read("leaderboard_totals/user1"), {"total_correct": 4, "total_incorrect": 2})
+        self.assertEqual(self.store.read("user_leaderboard/user1/_totals"), {"correct": 4, "incorrect": 2, "decks": 2})
+        self.assertEqual(self.store.read("user_leaderboard/user2/deck1"), {"correct": 2, "incorrect": 0})
+        self.assertEqual(self.store.read("leaderboard/deck1/user1/score"), 3 * SCORE_SCALE)
+        self.assertEqual(self.store.read("leaderboard_counts/deck1"), {"c2": 1, "c3": 1})
@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from src.deck import fsrs
+from src.deck.scheduler import deck_reviewer, fsrs_params
+from src.deck.sm2 import DAY, new_progress
+
+
+def synthetic_histories(params, cards=400, reviews=8, seed=1):
+    """Review histories of a learner whose memory follows FSRS with ``params``"""
+    rng = np.random.default_rng(seed)
+    histories = []
+    for _ in range(cards):
+        stability, difficulty = fsrs.initial_state(np.array(params), 3)
+        epoch, history = 0, [(0, 4)]
+        for _ in range(reviews):
+            elapsed = fsrs.next_interval(stability) * rng.uniform(0.5, 1.5)
+            epoch += int(elapsed * DAY)
+            rating = 3 if rng.random() < fsrs.retrievability(elapsed, stability) else 1
+            history.append((epoch, 4 if rating == 3 else 1))
+            stability, difficulty = fsrs.next_state(np.array(params), stability, difficulty, elapsed, rating)
+        histories.append(history)
+    return histories
+
+
+class TestFsrs:
+    reviewed_at = datetime(2030, 1, 1, tzinfo=timezone.utc)
+
+    def test_first_review(self):
+        update = fsrs.review(new_progress(self.reviewed_at), 4, self.reviewed_at)
+
+        # At 90% retention the interval equals the stability, 3.7145 days for a first "Good"
+        assert update["stability"] == 3.7145
+        assert update["interval"] == 4
+        assert update["repetitions"] == 1
+        assert update["next_review"] == "2030-01-05T00:00:00+00:00"
+
+    def test_recall_grows_and_lapse_shrinks_stability(self):
+        progress = {
+            "interval": 4,
+            "repetitions": 1,
+            "ease_factor": 2.5,
+            "scheduler": "fsrs",
+            "stability": 3.7145,
+            "difficulty": 5.1618,
+            "last_review": (self.reviewed_at - timedelta(days=4)).isoformat(),
+        }
+
+        recalled = fsrs.review(progress, 4, self.reviewed_at)
+        forgotten = fsrs.review(progress, 1, self.reviewed_at)
+
+        assert recalled["stability"] > 10 and recalled["repetitions"] == 2
+        assert forgotten["stability"] < 3.7145 and forgotten["repetitions"] == 0
+        assert forgotten["difficulty"] > recalled["difficulty"]
+
+    def test_continues_sm2_cards(self):
+        progress = {
+            "interval": 15.0,
+            "repetitions": 3,
+            "ease_factor": 2.5,
+            "last_review": (self.reviewed_at - timedelta(days=15)).isoformat(),
+        }
+
+        update = fsrs.review(progress, 4, self.reviewed_at)
+
+        assert update["interval"] > 15
+        assert update["ease_factor"] == 2.5
+
+    def test_log_loss_batches_parameter_sets(self):
+        elapsed, ratings, mask = fsrs._history_arrays(synthetic_histories(fsrs.DEFAULT_PARAMS, cards=50))
+        other = np.array(fsrs.DEFAULT_PARAMS) * 1.1
+
+        losses = fsrs.log_loss(np.vstack([fsrs.DEFAULT_PARAMS, other]), elapsed, ratings, mask)
+
+        assert np.allclose(losses, [fsrs.log_loss(p, elapsed, ratings, mask) for p in (fsrs.DEFAULT_PARAMS, other)])
+
+    def test_fit_parameters(self):
+        true_params = np.array(fsrs.DEFAULT_PARAMS)
+        true_params[[0, 8, 10]] = [1.5, 2.2, 1.5]
+        histories = synthetic_histories(true_params)
+        elapsed, ratings, mask = fsrs._history_arrays(histories)
+
+        params, loss, reviews = fsrs.fit_parameters(histories, iterations=40)
+
+        assert reviews == 400 * 8
+        assert loss < fsrs.log_loss(fsrs.DEFAULT_PARAMS, elapsed, ratings, mask) - 0.01
+        assert len(params) == 17
+
+    def test_fit_needs_enough_reviews(self):
+        assert fsrs.fit_parameters([[(0, 4), (DAY, 4)]] * 10) is None
+
+
+class TestScheduler:
+    reviewed_at = datetime(2030, 1, 1, tzinfo=timezone.utc)
+
+    def test_deck_reviewer_uses_deck_setting(self):
+        settings = {"decks": {"deck1": "fsrs", "deck2": "bogus"}}
+
+        fsrs_update = deck_reviewer(settings, "deck1")(new_progress(self.reviewed_at), 4, self.reviewed_at)
+        sm2_update = deck_reviewer(settings, "deck2")(new_progress(self.reviewed_at), 4, self.reviewed_at)
+
+        assert fsrs_update["scheduler"] == "fsrs" and "stability" in fsrs_update
+        assert sm2_update["scheduler"] == "sm2" and "stability" not in sm2_update
+
+    def test_fsrs_params(self):
+        params = list(range(17))
+
+        assert fsrs_params({"fsrs": {"params": params}}) == params
+        assert fsrs_params({"fsrs": {"params": {str(i): i for i in range(17)}}}) == params
+        assert fsrs_params({"fsrs": {"params": [1, 2]}}) is None
+        assert fsrs_params({}) is None
@@ -0,0 +1,362 @@
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import pytest
+from flask import Flask
+
+from src.common.firebase_ops import TransactionConflict
+from src.gamification.routes import gamification_bp
+from src.gamification.service import (
+    ACHIEVEMENT_RULES,
+    ACHIEVEMENTS,
+    apply_activity,
+    apply_xp,
+    evaluate_achievements,
+    grant_achievement,
+    new_profile,
+    record_review,
+    update_profile,
+)
+from src.gamification.xp_leaderboard import read_page, read_rank
+from tests.fake_firebase import FakeDatabase, FakeFirebase
+
+TEST_USER_ID = "test_user_123"
+
+
+def days_ago(days):
+    return (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d")
+
+
+def fake_db_with_profile(profile):
+    return FakeFirebase({"user_gamification": {TEST_USER_ID: profile}}).database()
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    app.register_blueprint(gamification_bp)
+    app.config["TESTING"] = True
+    return app.test_client()
+
+
+class TestGamificationService:
+    def test_apply_activity_continues_streak(self):
+        profile = new_profile()
+        profile["streak"] = {"current_streak": 2, "longest_streak": 2, "last_activity_date": days_ago(1)}
+
+        apply_activity(profile, "UTC")
+        earned = evaluate_achievements(profile)
+
+        assert profile["streak"]["current_streak"] == 3
+        assert profile["streak"]["longest_streak"] == 3
+        assert [achievement["id"] for achievement in earned] == ["streak_3_days"]
+        assert profile["xp"] == 30
+
+    def test_apply_activity_resets_missed_streak(self):
+        profile = new_profile()
+        profile["streak"] = {"current_streak": 10, "longest_streak": 10, "last_activity_date": days_ago(3)}
+
+        apply_activity(profile, "America/New_York")
+
+        assert profile["streak"]["current_streak"] == 1
+        assert profile["streak"]["longest_streak"] == 10
+
+    def test_apply_activity_unknown_timezone_uses_utc(self):
+        profile = new_profile()
+
+        apply_activity(profile, "Not/AZone")
+
+        assert profile["streak"]["last_activity_date"] == datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+    def test_apply_xp_review_with_streak_bonus(self):
+        profile = new_profile()
+        profile["streak"]["current_streak"] = 2
+
+        xp_earned = apply_xp(profile, "review_card", {"quality": 5})
+
+        # (5 base + 10 quality) * 1.2 streak bonus
+        assert xp_earned == 18
+        assert profile["xp"] == 18
+        assert profile["stats"]["cards_reviewed"] == 1
+        assert profile["stats"]["perfect_recalls"] == 1
+        assert evaluate_achievements(profile) == []
+
+    def test_apply_xp_keeps_achievement_xp(self):
+        profile = new_profile()
+        profile["stats"]["perfect_recalls"] = 9
+
+        xp_earned = apply_xp(profile, "review_card", {"quality": 5})
+        earned = evaluate_achievements(profile)
+
+        assert [achievement["id"] for achievement in earned] == ["perfect_recall_10"]
+        assert profile["xp"] == xp_earned + 50
+
+    def test_evaluate_achievements_single_pass(self):
+        profile = new_profile()
+        profile["streak"]["current_streak"] = 8
+        profile["stats"].update({"perfect_recalls": 60, "quizzes_completed": 1})
+        profile["achievements"] = {"streak_3_days": {"id": "streak_3_days"}}
+
+        earned = evaluate_achievements(profile)
+
+        assert {achievement["id"] for achievement in earned} == {
+            "streak_7_days",
+            "perfect_recall_10",
+            "perfect_recall_50",
+            "first_quiz",
+        }
+        assert profile["xp"] == 100 + 50 + 200 + 50
+        # everything unlocked is remembered, so a second pass grants nothing
+        assert evaluate_achievements(profile) == []
+
+    def test_every_achievement_has_a_rule(self):
+        rule_ids = {rule[0] for rule in ACHIEVEMENT_RULES}
+        assert rule_ids == set(ACHIEVEMENTS)
+        for _, section, _, threshold in ACHIEVEMENT_RULES:
+            assert section in new_profile()
+            assert threshold > 0
+
+    def test_perfect_quiz_unlocks_through_stats(self):
+        profile = new_profile()
+
+        apply_xp(profile, "complete_quiz", {"score": 9, "total": 10})
+        assert "perfect_quiz" not in {achievement["id"] for achievement in evaluate_achievements(profile)}
+
+        apply_xp(profile, "complete_quiz", {"score": 10, "total": 10})
+        assert [achievement["id"] for achievement in evaluate_achievements(profile)] == ["perfect_quiz"]
+
+    def test_grant_achievement_only_once(self):
+        profile = new_profile()
+
+        assert grant_achievement(profile, "first_quiz")["xp_awarded"] == 50
+        assert grant_achievement(profile, "first_quiz") is None
+        assert grant_achievement(profile, "not_an_achievement") is None
+        assert profile["xp"] == 50
+
+    def test_record_review_reads_and_writes_profile_once(self):
+        db = fake_db_with_profile(
+            {
+                "xp": 90,
+                "user_email": "test@example.com",
+                "streak": {"current_streak": 1, "longest_streak": 1, "last_activity_date": days_ago(0)},
+            }
+        )
+
+        result = record_review(db, TEST_USER_ID, 4, "card1")
+
+        path = f"user_gamification/{TEST_USER_ID}"
+        # The profile is read and written once, then the leaderboard entry is updated
+        assert db.store.requests == [("get_etag", path), ("get", path), ("conditional_set", path), ("update", "")]
+        saved = db.store.read(path)
+        assert saved["xp"] == 103
+        assert saved["stats"]["cards_reviewed"] == 1
+        assert saved["last_result"]["xp_earned"] == 13
+        assert result["xp_earned"] == 13
+        assert result["level_up"] is True
+        assert result["new_level"] == 1
+
+
+class TestConcurrentUpdates:
+    def test_conflicting_write_is_retried_on_fresh_profile(self):
+        db = fake_db_with_profile({"xp": 0})
+        other = db.store.database()
+        raced = []
+
+        def competing_review(path):
+            # Another server process records a review between our read and our write
+            if not raced:
+                raced.append(path)
+                record_review(other, TEST_USER_ID, 5)
+
+        db.store.before_conditional_write = competing_review
+        record_review(db, TEST_USER_ID, 5)
+
+        saved = db.store.read(f"user_gamification/{TEST_USER_ID}")
+        assert db.store.conflicts == 1
+        assert saved["xp"] == 30
+        assert saved["stats"]["cards_reviewed"] == 2
+        assert saved["stats"]["perfect_recalls"] == 2
+
+    def test_gives_up_after_bounded_retries(self):
+        db = fake_db_with_profile({"xp": 0})
+        other = db.store.database()
+        db.store.before_conditional_write = lambda path: other.child(path).child("xp").set(db.store.conflicts + 100)
+
+        with patch("src.common.firebase_ops.time.sleep"), pytest.raises(TransactionConflict):
+            record_review(db, TEST_USER_ID, 5)
+
+        assert db.store.conflicts == 10
+
+    def test_concurrent_writers_do_not_lose_xp(self):
+        store = FakeFirebase(latency=0.002)
+        workers, reviews_each = 4, 3
+        barrier = threading.Barrier(workers)
+
+        def worker():
+            db = store.database()
+            barrier.wait()
+            for _ in range(reviews_each):
+                record_review(db, TEST_USER_ID, 3)
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        saved = store.read(f"user_gamification/{TEST_USER_ID}")
+        assert store.conflicts > 0
+        assert saved["stats"]["cards_reviewed"] == workers * reviews_each
+        assert saved["xp"] == workers * reviews_each * (5 + 5)
+
+
+class TestGamificationRoutes:
+    def test_record_activity_route(self, client):
+        db = fake_db_with_profile(
+            {"xp": 0, "streak": {"current_streak": 3, "longest_streak": 5, "last_activity_date": days_ago(1)}}
+        )
+
+        with patch("src.gamification.routes.db", db):
+            response = client.post(
+                f"/gamification/record-activity/{TEST_USER_ID}",
+                data=json.dumps({"timezone": "UTC"}),
+                content_type="application/json",
+            )
+
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data["streak"]["current_streak"] == 4
+        assert data["achievements_earned"][0]["id"] == "streak_3_days"
+        assert db.store.read(f"user_gamification/{TEST_USER_ID}/streak/current_streak") == 4
+
+    def test_award_xp_route_writes_once(self, client):
+        db = FakeFirebase().database()
+
+        with patch("src.gamification.routes.db", db):
+            response = client.post(
+                f"/gamification/award-xp/{TEST_USER_ID}",
+                data=json.dumps({"activity_type": "complete_quiz", "metadata": {"score": 10, "total": 10}}),
+                content_type="application/json",
+            )
+
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data["xp_earned"] == 50
+        assert {achievement["id"] for achievement in data["achievements_earned"]} == {"perfect_quiz", "first_quiz"}
+        assert data["new_xp"] == 200
+        assert [request[0] for request in db.store.requests].count("conditional_set") == 1
+        assert db.store.read(f"user_gamification/{TEST_USER_ID}/xp") == 200
+
+    def test_latest_result_is_read_from_the_profile(self, client):
+        """Test any server process returns the result a worker in another process stored"""
+        db = FakeFirebase({"user_gamification": {TEST_USER_ID: {"last_result": {"xp_earned": 8}}}}).database()
+
+        with patch("src.gamification.routes.db", db):
+            response = client.get(f"/gamification/latest/{TEST_USER_ID}")
+
+        assert response.status_code == 200
+        assert json.loads(response.data)["result"] == {"xp_earned": 8}
+
+
+class TestXpLeaderboard:
+    def award(self, db, user_id, xp, achievements=0):
+        def change(profile):
+            profile["xp"] += xp
+            for index in range(achievements):
+                profile["achievements"][f"a{index}"] = {"id": f"a{index}"}
+
+        update_profile(db, user_id, change)
+
+    def test_profile_updates_maintain_index(self):
+        store = FakeFirebase({"users": {"user1": {"email": "one@example.com"}}})
+        db = store.database()
+
+        self.award(db, "user1", 150, achievements=2)
+        self.award(db, "user1", 100)
+        self.award(db, "user2", 30)
+
+        assert store.read("xp_leaderboard/user1") == {
+            "xp": 250,
+            "level": 3,
+            "achievements_count": 2,
+            "user_email": "one@example.com",
+        }
+        assert store.read("xp_leaderboard/user2/user_email") == "Unknown"
+        assert store.read("xp_histogram") == {"0": 1, "1": 0, "2": 1}
+
+    def test_streak_only_update_skips_index(self):
+        db = fake_db_with_profile({"xp": 10, "streak": {"current_streak": 1, "last_activity_date": days_ago(1)}})
+
+        update_profile(db, TEST_USER_ID, lambda profile: apply_activity(profile))
+
+        assert ("update", "") not in db.store.requests
+
+    def test_pages_and_ranks(self):
+        db = FakeFirebase().database()
+        for user_id, xp in [("a", 500), ("b", 120), ("c", 120), ("d", 120), ("e", 40), ("f", 900)]:
+            self.award(db, user_id, xp)
+        db.store.requests.clear()
+
+        first, cursor = read_page(db, 3)
+        second, cursor2 = read_page(db, 3, cursor)
+        third, cursor3 = read_page(db, 3, cursor2)
+
+        order = [entry["user_id"] for entry in first + second + third]
+        assert order == ["f", "a", "d", "c", "b", "e"]
+        assert [entry["rank"] for entry in first + second] == [1, 2, 3, 4, 5, 6]
+        assert third == [] and cursor3 is None
+        assert [request[0] for request in db.store.requests] == ["get", "get", "get"]
+        assert [read_rank(db, user_id)["rank"] for user_id in order] == [1, 2, 3, 4, 5, 6]
+        assert read_rank(db, "nobody") is None
+
+    def test_rank_reads_only_the_buckets_above(self):
+        db = FakeFirebase().database()
+        # Buckets 2, 3 and 11 to 13: above 1000 XP the keys sort differently as strings
+        for user_id, xp in [("a", 1350), ("b", 1150), ("c", 1150), ("d", 320), ("e", 250), ("f", 210)]:
+            self.award(db, user_id, xp)
+        db.store.requests.clear()
+
+        with patch.object(FakeDatabase, "start_at", autospec=True, side_effect=FakeDatabase.start_at) as start_at:
+            assert read_rank(db, "e")["rank"] == 5
+            assert read_rank(db, "c")["rank"] == 2
+
+        assert ("get", "xp_histogram") in db.store.requests
+        # The histogram query starts at the bucket after the user's
+        assert [call.args[1] for call in start_at.call_args_list][::2] == ["3", "12"]
+
+    def test_leaderboard_route_adds_own_rank(self, client):
+        db = FakeFirebase().database()
+        for user_id, xp in [("a", 300), ("b", 200), ("c", 100)]:
+            self.award(db, user_id, xp)
+
+        with patch("src.gamification.routes.db", db):
+            page = json.loads(client.get("/gamification/leaderboard?limit=1&user_id=c").data)
+            rank = json.loads(client.get("/gamification/leaderboard/rank/b").data)
+            bad = client.get("/gamification/leaderboard?cursor=nonsense")
+
+        assert [(entry["user_id"], entry["rank"]) for entry in page["leaderboard"]] == [("a", 1), ("c", 3)]
+        assert page["next_cursor"] == "1:1:300"
+        assert rank["entry"]["rank"] == 2
+        assert bad.status_code == 400
+
+    def test_rebuild_command(self):
+        store = FakeFirebase(
+            {"user_gamification": {"a": {"xp": 250, "achievements": {"x": {"id": "x"}}}, "b": {"xp": 0}}}
+        )
+        app = Flask(__name__)
+        app.register_blueprint(gamification_bp)
+
+        with patch("src.gamification.routes.db", store.database()):
+            result = app.test_cli_runner().invoke(args=["gamification", "rebuild-xp-leaderboard"])
+
+        assert result.exit_code == 0, result.output
+        assert "Rebuilt the XP leaderboard for 2 users" in result.output
+        assert store.read("xp_leaderboard/a") == {
+            "xp": 250,
+            "level": 3,
+            "achievements_count": 1,
+            "user_email": "Unknown",
+        }
+        assert store.read("xp_histogram") == {"0": 1, "2": 1}
@@ -0,0 +1,168 @@
+import sqlite3
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from src.gamification.worker import GamificationQueue, MemoryEventStore, SQLiteEventStore
+from tests.fake_firebase import FakeFirebase
+
+
+def make_db(profiles):
+    """Fake database holding the given user_gamification profiles"""
+    return FakeFirebase({"user_gamification": profiles}).database()
+
+
+class TestEventStores:
+    def test_memory_store_takes_waiting_events_in_order(self):
+        store = MemoryEventStore(shards=2)
+        for quality in range(3):
+            store.put(1, "user1", {"quality": quality})
+
+        items = store.take(1, limit=2, timeout=0)
+
+        assert [item[2]["quality"] for item in items] == [0, 1]
+        assert store.take(0, limit=10, timeout=0) == []
+        assert store.pending() == 1
+
+    def test_sqlite_store_survives_reopen(self, tmp_path):
+        path = str(tmp_path / "events.sqlite3")
+        store = SQLiteEventStore(path, shards=1)
+        store.put(0, "user1", {"quality": 5})
+        store.put(0, "user1", {"quality": 3})
+
+        reopened = SQLiteEventStore(path, shards=1)
+        items = reopened.take(0, limit=10, timeout=0)
+
+        assert [item[2]["quality"] for item in items] == [5, 3]
+        # leased events are not handed out twice until the lease expires
+        assert reopened.take(0, limit=10, timeout=0) == []
+        reopened.ack(items)
+        assert reopened.pending() == 0
+
+    def test_sqlite_store_releases_unacked_events(self, tmp_path):
+        store = SQLiteEventStore(str(tmp_path / "events.sqlite3"), shards=1, lease_seconds=0)
+        store.put(0, "user1", {"quality": 5})
+
+        assert len(store.take(0, limit=10, timeout=0)) == 1
+        time.sleep(0.01)
+        assert len(store.take(0, limit=10, timeout=0)) == 1
+
+    def test_sqlite_store_adds_attempts_to_an_old_file(self, tmp_path):
+        path = str(tmp_path / "events.sqlite3")
+        conn = sqlite3.connect(path)
+        conn.execute(
+            """CREATE TABLE gamification_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_hash INTEGER NOT NULL,
+                user_id TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                leased_until REAL NOT NULL DEFAULT 0
+            )"""
+        )
+        conn.execute("INSERT INTO gamification_events (user_hash, user_id, payload) VALUES (0, 'user1', '{}')")
+        conn.commit()
+        conn.close()
+
+        store = SQLiteEventStore(path, shards=1, retry_delay=0)
+        store.retry(0, store.take(0, limit=10, timeout=0))
+
+        assert len(store.take(0, limit=10, timeout=0)) == 1
+
+
+class TestGamificationQueue:
+    def test_batch_is_coalesced_per_user(self):
+        queue = GamificationQueue(MagicMock, workers=1)
+        store = queue._get_store()
+        for quality in (5, 4, 3):
+            store.put(0, "user1", {"quality": quality})
+        store.put(0, "user2", {"quality": 5})
+        mock_db = make_db({})
+
+        handled = queue.process_batch(0, mock_db)
+
+        assert handled == 4
+        # one read and one write per user, not per event
+        assert [request[0] for request in mock_db.store.requests].count("conditional_set") == 2
+        assert queue.latest("user1")["reviews"] == 3
+        assert queue.latest("user1")["xp_earned"] == (5 + 10) + (5 + 8) + (5 + 5)
+        assert queue.latest("user2")["reviews"] == 1
+
+    def test_failed_durable_batch_is_retried(self, tmp_path):
+        queue = GamificationQueue(MagicMock, workers=1, durable_path=str(tmp_path / "events.sqlite3"), retry_delay=0)
+        queue._get_store().put(0, "user1", {"quality": 5})
+        failing_db = MagicMock()
+        failing_db.child.side_effect = Exception("Firebase unavailable")
+
+        queue.process_batch(0, failing_db)
+
+        assert queue.pending() == 1
+        assert queue.latest("user1") is None
+        time.sleep(0.01)
+        queue.process_batch(0, make_db({}))
+        assert queue.pending() == 0
+        assert queue.latest("user1")["reviews"] == 1
+
+    def test_failed_batch_is_retried_in_memory(self):
+        queue = GamificationQueue(MagicMock, workers=1, retry_delay=0)
+        queue._get_store().put(0, "user1", {"quality": 5})
+        failing_db = MagicMock()
+        failing_db.child.side_effect = Exception("Firebase unavailable")
+
+        queue.process_batch(0, failing_db)
+
+        assert queue.pending() == 1
+        assert queue.latest("user1") is None
+        queue.process_batch(0, make_db({}))
+        assert queue.pending() == 0
+        assert queue.latest("user1")["reviews"] == 1
+
+    def test_failed_retry_waits_for_the_delay(self):
+        queue = GamificationQueue(MagicMock, workers=1, retry_delay=60)
+        queue._get_store().put(0, "user1", {"quality": 5})
+        failing_db = MagicMock()
+        failing_db.child.side_effect = Exception("Firebase unavailable")
+
+        queue.process_batch(0, failing_db)
+
+        assert queue.process_batch(0, make_db({})) == 0
+        assert queue.pending() == 1
+
+    @pytest.mark.parametrize("durable", [False, True])
+    def test_event_is_dropped_after_max_attempts(self, durable, tmp_path):
+        queue = GamificationQueue(
+            MagicMock,
+            workers=1,
+            durable_path=str(tmp_path / "events.sqlite3") if durable else None,
+            max_attempts=3,
+            retry_delay=0,
+        )
+        queue._get_store().put(0, "user1", {"quality": 5})
+        failing_db = MagicMock()
+        failing_db.child.side_effect = Exception("Firebase unavailable")
+
+        assert [queue.process_batch(0, failing_db) for _ in range(4)] == [1, 1, 1, 0]
+        assert queue.pending() == 0
+
+    def test_workers_drain_submitted_events(self):
+        mock_db = make_db({})
+        queue = GamificationQueue(lambda: mock_db, workers=2, poll_interval=0.05)
+
+        queue.submit("user1", {"quality": 5})
+        queue.submit("user2", {"quality": 4})
+        deadline = time.time() + 5
+        while (queue.latest("user1") is None or queue.latest("user2") is None) and time.time() < deadline:
+            time.sleep(0.01)
+        queue.stop()
+
+        assert queue.latest("user1")["xp_earned"] == 15
+        assert queue.latest("user2")["xp_earned"] == 13
+
+    def test_submit_many_keeps_order(self, tmp_path):
+        queue = GamificationQueue(MagicMock, workers=1, durable_path=str(tmp_path / "events.sqlite3"))
+        queue._get_store().put_many(0, "user1", [{"quality": 5}, {"quality": 0}])
+
+        queue.process_batch(0, make_db({}))
+
+        assert queue.latest("user1")["reviews"] == 2
+        assert queue.latest("user1")["xp_earned"] == (5 + 10) + 5
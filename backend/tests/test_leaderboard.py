@@ -0,0 +1,160 @@
+import json
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+from flask import Flask
+
+from src.common.snapshot import Snapshot
+from src.deck.leaderboard import read_user_scores, read_user_totals, save_score, top_totals
+from src.leaderboard import routes
+from tests.fake_firebase import FakeFirebase
+
+
+@pytest.fixture
+def store():
+    store = FakeFirebase()
+    db = store.database()
+    save_score(db, "deck1", "user1", {"userEmail": "a@example.com", "correct": 5, "incorrect": 1})
+    save_score(db, "deck2", "user1", {"userEmail": "a@example.com", "correct": 4, "incorrect": 0})
+    save_score(db, "deck1", "user2", {"userEmail": "b@example.com", "correct": 7, "incorrect": 3})
+    save_score(db, "deck1", "user3", {"userEmail": "c@example.com", "correct": 1, "incorrect": 8})
+    return store
+
+
+@pytest.fixture
+def client(store):
+    app = Flask(__name__)
+    app.register_blueprint(routes.leaderboard_bp)
+    with (
+        patch.object(routes, "db", store.database()),
+        patch.object(routes, "global_top", Snapshot(lambda: top_totals(store.database(), 3), 60)),
+    ):
+        yield app.test_client()
+
+
+def test_totals_are_maintained_on_save(store):
+    save_score(store.database(), "deck1", "user1", {"userEmail": "a@example.com", "correct": 2, "incorrect": 2})
+
+    assert store.read("leaderboard_totals/user1") == {
+        "userEmail": "a@example.com",
+        "total_correct": 6,
+        "total_incorrect": 2,
+    }
+
+
+def test_user_index_is_maintained_on_save(store):
+    save_score(store.database(), "deck1", "user1", {"userEmail": "a@example.com", "correct": 2, "incorrect": 2})
+
+    scores = store.read("user_leaderboard/user1")
+    assert scores["_totals"] == {"correct": 6, "incorrect": 2, "decks": 2}
+    assert scores["deck1"] == {"correct": 2, "incorrect": 2}
+    assert read_user_scores(store.database(), "user1").keys() == {"deck1", "deck2"}
+    assert read_user_totals(store.database(), "nobody") == {"correct": 0, "incorrect": 0, "decks": 0}
+
+
+def test_top_totals_reads_only_the_top(store):
+    store.requests.clear()
+
+    top = top_totals(store.database(), 2)
+
+    assert [entry["userEmail"] for entry in top] == ["a@example.com", "b@example.com"]
+    assert store.requests == [("get", "leaderboard_totals")]
+
+
+def test_global_leaderboard_pages(client, store):
+    first = json.loads(client.get("/leaderboard/global?limit=2").data)
+    second = json.loads(client.get(f"/leaderboard/global?limit=2&offset={first['next_offset']}").data)
+
+    assert [(entry["rank"], entry["total_correct"]) for entry in first["leaderboard"]] == [(1, 9), (2, 7)]
+    assert [(entry["rank"], entry["userEmail"]) for entry in second["leaderboard"]] == [(3, "c@example.com")]
+    assert second["next_offset"] is None
+    # Both pages come from one snapshot
+    assert store.requests.count(("get", "leaderboard_totals")) == 1
+
+
+def test_concurrent_cold_reads_share_one_query(client, store):
+    store.latency = 0.05
+    store.requests.clear()
+    statuses = []
+    threads = [
+        threading.Thread(target=lambda: statuses.append(client.get("/leaderboard/global").status_code))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses == [200] * 8
+    assert store.requests == [("get", "leaderboard_totals")]
+
+
+def test_global_snapshot_loads_with_its_own_handle(store):
+    # The snapshot is refreshed off the request thread, so it must not use the shared handle
+    shared, handles = store.database(), []
+
+    def database():
+        handles.append(store.database())
+        return handles[-1]
+
+    app = Flask(__name__)
+    app.register_blueprint(routes.leaderboard_bp)
+    routes.global_top.invalidate()
+    try:
+        with patch.object(routes.firebase, "database", database), patch.object(routes, "db", shared):
+            response = json.loads(app.test_client().get("/leaderboard/global").data)
+    finally:
+        routes.global_top.invalidate()
+
+    assert [entry["total_correct"] for entry in response["leaderboard"]] == [9, 7, 1]
+    assert len(handles) == 1 and handles[0] is not shared
+
+
+def test_global_leaderboard_rejects_bad_pages(client):
+    assert client.get("/leaderboard/global?limit=0").status_code == 400
+    assert client.get(f"/leaderboard/global?limit={routes.GLOBAL_LEADERBOARD_SIZE + 1}").status_code == 400
+    assert client.get("/leaderboard/global?offset=-1").status_code == 400
+
+
+def test_snapshot_refreshes_in_background():
+    loads = []
+    release = threading.Event()
+
+    def load():
+        loads.append(None)
+        if len(loads) > 1:
+            release.wait(5)
+        return len(loads)
+
+    snapshot = Snapshot(load, max_age=0)
+    assert snapshot.get() == 1
+
+    # A stale snapshot is served while a single refresh runs
+    assert snapshot.get() == 1
+    assert snapshot.get() == 1
+    time.sleep(0.05)
+    assert len(loads) == 2
+    release.set()
+    for _ in range(100):
+        if snapshot.get() > 1:
+            break
+        time.sleep(0.01)
+    assert snapshot.get() > 1
+
+
+def test_snapshot_keeps_value_when_refresh_fails():
+    results = iter([["top"], RuntimeError("offline")])
+
+    def load():
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    snapshot = Snapshot(load, max_age=0)
+    assert snapshot.get() == ["top"]
+    assert snapshot.get() == ["top"]
+    time.sleep(0.05)
+    assert snapshot.get() == ["top"]
@@ -0,0 +1,135 @@
+import json
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from flask import Flask
+
+from src.common.leaderboard_windows import (
+    CORRECT_BOARD,
+    XP_BOARD,
+    counter_updates,
+    deck_board,
+    expire_periods,
+    period_key,
+    read_top,
+    top_snapshots,
+)
+from src.deck.leaderboard import save_score
+from src.deck.routes import deck_bp
+from src.gamification.routes import gamification_bp
+from src.gamification.service import update_profile
+from src.leaderboard import routes as leaderboard_routes
+from tests.fake_firebase import FakeFirebase
+
+NOW = datetime(2026, 1, 2, 12, tzinfo=timezone.utc)
+
+
+def test_period_keys():
+    assert period_key("daily", NOW) == "2026-01-02"
+    # 2 January 2026 is in the first ISO week of 2026
+    assert period_key("weekly", NOW) == "2026-W01"
+    assert period_key("weekly", datetime(2027, 1, 1, tzinfo=timezone.utc)) == "2026-W53"
+    assert period_key("monthly", NOW) == "2026-01"
+
+
+def test_counters_rank_the_current_period():
+    db = FakeFirebase().database()
+    db.update(counter_updates(XP_BOARD, "a", 30, NOW, "a@example.com"))
+    db.update(counter_updates(XP_BOARD, "b", 50, NOW))
+    db.update(counter_updates(XP_BOARD, "a", 40, NOW))
+    db.update(counter_updates(XP_BOARD, "c", 99, datetime(2025, 12, 1, tzinfo=timezone.utc)))
+
+    top = read_top(db, XP_BOARD, "monthly", 10, NOW)
+
+    assert [(entry["user_id"], entry["score"], entry["rank"]) for entry in top] == [("a", 70, 1), ("b", 50, 2)]
+    assert top[0]["name"] == "a@example.com"
+    assert [entry["user_id"] for entry in read_top(db, XP_BOARD, "weekly", 1, NOW)] == ["a"]
+
+
+def test_expire_periods():
+    store = FakeFirebase()
+    db = store.database()
+    for day in range(1, 32):
+        db.update(counter_updates(CORRECT_BOARD, "a", 1, datetime(2025, 12, day, tzinfo=timezone.utc)))
+    db.update(counter_updates(CORRECT_BOARD, "a", 1, NOW))
+
+    assert expire_periods(db, CORRECT_BOARD, NOW) == 19
+    daily = sorted(store.read(f"{CORRECT_BOARD}/daily"))
+    assert daily[0] == "2025-12-20" and daily[-1] == "2026-01-02" and len(daily) == 13
+    assert sorted(store.read(f"{CORRECT_BOARD}/monthly")) == ["2025-12", "2026-01"]
+    assert expire_periods(db, CORRECT_BOARD, NOW) == 0
+
+
+def test_scores_and_xp_feed_the_windows():
+    store = FakeFirebase()
+    db = store.database()
+    today = period_key("daily", datetime.now(timezone.utc))
+
+    save_score(db, "deck1", "a", {"userEmail": "a@example.com", "correct": 4, "incorrect": 1})
+    save_score(db, "deck1", "a", {"userEmail": "a@example.com", "correct": 6, "incorrect": 0})
+    store.data["users"] = {"a": {"email": "a@example.com"}}
+    update_profile(db, "a", lambda profile: profile.update(xp=profile["xp"] + 25))
+    store.requests.clear()
+    update_profile(db, "a", lambda profile: profile.update(xp=profile["xp"] + 5))
+
+    assert store.read(f"{deck_board('deck1')}/daily/{today}/a") == {"score": 10, "name": "a@example.com"}
+    assert store.read(f"{CORRECT_BOARD}/daily/{today}/a/score") == 10
+    # The XP counters are named from the email kept on the profile, which is only looked up once
+    assert store.read(f"{XP_BOARD}/daily/{today}/a") == {"score": 30, "name": "a@example.com"}
+    assert ("get", "users/a") not in store.requests
+
+
+def test_windowed_routes():
+    store = FakeFirebase()
+    db = store.database()
+    save_score(db, "deck1", "a", {"userEmail": "a@example.com", "correct": 3, "incorrect": 1})
+    save_score(db, "deck1", "b", {"userEmail": "b@example.com", "correct": 8, "incorrect": 1})
+    store.data["users"] = {"a": {"email": "a@example.com"}}
+    update_profile(db, "a", lambda profile: profile.update(xp=40))
+    store.requests.clear()
+    app = Flask(__name__)
+    for blueprint in (deck_bp, gamification_bp, leaderboard_routes.leaderboard_bp):
+        app.register_blueprint(blueprint)
+    client = app.test_client()
+
+    with (
+        patch("src.deck.routes.db", db),
+        patch("src.deck.routes.window_top", top_snapshots(store.database)),
+        patch("src.gamification.routes.db", db),
+        patch("src.gamification.routes.window_top", top_snapshots(store.database)),
+        patch.object(leaderboard_routes, "db", db),
+        patch.object(leaderboard_routes, "window_top", top_snapshots(store.database)),
+    ):
+        deck = json.loads(client.get("/deck/deck1/leaderboard?window=weekly").data)
+        overall = json.loads(client.get("/leaderboard/global?window=daily").data)
+        xp = json.loads(client.get("/gamification/leaderboard?window=monthly").data)
+        bad = client.get("/deck/deck1/leaderboard?window=yearly")
+
+    assert [(entry["userEmail"], entry["correct"]) for entry in deck["leaderboard"]] == [
+        ("b@example.com", 8),
+        ("a@example.com", 3),
+    ]
+    assert [(entry["rank"], entry["total_correct"]) for entry in overall["leaderboard"]] == [(1, 8), (2, 3)]
+    assert [(entry["user_id"], entry["xp"], entry["user_email"]) for entry in xp["leaderboard"]] == [
+        ("a", 40, "a@example.com")
+    ]
+    # Names come from the counters, not a read per ranked user
+    assert not [path for _, path in store.requests if path.startswith("xp_leaderboard")]
+    assert bad.status_code == 400
+
+
+def test_expire_windows_command():
+    store = FakeFirebase()
+    db = store.database()
+    old = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    db.update(counter_updates(deck_board("deck1"), "a", 1, old))
+    db.update(counter_updates(XP_BOARD, "a", 1, old))
+    app = Flask(__name__)
+    app.register_blueprint(leaderboard_routes.leaderboard_bp)
+
+    with patch.object(leaderboard_routes, "db", db):
+        result = app.test_cli_runner().invoke(args=["leaderboard", "expire-windows"])
+
+    assert result.exit_code == 0, result.output
+    assert "Deleted 6 expired periods from 3 leaderboards" in result.output
+    assert store.read("deck_leaderboard_windows") is None
@@ -0,0 +1,521 @@
+import json
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+from flask import Flask
+
+from src.cards import routes as card_routes
+from src.common.response_cache import ResponseCache, SQLiteCacheBackend, _from_env
+from src.common.single_flight import SingleFlight
+from src.deck import routes as deck_routes
+from src.folders import routes as folder_routes
+from tests.fake_firebase import FakeFirebase
+
+
+class Loader:
+    def __init__(self, value="value"):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self, db):
+        self.calls += 1
+        return self.value
+
+
+def test_hit_after_miss():
+    cache = ResponseCache(ttl=60, max_entries=10)
+    load = Loader()
+
+    assert cache.get("deck:d1", load, None) == "value"
+    assert cache.get("deck:d1", load, None) == "value"
+
+    assert load.calls == 1
+    metrics = cache.metrics()
+    assert (metrics["hits"], metrics["misses"], metrics["hit_rate"]) == (1, 1, 0.5)
+    assert metrics["by_kind"] == {"deck": {"misses": 1, "hits": 1}}
+
+
+def test_entries_expire_after_ttl():
+    cache = ResponseCache(ttl=60, max_entries=10)
+    load = Loader()
+    with patch("src.common.response_cache.time.monotonic", return_value=1000):
+        cache.get("deck:d1", load, None)
+    with patch("src.common.response_cache.time.monotonic", return_value=1061):
+        cache.get("deck:d1", load, None)
+
+    assert load.calls == 2
+
+
+def test_least_recently_used_is_dropped():
+    cache = ResponseCache(ttl=60, max_entries=2)
+    loads = {key: Loader(key) for key in ("deck:a", "deck:b", "deck:c")}
+    cache.get("deck:a", loads["deck:a"], None)
+    cache.get("deck:b", loads["deck:b"], None)
+    cache.get("deck:a", loads["deck:a"], None)
+    cache.get("deck:c", loads["deck:c"], None)
+
+    cache.get("deck:a", loads["deck:a"], None)
+    cache.get("deck:b", loads["deck:b"], None)
+
+    assert {key: load.calls for key, load in loads.items()} == {"deck:a": 1, "deck:b": 2, "deck:c": 1}
+    assert cache.metrics()["entries"] == 2
+
+
+def test_invalidate_reloads():
+    cache = ResponseCache(ttl=60, max_entries=10)
+    load = Loader()
+    cache.get("deck:d1", load, None)
+
+    cache.invalidate("deck:d1", "decks:public")
+    cache.get("deck:d1", load, None)
+
+    assert load.calls == 2
+    assert cache.metrics()["invalidations"] == 2
+
+
+def test_load_racing_an_invalidation_is_not_kept():
+    cache = ResponseCache(ttl=60, max_entries=10)
+
+    def load(db):
+        # A write lands while the old value is being read
+        cache.invalidate("deck:d1")
+        return "old"
+
+    assert cache.get("deck:d1", load, None) == "old"
+    assert cache.get("deck:d1", Loader("new"), None) == "new"
+
+
+def test_zero_ttl_turns_the_cache_off():
+    cache = ResponseCache(ttl=0, max_entries=10)
+    load = Loader()
+    cache.get("deck:d1", load, None)
+    cache.get("deck:d1", load, None)
+
+    assert load.calls == 2
+
+
+@pytest.fixture
+def default_cache(monkeypatch):
+    """A cache configured the way a deployment without RESPONSE_CACHE_DB gets it"""
+    for name in ("RESPONSE_CACHE_DB", "RESPONSE_CACHE_TTL", "RESPONSE_CACHE_STALE", "RESPONSE_CACHE_SIZE"):
+        monkeypatch.delenv(name, raising=False)
+    return _from_env()
+
+
+def test_values_are_kept_briefly_and_never_stale_without_a_shared_store(default_cache):
+    cache = default_cache
+    load = Loader()
+    with patch("src.common.response_cache.time.monotonic", return_value=1000):
+        cache.get("deck:d1", load, None)
+    with patch("src.common.response_cache.time.monotonic", return_value=1001):
+        cache.get("deck:d1", load, None)
+
+    assert load.calls == 2
+    assert cache.metrics()["refreshes"] == 0
+
+
+def test_shared_store_keeps_values_longer(monkeypatch, tmp_path):
+    monkeypatch.setenv("RESPONSE_CACHE_DB", str(tmp_path / "cache.db"))
+    monkeypatch.delenv("RESPONSE_CACHE_TTL", raising=False)
+    monkeypatch.delenv("RESPONSE_CACHE_STALE", raising=False)
+    cache = _from_env()
+
+    assert (cache._ttl, cache._local_ttl, cache._stale) == (60, 1, 30)
+
+
+def test_shared_backend_serves_other_processes(tmp_path):
+    path = str(tmp_path / "cache.db")
+    first = ResponseCache(ttl=60, max_entries=10, backend=SQLiteCacheBackend(path), local_ttl=1)
+    second = ResponseCache(ttl=60, max_entries=10, backend=SQLiteCacheBackend(path), local_ttl=1)
+    load = Loader({"title": "Deck"})
+
+    first.get("deck:d1", load, None)
+    assert second.get("deck:d1", load, None) == {"title": "Deck"}
+    assert load.calls == 1
+    assert second.metrics()["shared_hits"] == 1
+
+    first.invalidate("deck:d1")
+    with patch("src.common.response_cache.time.monotonic", return_value=float("inf")):
+        second.get("deck:d1", load, None)
+    assert load.calls == 2
+
+
+def test_load_racing_another_process_invalidation_is_not_shared(tmp_path):
+    path = str(tmp_path / "cache.db")
+    first = ResponseCache(ttl=60, max_entries=10, backend=SQLiteCacheBackend(path), local_ttl=1)
+    second = ResponseCache(ttl=60, max_entries=10, backend=SQLiteCacheBackend(path), local_ttl=1)
+    loading, release = threading.Event(), threading.Event()
+
+    def old_load(db):
+        loading.set()
+        release.wait(5)
+        return "old"
+
+    reader = threading.Thread(target=lambda: first.get("deck:d1", old_load, None))
+    reader.start()
+    loading.wait(5)
+    # Another process writes the deck while the first is still loading the value from before the write
+    second.invalidate("deck:d1")
+    release.set()
+    reader.join()
+
+    assert second.get("deck:d1", Loader("new"), None) == "new"
+    # The value loaded after the write is the one the other processes share
+    third = ResponseCache(ttl=60, max_entries=10, backend=SQLiteCacheBackend(path))
+    assert third.get("deck:d1", Loader("newer"), None) == "new"
+
+
+def test_concurrent_readers_get_the_same_value():
+    cache = ResponseCache(ttl=60, max_entries=10)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("deck:d1", Loader(), None))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["value"] * 8
+
+
+def run_concurrently(target, count=8):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_single_flight_shares_one_call():
+    flights = SingleFlight()
+    release = threading.Event()
+    calls, results = [], []
+
+    def fetch():
+        calls.append(None)
+        release.wait(5)
+        return "value"
+
+    threads = [threading.Thread(target=lambda: results.append(flights.do("key", fetch))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert sorted(results, key=lambda result: result[1]) == [("value", False)] * 4 + [("value", True)]
+    # Once the call is over the next one fetches again
+    assert flights.do("key", fetch) == ("value", True)
+
+
+def test_single_flight_shares_errors():
+    flights = SingleFlight()
+    release = threading.Event()
+    errors = []
+
+    def fetch():
+        release.wait(5)
+        raise RuntimeError("offline")
+
+    def call():
+        try:
+            flights.do("key", fetch)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert errors == ["offline"] * 3
+
+
+def test_concurrent_misses_share_one_load():
+    cache = ResponseCache(ttl=60, max_entries=10)
+    loads = []
+
+    def load(db):
+        loads.append(None)
+        time.sleep(0.05)
+        return "value"
+
+    run_concurrently(lambda: cache.get("decks:public", load, None))
+
+    assert len(loads) == 1
+    metrics = cache.metrics()
+    assert (metrics["misses"], metrics["coalesced"] + metrics["hits"]) == (1, 7)
+
+
+def test_hot_key_loads_once_per_expiry_by_default(default_cache):
+    """Without a stale window an expired hot key is still loaded by one of its concurrent readers"""
+    loads = []
+
+    def load(db):
+        loads.append(None)
+        time.sleep(0.05)
+        return "value"
+
+    for now in (1000, 1001, 1002):
+        with patch("src.common.response_cache.time.monotonic", return_value=now):
+            run_concurrently(lambda: default_cache.get("decks:public", load, None), count=16)
+
+    assert len(loads) == 3
+    metrics = default_cache.metrics()
+    assert (metrics["misses"], metrics["coalesced"] + metrics["hits"], metrics["refreshes"]) == (3, 45, 0)
+
+
+def wait_for(condition):
+    for _ in range(100):
+        if condition():
+            return
+        time.sleep(0.01)
+    raise AssertionError("condition not met")
+
+
+def test_stale_value_is_served_while_refreshing():
+    cache = ResponseCache(ttl=60, max_entries=10, stale=30, db_factory=lambda: "refresh handle")
+    values = iter(["old", "new"])
+    handles = []
+    release = threading.Event()
+
+    def load(db):
+        handles.append(db)
+        value = next(values)
+        if value == "new":
+            release.wait(5)
+        return value
+
+    with patch("src.common.response_cache.time.monotonic", return_value=1000):
+        assert cache.get("decks:public", load, "request handle") == "old"
+    with patch("src.common.response_cache.time.monotonic", return_value=1070):
+        # Past the TTL but within the stale window: served at once, refreshed by one thread
+        assert cache.get("decks:public", load, "request handle") == "old"
+        assert cache.get("decks:public", load, "request handle") == "old"
+        release.set()
+        wait_for(lambda: cache.metrics()["refreshes"] == 1)
+        wait_for(lambda: cache.get("decks:public", load, "request handle") == "new")
+    assert cache.metrics()["misses"] == 1
+    # The refresh never reads with a handle a request thread is using
+    assert handles == ["request handle", "refresh handle"]
+
+
+def test_values_past_the_stale_window_are_loaded():
+    cache = ResponseCache(ttl=60, max_entries=10, stale=30, db_factory=lambda: None)
+    load = Loader()
+    with patch("src.common.response_cache.time.monotonic", return_value=1000):
+        cache.get("decks:public", load, None)
+    with patch("src.common.response_cache.time.monotonic", return_value=1091):
+        cache.get("decks:public", load, None)
+
+    assert (load.calls, cache.metrics()["misses"]) == (2, 2)
+
+
+def test_no_stale_values_without_a_handle_for_the_refresh():
+    cache = ResponseCache(ttl=60, max_entries=10, stale=30)
+    load = Loader()
+    with patch("src.common.response_cache.time.monotonic", return_value=1000):
+        cache.get("decks:public", load, None)
+    with patch("src.common.response_cache.time.monotonic", return_value=1070):
+        cache.get("decks:public", load, None)
+
+    assert (load.calls, cache.metrics()["refreshes"]) == (2, 0)
+
+
+def test_invalidated_value_is_never_served_stale():
+    cache = ResponseCache(ttl=60, max_entries=10, stale=30, db_factory=lambda: None)
+    cache.get("decks:public", Loader("old"), None)
+
+    cache.invalidate("decks:public")
+
+    assert cache.get("decks:public", Loader("new"), None) == "new"
+
+
+def test_read_after_invalidation_does_not_share_an_older_load():
+    cache = ResponseCache(ttl=60, max_entries=10)
+    started, release = threading.Event(), threading.Event()
+    results = []
+
+    def old_load(db):
+        started.set()
+        release.wait(5)
+        return "old"
+
+    reader = threading.Thread(target=lambda: results.append(cache.get("decks:public", old_load, None)))
+    reader.start()
+    started.wait(5)
+    cache.invalidate("decks:public")
+
+    assert cache.get("decks:public", Loader("new"), None) == "new"
+    release.set()
+    reader.join()
+    assert results == ["old"]
+    assert cache.get("decks:public", Loader("newer"), None) == "new"
+
+
+@pytest.fixture
+def store():
+    return FakeFirebase(
+        {
+            "deck": {"d1": {"userId": "u1", "title": "Deck", "visibility": "public", "cards_count": 0}},
+            "folder": {"f1": {"userId": "u1", "name": "Folder"}},
+        }
+    )
+
+
+@pytest.fixture
+def client(store):
+    app = Flask(__name__)
+    for blueprint in (deck_routes.deck_bp, card_routes.card_bp, folder_routes.folder_bp):
+        app.register_blueprint(blueprint)
+    db = store.database()
+    cache = ResponseCache(ttl=60, max_entries=1024)
+    with (
+        patch.object(deck_routes, "db", db),
+        patch.object(card_routes, "db", db),
+        patch.object(folder_routes, "db", db),
+        patch.object(deck_routes, "response_cache", cache),
+        patch.object(card_routes, "response_cache", cache),
+        patch.object(folder_routes, "response_cache", cache),
+    ):
+        yield app.test_client()
+
+
+def reads(store, path):
+    return sum(1 for method, request_path in store.requests if (method, request_path) == ("get", path))
+
+
+def test_deck_reads_are_cached_until_an_update(client, store):
+    for _ in range(3):
+        assert json.loads(client.get("/deck/d1").data)["deck"]["title"] == "Deck"
+        client.get("/deck/all?localId=u1")
+    assert reads(store, "deck/d1") == 1
+    assert reads(store, "deck") == 1
+
+    client.patch(
+        "/deck/update/d1",
+        data=json.dumps({"localId": "u1", "title": "Renamed", "description": "", "visibility": "public"}),
+        content_type="application/json",
+    )
+
+    assert json.loads(client.get("/deck/d1").data)["deck"]["title"] == "Renamed"
+    assert [deck["title"] for deck in json.loads(client.get("/deck/all?localId=u1").data)["decks"]] == ["Renamed"]
+    assert [deck["title"] for deck in json.loads(client.get("/deck/all").data)["decks"]] == ["Renamed"]
+
+
+def test_opening_a_deck_invalidates_the_openers_list_without_reading_the_deck(client, store):
+    client.get("/deck/all?localId=u1")
+
+    client.patch("/deck/updateLastOpened/d1", data=json.dumps({"localId": "u1"}), content_type="application/json")
+
+    assert reads(store, "deck/d1/userId") == 0
+    assert json.loads(client.get("/deck/all?localId=u1").data)["decks"][0]["lastOpened"]
+
+
+def test_create_and_delete_invalidate_deck_lists(client):
+    assert len(json.loads(client.get("/deck/all?localId=u1").data)["decks"]) == 1
+
+    client.post(
+        "/deck/create",
+        data=json.dumps({"localId": "u1", "title": "New", "description": "", "visibility": "private"}),
+        content_type="application/json",
+    )
+    assert len(json.loads(client.get("/deck/all?localId=u1").data)["decks"]) == 2
+
+    client.delete("/deck/delete/d1")
+    assert [deck["title"] for deck in json.loads(client.get("/deck/all?localId=u1").data)["decks"]] == ["New"]
+    assert json.loads(client.get("/deck/all").data)["decks"] == []
+
+
+def test_card_writes_invalidate_cards_and_counts(client, store):
+    assert json.loads(client.get("/deck/d1/card/all").data)["cards"] == []
+    client.get("/deck/d1/card/all")
+    assert reads(store, "card") == 1
+
+    client.post(
+        "/deck/d1/card/create",
+        data=json.dumps({"localId": "u1", "cards": [{"front": "f", "back": "b", "hint": "h"}]}),
+        content_type="application/json",
+    )
+
+    assert [card["front"] for card in json.loads(client.get("/deck/d1/card/all").data)["cards"]] == ["f"]
+    assert json.loads(client.get("/deck/d1").data)["deck"]["cards_count"] == 1
+
+
+def folders(client):
+    return json.loads(client.get("/folders/all?userId=u1").data)["folders"]
+
+
+def test_folder_mutations_invalidate_folder_list(client):
+    assert [folder["name"] for folder in folders(client)] == ["Folder"]
+
+    client.patch("/folder/update/f1", data=json.dumps({"name": "Renamed"}), content_type="application/json")
+    assert [folder["name"] for folder in folders(client)] == ["Renamed"]
+
+    client.post("/deck/add-deck", data=json.dumps({"folderId": "f1", "deckId": "d1"}), content_type="application/json")
+    assert folders(client)[0]["decks_count"] == 1
+
+
+def test_concurrent_public_deck_and_card_reads_share_one_query(client, store):
+    store.latency = 0.05
+
+    run_concurrently(lambda: client.get("/deck/all"))
+    run_concurrently(lambda: client.get("/deck/d1/card/all"))
+
+    assert (reads(store, "deck"), reads(store, "card")) == (1, 1)
+
+
+def test_refresh_during_route_traffic_reads_with_its_own_handle(store):
+    shared, handles = store.database(), []
+
+    def database():
+        handles.append(store.database())
+        return handles[-1]
+
+    cache = ResponseCache(ttl=60, max_entries=10, stale=30, db_factory=database)
+    app = Flask(__name__)
+    for blueprint in (deck_routes.deck_bp, card_routes.card_bp):
+        app.register_blueprint(blueprint)
+    client = app.test_client()
+    statuses = []
+
+    def traffic():
+        for path in ("/deck/all", "/deck/d1", "/deck/d1/card/all", "/deck/all?localId=u1"):
+            statuses.append(client.get(path).status_code)
+
+    with (
+        patch.object(deck_routes, "db", shared),
+        patch.object(card_routes, "db", shared),
+        patch.object(deck_routes, "response_cache", cache),
+        patch.object(card_routes, "response_cache", cache),
+    ):
+        with patch("src.common.response_cache.time.monotonic", return_value=1000):
+            traffic()
+        # A change made outside the endpoints, seen once the stale values are refreshed
+        store.data["deck"]["d1"]["title"] = "Renamed"
+        store.latency = 0.02
+        with patch("src.common.response_cache.time.monotonic", return_value=1070):
+            run_concurrently(traffic)
+            wait_for(lambda: json.loads(client.get("/deck/all").data)["decks"][0]["title"] == "Renamed")
+            wait_for(lambda: json.loads(client.get("/deck/d1").data)["deck"]["title"] == "Renamed")
+
+    assert statuses == [200] * 36
+    # One new handle per refreshed key, none of them the handle the requests share
+    wait_for(lambda: len(handles) == 4)
+    assert cache.metrics()["refreshes"] == 4
+    assert all(handle is not shared for handle in handles)
+
+
+def test_metrics_route(client):
+    client.get("/deck/d1")
+    client.get("/deck/d1")
+
+    metrics = json.loads(client.get("/cache/metrics").data)["metrics"]
+
+    assert (metrics["hits"], metrics["misses"]) == (1, 1)
@@ -0,0 +1,189 @@
+from src.deck.review_log import (
+    CHUNK_REVIEWS,
+    COMPACT_AFTER,
+    RECORD,
+    append_updates,
+    card_counts,
+    card_histories,
+    compact_log,
+    compact_recent,
+    count_updates,
+    pack,
+    read_counts,
+    read_log,
+    rebuild_counts,
+    unpack,
+)
+from tests.fake_firebase import FakeFirebase
+
+
+class TestReviewLog:
+    def setup_method(self):
+        self.store = FakeFirebase()
+        self.db = self.store.database()
+
+    def test_records_are_13_bytes(self):
+        records = [(0, 1_900_000_000, 5, 1200), (4_000_000_000, 1_900_000_060, 0, 2**32 - 1)]
+
+        chunk = pack(records)
+
+        assert RECORD.itemsize == 13
+        assert len(chunk) == len(records) * 13 * 4 // 3 + 2
+        assert unpack(chunk).tolist() == records
+
+    def test_append_is_one_write_with_its_own_cards(self):
+        updates = append_updates(self.db, "user1", [("b", 100, 5, 900), ("a", 100, 2, 0), ("b", 110, 4, 0)])
+
+        ((path, chunk),) = [(path, value) for path, value in updates.items() if "/chunks/" in path]
+        assert path.startswith("user_review_log/user1/chunks/")
+        assert updates["user_review_log/user1/open_chunks"] == {".sv": {"increment": 1}}
+        assert chunk["cards"] == ["b", "a"]
+        assert unpack(chunk["records"])["card"].tolist() == [0, 1, 0]
+        assert self.store.requests == []
+
+    def test_append_and_read(self):
+        self.db.update(append_updates(self.db, "user1", [("a", 100, 5, 900), ("b", 100, 2, 0)]))
+        self.db.update(append_updates(self.db, "user1", [("b", 150, 1, 0), ("a", 200, 3, 400)]))
+        assert append_updates(self.db, "user1", []) == {}
+
+        cards, records = read_log(self.db, "user1")
+
+        assert cards == {0: "a", 1: "b"}
+        assert records["card"].tolist() == [0, 1, 1, 0]
+        assert records["epoch"].tolist() == [100, 100, 150, 200]
+        assert card_counts(cards, records, {"a"}) == {"a": (2, 2)}
+        assert card_histories(cards, records) == {"a": [(100, 5), (200, 3)], "b": [(100, 2), (150, 1)]}
+
+    def test_read_legacy_chunks(self):
+        # Chunks written before they carried their cards index the log's shared mapping,
+        # which Firebase returns as an array when its keys are dense integers
+        self.store.data = {"user_review_log": {"user1": {"cards": [None, "b"], "chunks": {"-k": pack([(1, 5, 4, 0)])}}}}
+        self.db.update(append_updates(self.db, "user1", [("c", 6, 1, 0), ("b", 7, 3, 0)]))
+
+        cards, records = read_log(self.db, "user1")
+
+        assert card_counts(cards, records, {"b", "c"}) == {"b": (2, 2), "c": (1, 0)}
+        assert card_histories(cards, records) == {"b": [(5, 4), (7, 3)], "c": [(6, 1)]}
+
+    def test_read_empty_log(self):
+        cards, records = read_log(self.db, "nobody")
+
+        assert cards == {} and len(records) == 0
+        assert card_counts(cards, records, {"a"}) == {}
+
+    def test_counts_are_server_increments_per_deck(self):
+        updates = count_updates("user1", [("d1", "a", 5), ("d1", "a", 1), ("d2", "b", 2)])
+
+        assert updates == {
+            "user_review_counts/user1/d1/a/reviews": {".sv": {"increment": 2}},
+            "user_review_counts/user1/d1/a/correct": {".sv": {"increment": 1}},
+            "user_review_counts/user1/d2/b/reviews": {".sv": {"increment": 1}},
+        }
+        self.db.update(updates)
+        self.db.update(count_updates("user1", [("d1", "a", 4)]))
+        self.store.requests.clear()
+
+        assert read_counts(self.db, "user1", "d1") == {"a": (3, 2)}
+        assert read_counts(self.db, "user1", "d2") == {"b": (1, 0)}
+        assert self.store.requests == [("get", "user_review_counts/user1/d1"), ("get", "user_review_counts/user1/d2")]
+
+    def test_rebuild_counts(self):
+        self.store.data = {"user_review_log": {"user1": {"cards": {"0": "a"}, "chunks": {"-k": pack([(0, 5, 4, 0)])}}}}
+        self.db.update(append_updates(self.db, "user1", [("a", 6, 1, 0), ("b", 7, 3, 0), ("gone", 8, 3, 0)]))
+
+        assert rebuild_counts(self.db, "user1", {"a": "d1", "b": "d2"}) == 2
+
+        assert read_counts(self.db, "user1", "d1") == {"a": (2, 1)}
+        assert read_counts(self.db, "user1", "d2") == {"b": (1, 1)}
+
+    def test_compact_log(self):
+        for epoch in range(CHUNK_REVIEWS + 10):
+            self.db.update(append_updates(self.db, "user1", [(f"card{epoch % 3}", epoch, 4, 0)]))
+        keys = sorted(self.store.read("user_review_log/user1/chunks"))
+
+        before, after = compact_log(self.db, "user1")
+
+        chunks = self.store.read("user_review_log/user1/chunks")
+        assert (before, after) == (CHUNK_REVIEWS + 10, 2)
+        assert sorted(chunks) == [keys[0], keys[CHUNK_REVIEWS]]
+        cards, records = read_log(self.db, "user1")
+        assert records["epoch"].tolist() == list(range(CHUNK_REVIEWS + 10))
+        assert [cards[card] for card in records["card"][:4].tolist()] == ["card0", "card1", "card2", "card0"]
+        assert compact_log(self.db, "user1") == (2, 2)
+        assert self.store.read("user_review_log/user1/open_chunks") is None
+
+    def append(self, reviews):
+        self.db.update(append_updates(self.db, "user1", [(card, epoch, 4, 0) for card, epoch in reviews]))
+        return compact_recent(self.db, "user1")
+
+    def test_recent_chunks_are_merged_once_enough_are_appended(self):
+        merged = [self.append([(f"card{epoch % 3}", epoch)]) for epoch in range(COMPACT_AFTER)]
+
+        assert merged == [False] * (COMPACT_AFTER - 1) + [True]
+        assert len(self.store.read("user_review_log/user1/chunks")) == 1
+        assert self.store.read("user_review_log/user1/open_chunks") == 0
+        # The next merge adds to the chunk that still has room
+        for epoch in range(COMPACT_AFTER, 2 * COMPACT_AFTER):
+            self.append([(f"card{epoch % 3}", epoch)])
+        assert len(self.store.read("user_review_log/user1/chunks")) == 1
+        cards, records = read_log(self.db, "user1")
+        assert records["epoch"].tolist() == list(range(2 * COMPACT_AFTER))
+        reviews = len(range(0, 2 * COMPACT_AFTER, 3))
+        assert card_counts(cards, records, {"card0"}) == {"card0": (reviews, reviews)}
+
+    def test_merging_recent_chunks_reads_only_those(self):
+        for start in range(0, 3 * CHUNK_REVIEWS, 64):
+            self.db.update(append_updates(self.db, "user1", [("a", epoch, 4, 0) for epoch in range(start, start + 64)]))
+        compact_log(self.db, "user1")
+        self.store.requests.clear()
+
+        for epoch in range(3 * CHUNK_REVIEWS, 3 * CHUNK_REVIEWS + COMPACT_AFTER):
+            self.append([("b", epoch)])
+
+        reads = [path for method, path in self.store.requests if method == "get"]
+        assert reads == ["user_review_log/user1/open_chunks"] * (COMPACT_AFTER + 1) + ["user_review_log/user1/chunks"]
+        assert len(self.store.read("user_review_log/user1/chunks")) == 4
+        assert read_log(self.db, "user1")[1]["epoch"].tolist() == list(range(3 * CHUNK_REVIEWS + COMPACT_AFTER))
+
+    def test_only_one_request_merges_recent_chunks(self):
+        for epoch in range(COMPACT_AFTER):
+            self.db.update(append_updates(self.db, "user1", [("a", epoch, 4, 0)]))
+        # Another request claims the merge between this one's reads and its write
+        self.store.before_conditional_write = lambda path: self.store.write(path, 0)
+
+        assert not compact_recent(self.db, "user1")
+        assert len(self.store.read("user_review_log/user1/chunks")) == COMPACT_AFTER
+
+    def test_recent_chunks_in_the_old_form_are_left_to_compact_log(self):
+        self.store.data = {
+            "user_review_log": {
+                "user1": {"cards": {"0": "a"}, "chunks": {"-k0": pack([(0, 5, 4, 0)])}, "open_chunks": 1}
+            }
+        }
+
+        for epoch in range(COMPACT_AFTER - 1):
+            self.append([("b", epoch)])
+
+        chunks = self.store.read("user_review_log/user1/chunks")
+        assert len(chunks) == 2 and isinstance(chunks["-k0"], str)
+        cards, records = read_log(self.db, "user1")
+        assert card_histories(cards, records)["a"] == [(5, 4)]
+
+    def test_compact_rewrites_legacy_chunks(self):
+        self.store.data = {
+            "user_review_log": {
+                "user1": {
+                    "cards": {"0": "a", "1": "b"},
+                    "card_count": 2,
+                    "chunks": {"-k0": pack([(1, 5, 4, 0)]), "-k1": pack([(0, 6, 2, 0)])},
+                }
+            }
+        }
+
+        assert compact_log(self.db, "user1") == (2, 1)
+
+        log = self.store.read("user_review_log/user1")
+        assert sorted(log) == ["chunks"]
+        assert sorted(log["chunks"]["-k0"]) == ["cards", "records"]
+        cards, records = read_log(self.db, "user1")
+        assert card_histories(cards, records) == {"b": [(5, 4)], "a": [(6, 2)]}
@@ -0,0 +1,158 @@
+import json
+from unittest.mock import patch
+
+from flask import Flask
+import numpy as np
+import pytest
+
+from src.deck.routes import deck_bp
+from src.deck.simulate import (
+    DECK_READ_REQUESTS,
+    GAMIFICATION_PATHS,
+    GAMIFICATION_REQUESTS,
+    NEW_CARD_REQUESTS,
+    PATHS_PER_CORRECT,
+    PATHS_PER_REVIEW,
+    REVIEW_REQUESTS,
+    SESSION_REQUESTS,
+    format_report,
+    simulate,
+)
+from tests.fake_firebase import FakeDatabase, FakeFirebase
+
+PERFECT = (0, 0, 0, 0, 0, 1)
+BLACKOUT = (1, 0, 0, 0, 0, 0)
+
+
+class TestSimulate:
+    def test_perfect_answers(self):
+        load = simulate(1, cards=30, days=3, new_per_day=10, activity=1, quality=PERFECT)
+
+        # Day 1 repeats day 0's cards (interval 1); on day 2 they move to a 6 day interval
+        assert load.reviews.tolist() == [10, 20, 20]
+        assert load.new_cards.tolist() == [10, 10, 10]
+        assert load.sessions.tolist() == [1, 1, 1]
+        # Progress, its legacy location's deletion, the due and new index entries, the log chunk
+        # and its open chunk count, the review and correct answer counts, the XP leaderboard entry's three fields and the
+        # score and name of the three XP window counters
+        assert load.paths_written.tolist() == [170, 340, 340]
+        # 15 XP per perfect review, plus the 20% and 30% streak bonuses on days 1 and 2
+        assert load.xp.tolist() == [150, 20 * 18, 20 * 20]
+
+    def test_failed_cards_come_back_every_day(self):
+        load = simulate(1, cards=25, days=4, new_per_day=10, activity=1, quality=BLACKOUT)
+
+        assert load.reviews.tolist() == [10, 20, 25, 25]
+        assert load.new_cards.tolist() == [10, 10, 5, 0]
+
+    def test_chunks_do_not_change_totals(self):
+        single = simulate(1, cards=50, days=10, new_per_day=5, activity=1, quality=PERFECT)
+        many = simulate(25, cards=50, days=10, new_per_day=5, activity=1, quality=PERFECT, chunk_size=10)
+
+        np.testing.assert_array_equal(many.reviews, single.reviews * 25)
+        np.testing.assert_array_equal(many.xp, single.xp * 25)
+
+    def test_inactive_users(self):
+        load = simulate(100, cards=20, days=5, activity=0)
+
+        assert load.reviews.sum() == load.sessions.sum() == load.xp.sum() == 0
+
+    def test_random_population_is_reproducible(self):
+        first = simulate(500, cards=40, days=15, seed=3)
+        second = simulate(500, cards=40, days=15, seed=3)
+
+        np.testing.assert_array_equal(first.reviews, second.reviews)
+        assert (first.active_users > 250).all() and (first.active_users < 450).all()
+
+    def test_rejects_bad_quality_distribution(self):
+        with pytest.raises(ValueError):
+            simulate(1, cards=10, days=1, quality=(0.5, 0.5))
+        with pytest.raises(ValueError):
+            simulate(1, cards=10, days=1, quality=(0.5, 0.5, 0.5, 0, 0, 0))
+
+    def test_report(self):
+        report = format_report(simulate(1, cards=30, days=3, new_per_day=10, activity=1, quality=PERFECT), 1)
+
+        assert "Peak day 1: 20 reviews from 1 sessions" in report
+        assert "Average XP per review: 18.20" in report
+
+    def test_report_counts_every_request(self):
+        # Day 1 has 20 reviews, 10 of them first reviews, in one session, all within one second
+        report = format_report(simulate(1, cards=30, days=3, new_per_day=10, activity=1, quality=PERFECT), 1 / 3600)
+
+        # Per review: progress read, settings read, update, open chunk count read, and the
+        # gamification ETag read, read, write and XP index update; per first review: the legacy
+        # progress read; without deckId: the card's deck read
+        assert "170.0 with record-answer (190.0 without deckId)" in report
+        # Per session: progress read, legacy key listing, settings read, update, open chunk count
+        # read and the gamification update
+        assert "9.0 with record-answers" in report
+
+
+class TestSimulatedRequests:
+    """The simulator's request and path counts, checked against the review endpoints"""
+
+    def setup_method(self):
+        app = Flask(__name__)
+        app.register_blueprint(deck_bp)
+        self.client = app.test_client()
+        self.store = FakeFirebase(
+            {
+                "card": {"card1": {"deckId": "deck1"}, "card2": {"deckId": "deck1"}},
+                "user_gamification": {"user1": {"xp": 10, "achievements": {}, "user_email": "user1@example.com"}},
+                "xp_leaderboard": {"user1": {"xp": 10, "level": 1, "achievements_count": 0}},
+            }
+        )
+
+    def post(self, path, body):
+        """Post to a review endpoint and return (requests made, paths written)"""
+        db = self.store.database()
+        self.store.requests.clear()
+        with (
+            patch("src.deck.routes.db", db),
+            patch("src.deck.routes.gamification_queue") as queue,
+            patch.object(FakeDatabase, "update", autospec=True, side_effect=FakeDatabase.update) as update,
+        ):
+            queue.enabled = False
+            response = self.client.post(path, data=json.dumps(body), content_type="application/json")
+        assert response.status_code == 200, response.data
+        return len(self.store.requests), sum(len(call.args[1]) for call in update.call_args_list)
+
+    def answer(self, quality, **ids):
+        return self.post("/deck/user1/record-answer", {"cardId": "card1", "quality": quality, **ids})
+
+    def test_record_answer(self):
+        first = self.answer(5, deckId="deck1")
+        again = self.answer(1, deckId="deck1")
+
+        paths = PATHS_PER_REVIEW + GAMIFICATION_PATHS
+        assert first == (REVIEW_REQUESTS + NEW_CARD_REQUESTS + GAMIFICATION_REQUESTS, paths + PATHS_PER_CORRECT)
+        assert again == (REVIEW_REQUESTS + GAMIFICATION_REQUESTS, paths)
+        assert self.answer(1)[0] == REVIEW_REQUESTS + DECK_READ_REQUESTS + GAMIFICATION_REQUESTS
+
+    def test_record_answers(self):
+        reviews = [{"cardId": "card1", "quality": 5}, {"cardId": "card2", "quality": 5}]
+
+        requests, _ = self.post("/deck/user1/record-answers", {"deckId": "deck1", "reviews": reviews})
+
+        assert requests == SESSION_REQUESTS + GAMIFICATION_REQUESTS
+
+
+class TestSimulateCommand:
+    def setup_method(self):
+        app = Flask(__name__)
+        app.register_blueprint(deck_bp)
+        self.runner = app.test_cli_runner()
+
+    def test_simulate_load(self):
+        result = self.runner.invoke(args=["deck", "simulate-load", "--users", "200", "--cards", "20", "--days", "5"])
+
+        assert result.exit_code == 0, result.output
+        assert len(result.output.splitlines()) == 10
+        assert "with record-answers" in result.output
+
+    def test_bad_quality(self):
+        result = self.runner.invoke(args=["deck", "simulate-load", "--users", "1", "--quality", "1,0"])
+
+        assert result.exit_code == 2
+        assert "--quality" in result.output
@@ -0,0 +1,92 @@
+from datetime import datetime, timezone
+
+import numpy as np
+
+from src.deck.sm2 import DAY, balance_interval, fuzz_range, next_review_epoch, review, schedule, schedule_batch
+
+
+def random_cards(size, seed=0):
+    rng = np.random.default_rng(seed)
+    interval = np.round(rng.uniform(1, 400, size), 2)
+    interval[: size // 4] = rng.choice([1, 6], size // 4)
+    repetitions = rng.integers(0, 12, size)
+    ease = np.round(rng.uniform(1.3, 3.0, size), 2)
+    quality = rng.integers(0, 6, size)
+    return interval, repetitions, ease, quality
+
+
+class TestScheduler:
+    def test_first_reviews(self):
+        assert schedule(1, 0, 2.5, 5) == (1, 1, 2.6)
+        assert schedule(1, 1, 2.6, 4) == (6, 2, 2.6)
+        assert schedule(6, 2, 2.5, 3) == (15.0, 3, 2.36)
+
+    def test_failed_review_resets(self):
+        assert schedule(15.0, 3, 1.4, 2) == (1, 0, 1.3)
+
+    def test_review_progress_fields(self):
+        reviewed_at = datetime(2030, 1, 1, tzinfo=timezone.utc)
+
+        update = review({"interval": 6, "repetitions": 2, "ease_factor": 2.5}, 5, reviewed_at)
+
+        assert update["interval"] == 15.0
+        assert update["next_review"] == "2030-01-16T00:00:00+00:00"
+        assert update["last_review"] == reviewed_at.isoformat()
+        assert update["confidence"] == 5
+
+    def test_batch_matches_scalar(self):
+        interval, repetitions, ease, quality = random_cards(20000)
+        reviewed_at = 1_900_000_000
+
+        batch = schedule_batch(interval, repetitions, ease, quality, reviewed_at)
+
+        for i in range(len(interval)):
+            expected = schedule(float(interval[i]), int(repetitions[i]), float(ease[i]), int(quality[i]))
+            assert (batch[0][i], batch[1][i], batch[2][i]) == expected
+            assert batch[3][i] == next_review_epoch(reviewed_at, expected[0])
+
+    def test_batch_matches_repeated_scalar_reviews(self):
+        """Several rounds of reviews stay identical, including the rounding of grown intervals"""
+        interval, repetitions, ease, _ = random_cards(2000, seed=1)
+        qualities = np.random.default_rng(2).integers(0, 6, (10, 2000))
+        scalar = [(float(i), int(r), float(e)) for i, r, e in zip(interval, repetitions, ease)]
+
+        for round_quality in qualities:
+            interval, repetitions, ease, _ = schedule_batch(interval, repetitions, ease, round_quality, 0)
+            scalar = [schedule(*card, int(q)) for card, q in zip(scalar, round_quality)]
+
+        assert interval.tolist() == [card[0] for card in scalar]
+        assert repetitions.tolist() == [card[1] for card in scalar]
+        assert ease.tolist() == [card[2] for card in scalar]
+
+    def test_batch_per_card_review_times(self):
+        _, _, _, next_review = schedule_batch([1, 6], [0, 2], [2.5, 2.5], [5, 5], [0, DAY])
+
+        assert next_review.tolist() == [DAY, DAY + 15 * DAY]
+
+
+class TestFuzz:
+    def test_fuzz_range(self):
+        assert fuzz_range(1) is None
+        assert fuzz_range(6) == (5, 7)
+        assert fuzz_range(15.36) == (14, 16)
+        assert fuzz_range(100) == (95, 105)
+
+    def test_balance_picks_least_loaded_day(self):
+        reviewed_at = 100 * DAY + 3600
+        counts = {114: 1, 115: 3, 116: 0}
+
+        assert balance_interval(15.0, reviewed_at, lambda first, last: counts) == 16
+        assert balance_interval(15.0, reviewed_at, lambda first, last: {}) == 15
+        assert balance_interval(1, reviewed_at, None) == 1
+
+    def test_review_with_due_counts(self):
+        reviewed_at = datetime(2030, 1, 1, tzinfo=timezone.utc)
+        day = int(reviewed_at.timestamp()) // DAY
+
+        update = review(
+            {"interval": 6, "repetitions": 2, "ease_factor": 2.5}, 5, reviewed_at, lambda first, last: {day + 15: 2}
+        )
+
+        assert update["interval"] == 14
+        assert update["next_review"] == "2030-01-15T00:00:00+00:00"
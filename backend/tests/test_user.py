@@ -87,15 +87,8 @@ def client(app):
 
 def test_get_user_stats_success(client, monkeypatch):
     """Test the /user/<user_id>/stats endpoint with valid data."""
-    # Mock leaderboard data
-    mock_data = {
-        "deck1": {
-            "user123": {"correct": 5, "incorrect": 2},
-        },
-        "deck2": {
-            "user123": {"correct": 3, "incorrect": 1},
-        },
-    }
+    # Mock the running totals kept in user_leaderboard/<user>/_totals
+    mock_data = {"correct": 8, "incorrect": 3, "decks": 2}
 
     # Create a new mock database instance for this test
     mock_db = MockFirebaseDatabase()
@@ -171,3 +164,20 @@ def test_get_user_progress_no_data(client, monkeypatch):
     response_data = response.get_json()
     assert len(response_data["progress"]) == 0
     assert response_data["message"] == "User progress fetched successfully"
+
+
+def test_get_user_progress_success(client, monkeypatch):
+    """Test the /user/<user_id>/progress endpoint reads the user's scores from user_leaderboard."""
+    mock_db = MockFirebaseDatabase()
+    mock_db.data = {
+        "_totals": {"correct": 8, "incorrect": 3, "decks": 2},
+        "deck2": {"correct": 3, "incorrect": 1, "lastAttempt": "2024-01-02T12:00:00"},
+        "deck1": {"correct": 5, "incorrect": 2, "lastAttempt": "2024-01-01T12:00:00"},
+    }
+    monkeypatch.setattr("src.user.routes.db", mock_db)
+
+    response = client.get("/user/user123/progress")
+    assert response.status_code == 200
+    progress = response.get_json()["progress"]
+    assert [entry["deckId"] for entry in progress] == ["deck1", "deck2"]
+    assert progress[0]["correct"] == 5
@@ -124,7 +124,7 @@ const Dashboard = () => {
 
   const updateLastOpened = async (deckId: string) => {
     const timestamp = new Date().toISOString(); // Get the current timestamp
-    await http.patch(`/deck/updateLastOpened/${deckId}`, { lastOpened: timestamp });
+    await http.patch(`/deck/updateLastOpened/${deckId}`, { lastOpened: timestamp, localId });
     fetchDecks(); // Refetch the decks to update both 'decks' and 'recentDecks'
   };
 
@@ -78,7 +78,8 @@ const GamificationProfile = () => {
 
     const fetchLeaderboard = async () => {
       try {
-        const response = await http.get(`/gamification/leaderboard`);
+        // user_id adds the user's own rank when they are not on the first page
+        const response = await http.get(`/gamification/leaderboard`, { params: { user_id: localId } });
         if (response.data && response.data.leaderboard) {
           setLeaderboard(response.data.leaderboard);
         }
@@ -132,6 +132,8 @@ const PracticeDeck = () => {
 
       await http.post(`/deck/${localId}/record-answer`, {
         userId: localId,
+        cardId: currentCard.id,
+        deckId: id,
         front: currentCard.front,
         back: currentCard.back,
         hint: currentCard.hint,